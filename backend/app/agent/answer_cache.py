@@ -0,0 +1,200 @@
+# backend/app/agent/answer_cache.py
+# エージェントの回答キャッシュ
+# - キー: 正規化した質問 + 回答生成に使う会話履歴 + インデックスの世代番号
+#   （文書の追加・削除で世代番号が変わるので、古い回答は自動的にヒットしなくなる）
+# - 完全一致に加えて、埋め込みの類似度がしきい値以上の質問もヒットさせられる（オプション）
+# - 件数上限（LRU）と TTL で古いエントリを捨てる
+
+import hashlib
+import json
+import math
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import Callable, Dict, List, Optional, Sequence
+
+from app import config
+from app.rag.embedding_cache import normalize_query
+
+
+@dataclass
+class CachedAnswer:
+    output: str
+    steps: List[Dict]
+    references: List[Dict]
+    source: Optional[str]
+    context_key: str                       # 履歴 + 世代番号（類似検索はこれが同じものだけ対象）
+    embedding: Optional[List[float]] = None
+    created_at: float = field(default_factory=time.monotonic)
+
+
+def _cosine(a: Sequence[float], b: Sequence[float]) -> float:
+    dot = sum(x * y for x, y in zip(a, b))
+    na = math.sqrt(sum(x * x for x in a))
+    nb = math.sqrt(sum(y * y for y in b))
+    return dot / (na * nb) if na and nb else 0.0
+
+
+class AnswerCache:
+    """
+    回答キャッシュ本体。lookup() / store() はスレッドセーフ。
+    """
+
+    def __init__(
+        self,
+        max_size: int = config.ANSWER_CACHE_SIZE,
+        ttl_sec: float = config.ANSWER_CACHE_TTL_SEC,
+        similarity_threshold: float = config.ANSWER_CACHE_SIMILARITY,
+        history_turns: Optional[int] = None,
+    ):
+        self.max_size = max_size
+        self.ttl_sec = ttl_sec
+        self.similarity_threshold = similarity_threshold
+        # キーに含める直近ターン数（None なら全ターン）
+        # 回答生成のプロンプトには古いターンの要約も入るため、既定では履歴全体をキーにする
+        self.history_turns = history_turns
+        self._entries: "OrderedDict[str, CachedAnswer]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._counts = {"exact_hits": 0, "similar_hits": 0, "misses": 0}
+
+    @property
+    def similarity_enabled(self) -> bool:
+        return 0.0 < self.similarity_threshold <= 1.0
+
+    def _context_key(self, history: List[Dict[str, str]], generation: int) -> str:
+        recent = [
+            {"role": t.get("role", "user"), "content": t.get("content", "")}
+            for t in (history or [])[-(self.history_turns or 0):]
+        ]
+        payload = json.dumps({"history": recent, "generation": generation}, ensure_ascii=False)
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def _key(self, question: str, context_key: str) -> str:
+        return hashlib.sha256(f"{context_key}\n{normalize_query(question)}".encode("utf-8")).hexdigest()
+
+    def _evict_expired(self, now: float) -> None:
+        # ロックを保持した状態で呼ぶこと（OrderedDict の先頭ほど古い）
+        expired = [k for k, e in self._entries.items() if now - e.created_at > self.ttl_sec]
+        for k in expired:
+            del self._entries[k]
+
+    def lookup(
+        self,
+        question: str,
+        history: List[Dict[str, str]],
+        generation: int,
+        embed: Optional[Callable[[str], List[float]]] = None,
+    ) -> Optional[Dict]:
+        """
+        キャッシュを検索する。ヒットした場合は {"entry": CachedAnswer, "match": "exact" | "similar", "similarity": float}。
+        embed を渡し、類似マッチが有効な場合は埋め込みの類似度でも検索する。
+        """
+        context_key = self._context_key(history, generation)
+        key = self._key(question, context_key)
+        now = time.monotonic()
+
+        with self._lock:
+            self._evict_expired(now)
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                self._counts["exact_hits"] += 1
+                return {"entry": entry, "match": "exact", "similarity": 1.0}
+            candidates = [
+                (k, e) for k, e in self._entries.items()
+                if e.context_key == context_key and e.embedding is not None
+            ]
+
+        if self.similarity_enabled and embed is not None and candidates:
+            try:
+                vector = embed(question)
+            except Exception as e:
+                print(f"警告: [AnswerCache] 類似検索用の埋め込み取得に失敗しました: {e}")
+                vector = None
+            if vector is not None:
+                best_key, best_entry, best_sim = None, None, 0.0
+                for k, e in candidates:
+                    sim = _cosine(vector, e.embedding)
+                    if sim > best_sim:
+                        best_key, best_entry, best_sim = k, e, sim
+                if best_entry is not None and best_sim >= self.similarity_threshold:
+                    with self._lock:
+                        if best_key in self._entries:
+                            self._entries.move_to_end(best_key)
+                        self._counts["similar_hits"] += 1
+                    return {"entry": best_entry, "match": "similar", "similarity": best_sim}
+
+        with self._lock:
+            self._counts["misses"] += 1
+        return None
+
+    def store(
+        self,
+        question: str,
+        history: List[Dict[str, str]],
+        generation: int,
+        result: Dict,
+        embed: Optional[Callable[[str], List[float]]] = None,
+    ) -> None:
+        """
+        エージェントの実行結果をキャッシュに保存する。
+        """
+        context_key = self._context_key(history, generation)
+        embedding = None
+        if self.similarity_enabled and embed is not None:
+            try:
+                embedding = embed(question)
+            except Exception as e:
+                print(f"警告: [AnswerCache] 埋め込み取得に失敗しました（完全一致のみで保存します）: {e}")
+
+        entry = CachedAnswer(
+            output=result.get("output", ""),
+            steps=[_dump(s) for s in result.get("steps", [])],
+            references=[_dump(r) for r in result.get("references", [])],
+            source=result.get("source"),
+            context_key=context_key,
+            embedding=embedding,
+        )
+        key = self._key(question, context_key)
+        with self._lock:
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def stats(self) -> Dict:
+        with self._lock:
+            counts = dict(self._counts)
+            size = len(self._entries)
+        total = sum(counts.values())
+        hits = counts["exact_hits"] + counts["similar_hits"]
+        return {
+            **counts,
+            "size": size,
+            "hit_rate": (hits / total) if total else 0.0,
+            "similarity_threshold": self.similarity_threshold if self.similarity_enabled else None,
+        }
+
+
+def _dump(item) -> Dict:
+    return item.model_dump() if hasattr(item, "model_dump") else dict(item)
+
+
+def is_cacheable(result: Dict) -> bool:
+    """
+    キャッシュしてよい実行結果かどうか。
+    - 回答生成に失敗した結果は保存しない
+    - RAG 検索に失敗して一般知識で答えた結果は保存しない（検索が復旧したら検索し直す）
+    - Web検索を使った回答は時事性が高いため保存しない
+    """
+    return (
+        bool(result.get("output"))
+        and not result.get("error")
+        and not result.get("rag_error")
+        and not result.get("web_search_result")
+    )
+
+
+# シングルトンとして保持
+answer_cache = AnswerCache()
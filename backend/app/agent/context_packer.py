@@ -0,0 +1,260 @@
+# backend/app/agent/context_packer.py
+# 回答生成に渡す手元文書の抜粋（RAG コンテキスト）の組み立て
+# - 同じ文書で隣り合うチャンク（chunk_index が連続）は1つの抜粋につなぎ、重なっている部分は除く
+# - ほぼ同じ内容の抜粋（文字 3-gram の Jaccard 係数がしきい値以上）は、順位の高い方だけを残す
+# - 検索順位の高い抜粋から、トークン数の上限に入るだけ詰める（上位3件で打ち切らない）
+# - 上限に余りがあれば、位置の分かる抜粋を文書ストアの全文から前後に広げる（順位の高い順）
+
+from dataclasses import dataclass, field
+from typing import Callable, Dict, List, Optional, Set, Tuple
+
+from app import config
+from app.rag.ingest_pipeline import estimate_tokens
+from app.rag.lexical_index import char_ngrams
+
+# 位置の記録がない古いチャンク（重なりあり）で、つなぎ目の重なりを探す最大文字数
+MAX_OVERLAP_CHARS = 300
+
+# 1件分の見出し（タイトル・スコアなど）のトークン数の見積もり
+HEADER_TOKENS = 30
+
+# 上限に入りきらない抜粋を途中で切って入れる場合の最小トークン数（これより小さければ入れない）
+MIN_TRUNCATED_TOKENS = 100
+
+
+@dataclass
+class Passage:
+    document_id: Optional[str]
+    document_title: str
+    text: str
+    score: Optional[float]
+    rank: int                                   # 検索結果での最上位の順位（0 始まり）
+    chunk_ids: List[str] = field(default_factory=list)
+    articles: List[str] = field(default_factory=list)
+    chunk_index: Optional[int] = None           # 最後につないだチャンクの番号
+    char_start: Optional[int] = None            # 最初のチャンクの開始位置
+    char_end: Optional[int] = None              # 最後につないだチャンクの終了位置
+    truncated: bool = False
+
+    @property
+    def tokens(self) -> int:
+        return estimate_tokens(self.text) + HEADER_TOKENS
+
+
+def _join(prev_text: str, prev_end: Optional[int], hit: Dict) -> str:
+    """
+    前の抜粋の末尾に次のチャンクをつないだテキストを返す（重なっている部分は1回だけにする）。
+    """
+    text = hit.get("snippet") or ""
+    start = hit.get("char_start")
+    if prev_end is not None and start is not None:
+        if start >= prev_end:
+            # 間に空白・改行があった場合（チャンクは前後の空白を除いて保存している）は改行でつなぐ
+            return prev_text + ("\n" if start > prev_end else "") + text
+        return prev_text + text[min(prev_end - start, len(text)):]
+    # 位置の記録がなければ、末尾と先頭で一致する最長の文字列を重なりとみなす
+    for n in range(min(len(prev_text), len(text), MAX_OVERLAP_CHARS), 0, -1):
+        if prev_text.endswith(text[:n]):
+            return prev_text + text[n:]
+    return prev_text + "\n" + text
+
+
+def _is_next(passage: Passage, hit: Dict) -> bool:
+    index = hit.get("chunk_index")
+    return (
+        hit.get("document_id") is not None
+        and hit.get("document_id") == passage.document_id
+        and index is not None
+        and passage.chunk_index is not None
+        and index == passage.chunk_index + 1
+    )
+
+
+def merge_adjacent(hits: List[Dict]) -> List[Passage]:
+    """
+    同じ文書で chunk_index が連続するヒットを1つの抜粋にまとめる（順位の高い順に返す）。
+    """
+    ranked = [(rank, hit) for rank, hit in enumerate(hits)]
+    # 文書ごと・チャンク番号順に並べてからつなぐ（番号のないヒットはそのまま1件の抜粋にする）
+    ranked.sort(key=lambda item: (
+        str(item[1].get("document_id")),
+        item[1].get("chunk_index") if item[1].get("chunk_index") is not None else -1,
+        item[0],
+    ))
+
+    passages: List[Passage] = []
+    seen: Set[str] = set()
+    for rank, hit in ranked:
+        chunk_id = hit.get("chunk_id")
+        if chunk_id and chunk_id in seen:
+            continue
+        if chunk_id:
+            seen.add(chunk_id)
+        article = hit.get("article")
+        last = passages[-1] if passages else None
+        if last is not None and _is_next(last, hit):
+            last.text = _join(last.text, last.char_end, hit)
+            last.rank = min(last.rank, rank)
+            if hit.get("score") is not None:
+                last.score = max(last.score or 0.0, hit["score"])
+            if chunk_id:
+                last.chunk_ids.append(chunk_id)
+            last.chunk_index = hit.get("chunk_index")
+            last.char_end = hit.get("char_end")
+            if article and article not in last.articles:
+                last.articles.append(article)
+            continue
+        passages.append(Passage(
+            document_id=hit.get("document_id"),
+            document_title=hit.get("document_title") or "（タイトル不明）",
+            text=hit.get("snippet") or hit.get("content") or "",
+            score=hit.get("score"),
+            rank=rank,
+            chunk_ids=[chunk_id] if chunk_id else [],
+            articles=[article] if article else [],
+            chunk_index=hit.get("chunk_index"),
+            char_start=hit.get("char_start"),
+            char_end=hit.get("char_end"),
+        ))
+
+    passages.sort(key=lambda p: p.rank)
+    return passages
+
+
+def _similarity(a: Set[str], b: Set[str]) -> float:
+    if not a or not b:
+        return 0.0
+    return len(a & b) / len(a | b)
+
+
+def drop_near_duplicates(passages: List[Passage], threshold: float) -> List[Passage]:
+    """
+    ほぼ同じ内容の抜粋を除く（順位の高い方を残す。他の抜粋に丸ごと含まれるものも除く）。
+    """
+    kept: List[Passage] = []
+    kept_grams: List[Set[str]] = []
+    for passage in passages:
+        text = passage.text.strip()
+        if not text:
+            continue
+        grams = set(char_ngrams(text, sizes=(3,)))
+        if any(
+            text in other.text or _similarity(grams, other_grams) >= threshold
+            for other, other_grams in zip(kept, kept_grams)
+        ):
+            continue
+        kept.append(passage)
+        kept_grams.append(grams)
+    return kept
+
+
+def truncate_to_tokens(text: str, max_tokens: int) -> str:
+    """
+    トークン数の上限に収まるよう、文末（。）を優先して末尾を切る。
+    """
+    max_tokens -= 1  # 末尾に付ける "…" の分
+    lo, hi = 0, len(text)
+    while lo < hi:
+        mid = (lo + hi + 1) // 2
+        if estimate_tokens(text[:mid]) <= max_tokens:
+            lo = mid
+        else:
+            hi = mid - 1
+    cut = text[:lo]
+    sentence_end = cut.rfind("。")
+    if sentence_end >= len(cut) // 2:
+        cut = cut[:sentence_end + 1]
+    return cut + "…"
+
+
+def _overlaps(span: Tuple[str, int, int], spans: List[Tuple[str, int, int]]) -> bool:
+    return any(
+        span[0] == other[0] and span[1] < other[2] and other[1] < span[2]
+        for other in spans
+    )
+
+
+def widen_passages(
+    passages: List[Passage],
+    widen: Callable[..., Dict],
+    chars: int,
+    remaining: int,
+) -> int:
+    """
+    トークン数の余り（remaining）の範囲で、抜粋を前後 chars 文字ずつ広げる（順位の高い順）。
+    広げると同じ文書の他の抜粋と重なる場合は広げない。
+    :param widen: RAGRetriever.widen（ヒットの位置から前後を含めた抜粋を返す）
+    :return: 広げたあとの余りのトークン数
+    """
+    spans: List[Optional[Tuple[str, int, int]]] = [
+        (p.document_id, p.char_start, p.char_end)
+        if p.document_id is not None and p.char_start is not None and p.char_end is not None else None
+        for p in passages
+    ]
+    for i, passage in enumerate(passages):
+        if passage.truncated or spans[i] is None:
+            continue
+        hit = widen(
+            {
+                "document_id": passage.document_id,
+                "char_start": passage.char_start,
+                "char_end": passage.char_end,
+                "snippet": passage.text,
+            },
+            before=chars,
+            after=chars,
+        )
+        text = hit.get("snippet") or ""
+        start, end = hit.get("char_start"), hit.get("char_end")
+        if text == passage.text or start is None or end is None:
+            continue
+        span = (passage.document_id, start, end)
+        extra = estimate_tokens(text) - estimate_tokens(passage.text)
+        if extra > remaining or _overlaps(span, [s for j, s in enumerate(spans) if j != i and s is not None]):
+            continue
+        spans[i] = span
+        passage.text, passage.char_start, passage.char_end = text, start, end
+        remaining -= extra
+    return remaining
+
+
+def pack_context(
+    hits: List[Dict],
+    max_tokens: Optional[int] = None,
+    dedup_threshold: Optional[float] = None,
+    widen: Optional[Callable[..., Dict]] = None,
+    widen_chars: Optional[int] = None,
+) -> List[Passage]:
+    """
+    検索結果から、トークン数の上限に収まる抜粋のリストを作る（順位の高い順）。
+    :param widen: 渡した場合、上限に余りがあれば抜粋を前後 widen_chars 文字ずつ広げる
+                  （既定は config.RAG_CONTEXT_WIDEN_CHARS）
+    """
+    max_tokens = config.RAG_CONTEXT_MAX_TOKENS if max_tokens is None else max_tokens
+    threshold = config.RAG_CONTEXT_DEDUP_THRESHOLD if dedup_threshold is None else dedup_threshold
+    widen_chars = config.RAG_CONTEXT_WIDEN_CHARS if widen_chars is None else widen_chars
+
+    passages = drop_near_duplicates(merge_adjacent(hits), threshold)
+
+    packed: List[Passage] = []
+    remaining = max_tokens
+    for passage in passages:
+        if passage.tokens <= remaining:
+            packed.append(passage)
+            remaining -= passage.tokens
+        elif not packed and remaining - HEADER_TOKENS >= MIN_TRUNCATED_TOKENS:
+            # 最上位の抜粋が1件だけで上限を超える場合は、入るところまで切って入れる
+            passage.text = truncate_to_tokens(passage.text, remaining - HEADER_TOKENS)
+            passage.truncated = True
+            packed.append(passage)
+            remaining -= passage.tokens
+        # 入らない抜粋は飛ばし、後ろの短い抜粋が入るか試す
+
+    if widen is not None and widen_chars > 0 and remaining > 0:
+        remaining = widen_passages(packed, widen, widen_chars, remaining)
+
+    print(
+        f"[ContextPacker] hits={len(hits)}, passages={len(passages)}, packed={len(packed)}, "
+        f"tokens={max_tokens - remaining}/{max_tokens}"
+    )
+    return packed
@@ -1,5 +1,7 @@
 # LangGraph でノードをつなぎ、エージェントを構築する
 
+from typing import List
+
 from langgraph.graph import StateGraph, END
 from app.agent.types import AgentState
 from app.agent.nodes import (
@@ -7,23 +9,49 @@ from app.agent.nodes import (
     run_rag_if_needed,
     run_web_search_if_needed,
     generate_answer,
+    aanalyze_intent,
+    arun_rag_if_needed,
+    arun_web_search_if_needed,
+    agenerate_answer,
+    plan_route,
 )
 
 
+def route_after_analysis(state: AgentState) -> List[str]:
+    """
+    analysis の後に実行するノードを返す（条件付きエッジ）。
+    rag と web_search の両方が必要な場合は並列に実行される。
+    """
+    return plan_route(state.intent, state.input)
+
 
-def create_agent_graph():
+def create_agent_graph(use_async: bool = False):
+    """
+    エージェントのグラフを構築する。
+    :param use_async: True の場合は非同期ノードで構築する（ainvoke / astream で実行する）
+    """
     workflow = StateGraph(AgentState)
 
-    workflow.add_node("analysis", analyze_intent)
-    workflow.add_node("rag", run_rag_if_needed)
-    workflow.add_node("web_search", run_web_search_if_needed)
-    workflow.add_node("answer", generate_answer)
+    if use_async:
+        workflow.add_node("analysis", aanalyze_intent)
+        workflow.add_node("rag", arun_rag_if_needed)
+        workflow.add_node("web_search", arun_web_search_if_needed)
+        workflow.add_node("answer", agenerate_answer)
+    else:
+        workflow.add_node("analysis", analyze_intent)
+        workflow.add_node("rag", run_rag_if_needed)
+        workflow.add_node("web_search", run_web_search_if_needed)
+        workflow.add_node("answer", generate_answer)
 
     workflow.set_entry_point("analysis")
 
-    # analysis → rag → web_search → answer → END
-    workflow.add_edge("analysis", "rag")
-    workflow.add_edge("rag", "web_search")
+    # analysis → (rag / web_search を必要なものだけ並列に) → answer → END
+    workflow.add_conditional_edges(
+        "analysis",
+        route_after_analysis,
+        ["rag", "web_search", "answer"],
+    )
+    workflow.add_edge("rag", "answer")
     workflow.add_edge("web_search", "answer")
     workflow.add_edge("answer", END)
 
@@ -32,3 +60,6 @@ def create_agent_graph():
 
 # シングルトンとして保持
 agent_executor = create_agent_graph()
+
+# API から使う非同期版（イベントループをブロックしない）
+async_agent_executor = create_agent_graph(use_async=True)
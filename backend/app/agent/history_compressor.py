@@ -0,0 +1,299 @@
+# backend/app/agent/history_compressor.py
+# 回答生成のプロンプトに入れる会話履歴の圧縮
+# - 直近のターンはトークン数の上限まで原文のまま残す
+# - それより古いターンは、方針（config.HISTORY_POLICY）に応じて
+#   "truncate": 捨てる / "summary": 要約にまとめる / "retrieval": 質問に関連するターンだけを選んで残す
+# - 要約はそれまでの要約に新しいターンを足して作り直す（差分だけを LLM に渡す）
+#   会話の先頭からのターンのハッシュをキーにキャッシュし、回答を待たせないよう裏で更新する
+#   （更新が間に合わない間は、まだ要約に入っていないターンを原文のまま少し多めに残す）
+# 会話が長くなっても、プロンプトに入る履歴は「要約 + 直近のターン」の大きさで頭打ちになる
+
+import hashlib
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from langchain_openai import ChatOpenAI
+
+from app import config
+from app.agent.context_packer import truncate_to_tokens
+from app.rag.ingest_pipeline import estimate_tokens
+from app.rag.lexical_index import char_ngrams
+from app.services.blocking_pool import submit_blocking
+
+HISTORY_POLICIES = ("truncate", "summary", "retrieval")
+
+ROLE_LABELS = {"user": "ユーザー", "assistant": "アシスタント"}
+
+SUMMARY_INSTRUCTION = (
+    "あなたは会話の要約係です。これまでの要約と、その後に続く会話を読み、"
+    "全体を1つの要約にまとめ直してください。\n"
+    "- 話題になった文書・条項・固有名詞・数値・ユーザーの前提条件や希望は省略しない\n"
+    "- アシスタントが示した結論は簡潔に残す\n"
+    "- 箇条書きで、{max_tokens}トークン程度に収める\n"
+    "- 要約以外の文は書かない"
+)
+
+
+def _turn_text(turn: Dict[str, str]) -> str:
+    role = turn.get("role", "user")
+    return f"{ROLE_LABELS.get(role, role)}: {turn.get('content', '')}"
+
+
+def _turn_tokens(turn: Dict[str, str]) -> int:
+    return estimate_tokens(_turn_text(turn))
+
+
+def prefix_keys(history: Sequence[Dict[str, str]]) -> List[str]:
+    """
+    会話の先頭から i ターン目までを表すキーのリスト（keys[i] は history[:i + 1] のキー）。
+    同じ会話が続く限り、既存のキーは変わらない。
+    """
+    keys: List[str] = []
+    digest = ""
+    for turn in history:
+        payload = f"{digest}\n{turn.get('role', 'user')}\n{turn.get('content', '')}"
+        digest = hashlib.sha256(payload.encode("utf-8")).hexdigest()
+        keys.append(digest)
+    return keys
+
+
+@dataclass
+class CompressedHistory:
+    policy: str
+    recent: List[Dict[str, str]] = field(default_factory=list)    # 原文のまま残す直近のターン
+    summary: Optional[str] = None                                   # 古いターンの要約（summary）
+    recalled: List[Dict[str, str]] = field(default_factory=list)  # 質問に関連する古いターン（retrieval）
+    omitted: int = 0                                                # プロンプトに入れなかったターン数
+
+    @property
+    def tokens(self) -> int:
+        return (
+            sum(_turn_tokens(t) for t in self.recent + self.recalled)
+            + (estimate_tokens(self.summary) if self.summary else 0)
+        )
+
+    def format(self) -> str:
+        if not self.recent and not self.summary and not self.recalled:
+            return "（このセッションの会話履歴は使用していません）"
+        sections = []
+        if self.summary:
+            sections.append(f"［これまでの会話の要約］\n{self.summary}")
+        if self.recalled:
+            sections.append("［質問に関連する過去のやり取り］\n" + "\n".join(_turn_text(t) for t in self.recalled))
+        if self.recent:
+            label = "［直近の会話］\n" if self.summary or self.recalled else ""
+            sections.append(label + "\n".join(_turn_text(t) for t in self.recent))
+        if self.omitted:
+            sections.append(f"（これより前の {self.omitted} 件のやり取りは省略しています）")
+        return "\n\n".join(sections)
+
+
+class HistorySummarizer:
+    """
+    会話の先頭からの要約を、先頭からのターンのキーごとに保持する（LRU）。
+    fold() は、キャッシュにある最も長い要約に続きのターンだけを足して要約し直す。
+    """
+
+    def __init__(
+        self,
+        max_size: int = config.HISTORY_SUMMARY_CACHE_SIZE,
+        max_tokens: int = config.HISTORY_SUMMARY_MAX_TOKENS,
+    ):
+        self.max_size = max_size
+        self.max_tokens = max_tokens
+        self._summaries: "OrderedDict[str, Tuple[str, int]]" = OrderedDict()  # キー → (要約, ターン数)
+        self._inflight: Dict[str, Future] = {}
+        self._lock = threading.Lock()
+        self._llm: Optional[ChatOpenAI] = None
+
+    def lookup(self, history: Sequence[Dict[str, str]]) -> Tuple[Optional[str], int]:
+        """
+        history の先頭部分について、キャッシュにある最も長い要約を返す。
+        :return: (要約, 要約に含まれるターン数)。なければ (None, 0)
+        """
+        keys = prefix_keys(history)
+        with self._lock:
+            for key in reversed(keys):
+                found = self._summaries.get(key)
+                if found is not None:
+                    self._summaries.move_to_end(key)
+                    return found
+        return None, 0
+
+    def put(self, history: Sequence[Dict[str, str]], summary: str) -> None:
+        if not history:
+            return
+        key = prefix_keys(history)[-1]
+        with self._lock:
+            self._summaries[key] = (summary, len(history))
+            self._summaries.move_to_end(key)
+            while len(self._summaries) > self.max_size:
+                self._summaries.popitem(last=False)
+
+    def _chat(self) -> ChatOpenAI:
+        if self._llm is None:
+            self._llm = ChatOpenAI(model=config.LLM_MODEL, api_key=config.OPENAI_API_KEY)
+        return self._llm
+
+    def fold(self, history: Sequence[Dict[str, str]]) -> Optional[str]:
+        """
+        history 全体の要約を作ってキャッシュし、返す（LLM を呼ぶブロッキング処理）。
+        """
+        previous, covered = self.lookup(history)
+        if covered >= len(history):
+            return previous
+        new_turns = "\n".join(_turn_text(t) for t in history[covered:])
+        prompt = (
+            f"{SUMMARY_INSTRUCTION.format(max_tokens=self.max_tokens)}\n\n"
+            f"これまでの要約:\n---\n{previous or '（なし）'}\n---\n\n"
+            f"その後の会話:\n---\n{new_turns}\n---"
+        )
+        summary = self._chat().invoke(prompt).content.strip()
+        # 指示より長い要約が返ってきても、プロンプトが膨らまないよう上限で切る
+        if estimate_tokens(summary) > self.max_tokens:
+            summary = truncate_to_tokens(summary, self.max_tokens)
+        self.put(history, summary)
+        print(
+            f"[HistorySummarizer] folded turns {covered}..{len(history)} "
+            f"(summary_tokens={estimate_tokens(summary)})"
+        )
+        return summary
+
+    def schedule(self, history: Sequence[Dict[str, str]]) -> Optional[Future]:
+        """
+        history 全体の要約を裏で作る（同じ会話の要約がすでに作成中なら何もしない）。
+        """
+        if not history:
+            return None
+        key = prefix_keys(history)[-1]
+        with self._lock:
+            if key in self._summaries:
+                return None
+            future = self._inflight.get(key)
+            if future is not None:
+                return future
+            history = list(history)
+            future = submit_blocking(self._fold_in_background, key, history)
+            self._inflight[key] = future
+        return future
+
+    def _fold_in_background(self, key: str, history: List[Dict[str, str]]) -> Optional[str]:
+        try:
+            return self.fold(history)
+        except Exception as e:
+            # 要約に失敗しても回答は続けられる（古いターンを省略するだけ）
+            print(f"警告: [HistorySummarizer] 会話履歴の要約に失敗しました: {e}")
+            return None
+        finally:
+            with self._lock:
+                self._inflight.pop(key, None)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._summaries.clear()
+
+
+# プロセス全体で共有する要約キャッシュ
+history_summarizer = HistorySummarizer()
+
+
+def _split_recent(history: Sequence[Dict[str, str]], budget: int, keep_last: bool = True) -> int:
+    """
+    末尾から budget トークンに入るだけのターンを数える。
+    :param keep_last: True なら最後のターンは入りきらなくても必ず残す
+    :return: 直近として残すターンの開始位置
+    """
+    used = 0
+    start = len(history)
+    for i in range(len(history) - 1, -1, -1):
+        tokens = _turn_tokens(history[i])
+        if used + tokens > budget and (start < len(history) or not keep_last):
+            break
+        used += tokens
+        start = i
+    return start
+
+
+def _fit_last(recent: List[Dict[str, str]], budget: int) -> List[Dict[str, str]]:
+    # 1ターンだけで上限を超える場合は、そのターンの本文を上限で切る
+    if len(recent) == 1 and _turn_tokens(recent[0]) > budget:
+        turn = recent[0]
+        return [{**turn, "content": truncate_to_tokens(turn.get("content", ""), max(budget, 1))}]
+    return recent
+
+
+def _recall(older: Sequence[Dict[str, str]], question: str, budget: int) -> List[Dict[str, str]]:
+    """
+    古いターンから、質問と文字 n-gram の重なりが大きいものを budget トークンまで選ぶ（時系列順に返す）。
+    """
+    query = set(char_ngrams(question))
+    if not query:
+        return []
+    scored = []
+    for i, turn in enumerate(older):
+        grams = set(char_ngrams(turn.get("content", "")))
+        overlap = len(query & grams) / len(query)
+        if overlap > 0:
+            scored.append((overlap, i))
+    scored.sort(key=lambda item: (-item[0], -item[1]))
+
+    chosen: List[int] = []
+    used = 0
+    for _, i in scored:
+        tokens = _turn_tokens(older[i])
+        if used + tokens > budget:
+            continue
+        chosen.append(i)
+        used += tokens
+    return [older[i] for i in sorted(chosen)]
+
+
+def compress_history(
+    history: Sequence[Dict[str, str]],
+    question: str = "",
+    policy: Optional[str] = None,
+    summarizer: Optional[HistorySummarizer] = None,
+) -> CompressedHistory:
+    """
+    会話履歴を、プロンプトに入れる形（要約・関連する古いターン・直近のターン）に圧縮する。
+    summary 方針では LLM を待たない（キャッシュ済みの要約を使い、続きの要約は裏で作る）。
+    """
+    policy = policy or config.HISTORY_POLICY
+    if policy not in HISTORY_POLICIES:
+        raise ValueError(f"未対応の履歴圧縮方針です: {policy}（{' / '.join(HISTORY_POLICIES)} のいずれか）")
+    history = [t for t in (history or []) if t.get("content")]
+    if not history:
+        return CompressedHistory(policy=policy)
+
+    budget = config.HISTORY_RECENT_TOKENS
+    start = _split_recent(history, budget)
+    recent = _fit_last(list(history[start:]), budget)
+    older = history[:start]
+    result = CompressedHistory(policy=policy, recent=recent)
+
+    if policy == "truncate" or not older:
+        result.omitted = len(older)
+    elif policy == "retrieval":
+        result.recalled = _recall(older, question, config.HISTORY_RETRIEVAL_TOKENS)
+        result.omitted = len(older) - len(result.recalled)
+    else:
+        summarizer = summarizer or history_summarizer
+        summary, covered = summarizer.lookup(older)
+        # まだ要約に入っていないターンは、余裕分（HISTORY_SUMMARY_PENDING_TOKENS）まで原文で残す
+        pending = older[covered:]
+        keep_from = _split_recent(pending, config.HISTORY_SUMMARY_PENDING_TOKENS, keep_last=False)
+        result.summary = summary
+        result.recent = list(pending[keep_from:]) + result.recent
+        result.omitted = keep_from
+        if pending:
+            summarizer.schedule(older)
+
+    print(
+        f"[HistoryCompressor] policy={policy}, turns={len(history)}, recent={len(result.recent)}, "
+        f"summary={'yes' if result.summary else 'no'}, recalled={len(result.recalled)}, "
+        f"omitted={result.omitted}, tokens={result.tokens}"
+    )
+    return result
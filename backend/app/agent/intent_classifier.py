@@ -0,0 +1,340 @@
+# backend/app/agent/intent_classifier.py
+# 質問意図（doc_dependent / general）のローカル高速分類器
+# - ルール（条文番号・契約書特有の語など）で確実なものを判定
+# - 文字 n-gram 特徴 × ロジスティック回帰（純 Python）で確信度の高いものを判定
+# - どちらでも決まらない曖昧なものだけ LLM にエスカレーションする
+# - 判定結果は正規化した入力ごとにキャッシュする
+#
+# 学習・評価（LLM の判定ログから）:
+#   python -m app.agent.intent_classifier train
+#   python -m app.agent.intent_classifier eval
+
+import argparse
+import json
+import math
+import random
+import re
+import threading
+import zlib
+from collections import OrderedDict
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+from app import config
+from app.rag.embedding_cache import normalize_query
+from app.services.blocking_pool import submit_blocking
+
+
+DOC_DEPENDENT = "doc_dependent"
+GENERAL = "general"
+
+# 特徴ベクトルの次元（ハッシュトリック）
+N_FEATURES = 1 << 18
+
+# 文書依存であることがほぼ確実な表現
+# （入力は normalize_query で NFKC 正規化・小文字化済み）
+DOC_RULES = [
+    # 「民法第5条」「労働基準法 第32条」「民法の第5条」のような法令の条文は除く
+    # （直前が 法・令・則 の場合は、間に空白や「の」があってもルールでは判定せずモデル / LLM に任せる）
+    (
+        re.compile(r"(?:^|[^法令則\sの])[\sの]*第\s*[0-9一二三四五六七八九十百]+\s*条"),
+        "条文番号への言及",
+    ),
+    (re.compile(r"この契約|本契約|当該契約|以下の文書|この文書|添付の|アップロードした"), "手元文書を指す表現"),
+    # 「甲状腺」「乙女座」などを拾わないよう、当事者としての使い方（甲は・乙に対し・甲乙 など）に限る
+    (
+        re.compile(r"甲乙|[甲乙](?:は|が|及び|および|と|に対し|に|の|を|又は|または|から|へ)"),
+        "契約当事者（甲・乙）への言及",
+    ),
+]
+
+# 一般的な質問であることがほぼ確実な表現（挨拶・雑談など）
+GENERAL_RULES = [
+    (re.compile(r"^(こんにちは|こんばんは|おはよう|ありがとう|はじめまして|hello|hi)[!！。、\s]*$"), "挨拶"),
+]
+
+
+def _ngrams(text: str) -> List[str]:
+    """
+    文字 1〜3-gram を列挙する（日本語は単語区切りがないため文字単位で扱う）。
+    """
+    padded = f"^{text}$"
+    grams = []
+    for n in (1, 2, 3):
+        grams.extend(padded[i:i + n] for i in range(len(padded) - n + 1))
+    return grams
+
+
+def featurize(text: str) -> Dict[int, float]:
+    """
+    正規化済みテキストをハッシュした n-gram の出現回数ベクトル（疎）に変換する。
+    """
+    features: Dict[int, float] = {}
+    for gram in _ngrams(text):
+        idx = zlib.crc32(gram.encode("utf-8")) % N_FEATURES
+        features[idx] = features.get(idx, 0.0) + 1.0
+    # 長い文ほど重みが大きくならないよう L2 正規化する
+    norm = math.sqrt(sum(v * v for v in features.values())) or 1.0
+    return {k: v / norm for k, v in features.items()}
+
+
+def _sigmoid(x: float) -> float:
+    if x < -30:
+        return 0.0
+    if x > 30:
+        return 1.0
+    return 1.0 / (1.0 + math.exp(-x))
+
+
+class NgramLogisticModel:
+    """
+    文字 n-gram のロジスティック回帰。P(doc_dependent | text) を返す。
+    """
+
+    def __init__(self, weights: Optional[Dict[int, float]] = None, bias: float = 0.0):
+        self.weights: Dict[int, float] = weights or {}
+        self.bias = bias
+
+    def predict_proba(self, text: str) -> float:
+        features = featurize(text)
+        score = self.bias + sum(self.weights.get(k, 0.0) * v for k, v in features.items())
+        return _sigmoid(score)
+
+    def fit(
+        self,
+        samples: List[Tuple[str, str]],
+        epochs: int = 20,
+        lr: float = 0.5,
+        l2: float = 1e-4,
+        seed: int = 0,
+    ) -> None:
+        """
+        SGD で学習する。samples は [(正規化済みテキスト, ラベル), ...]。
+        """
+        data = [(featurize(text), 1.0 if label == DOC_DEPENDENT else 0.0) for text, label in samples]
+        rng = random.Random(seed)
+        for _ in range(epochs):
+            rng.shuffle(data)
+            for features, y in data:
+                score = self.bias + sum(self.weights.get(k, 0.0) * v for k, v in features.items())
+                grad = _sigmoid(score) - y
+                self.bias -= lr * grad
+                for k, v in features.items():
+                    w = self.weights.get(k, 0.0)
+                    self.weights[k] = w - lr * (grad * v + l2 * w)
+        # ほぼ 0 の重みは保存サイズ削減のため落とす
+        self.weights = {k: w for k, w in self.weights.items() if abs(w) > 1e-6}
+
+    def save(self, path: Path) -> None:
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_text(
+            json.dumps({"bias": self.bias, "weights": self.weights}),
+            encoding="utf-8",
+        )
+
+    @classmethod
+    def load(cls, path: Path) -> Optional["NgramLogisticModel"]:
+        if not path.exists():
+            return None
+        data = json.loads(path.read_text(encoding="utf-8"))
+        weights = {int(k): float(v) for k, v in data.get("weights", {}).items()}
+        return cls(weights=weights, bias=float(data.get("bias", 0.0)))
+
+
+class TieredIntentClassifier:
+    """
+    ルール → ローカルモデル → LLM の段階的な意図分類器。
+    classify_local() で決まらなかった（None を返した）場合だけ LLM を呼び出し、
+    その結果を record_llm_decision() で記録する（キャッシュ＋学習用ログ）。
+    """
+
+    def __init__(
+        self,
+        model: Optional[NgramLogisticModel] = None,
+        threshold: float = config.INTENT_LOCAL_THRESHOLD,
+        cache_size: int = config.INTENT_CACHE_SIZE,
+        log_path: Optional[Path] = config.INTENT_LOG_PATH,
+    ):
+        self.model = model
+        self.threshold = threshold
+        self.cache_size = cache_size
+        self.log_path = log_path
+        self._cache: "OrderedDict[str, Tuple[str, str]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._counts = {"cache": 0, "rule": 0, "model": 0, "llm": 0}
+
+    def _remember(self, key: str, decision: Tuple[str, str]) -> None:
+        with self._lock:
+            self._cache[key] = decision
+            self._cache.move_to_end(key)
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+
+    def _count(self, tier: str) -> None:
+        with self._lock:
+            self._counts[tier] += 1
+
+    def classify_local(self, text: str) -> Optional[Tuple[str, str]]:
+        """
+        ローカルで判定できれば (intent, reason) を返し、曖昧なら None を返す。
+        """
+        key = normalize_query(text)
+
+        with self._lock:
+            cached = self._cache.get(key)
+            if cached is not None:
+                self._cache.move_to_end(key)
+                self._counts["cache"] += 1
+                return cached
+
+        for pattern, label in DOC_RULES:
+            if pattern.search(key):
+                decision = (DOC_DEPENDENT, f"ルール判定: {label}があるため文書依存と判断しました。")
+                self._count("rule")
+                self._remember(key, decision)
+                return decision
+        for pattern, label in GENERAL_RULES:
+            if pattern.search(key):
+                decision = (GENERAL, f"ルール判定: {label}のため一般的な質問と判断しました。")
+                self._count("rule")
+                self._remember(key, decision)
+                return decision
+
+        if self.model is not None:
+            p = self.model.predict_proba(key)
+            if p >= self.threshold or p <= 1.0 - self.threshold:
+                intent = DOC_DEPENDENT if p >= 0.5 else GENERAL
+                label = "手元の文書を前提とした質問" if intent == DOC_DEPENDENT else "一般知識で回答可能な質問"
+                decision = (intent, f"ローカル判定（確信度 {max(p, 1.0 - p):.2f}）: {label}と判断しました。")
+                self._count("model")
+                self._remember(key, decision)
+                return decision
+
+        # 曖昧なので LLM にエスカレーションする
+        self._count("llm")
+        return None
+
+    def record_llm_decision(self, text: str, intent: str, reason: str) -> None:
+        """
+        LLM にエスカレーションした結果をキャッシュし、学習用ログに追記する。
+        イベントループから呼ばれるため、ログの追記は共有スレッドプールで行う。
+        """
+        key = normalize_query(text)
+        self._remember(key, (intent, reason))
+        if self.log_path is None:
+            return
+        line = json.dumps({"text": key, "label": intent}, ensure_ascii=False) + "\n"
+        try:
+            submit_blocking(self._append_log, line)
+        except RuntimeError:
+            # 終了処理でスレッドプールが止まっている場合は、その場で書き込む
+            self._append_log(line)
+
+    def _append_log(self, line: str) -> None:
+        # 同時にエスカレーションした判定の行が混ざらないよう、ロックを保持して追記する
+        try:
+            with self._lock:
+                self.log_path.parent.mkdir(parents=True, exist_ok=True)
+                with self.log_path.open("a", encoding="utf-8") as f:
+                    f.write(line)
+        except Exception as e:
+            print(f"警告: [IntentClassifier] 判定ログの書き込みに失敗しました: {e}")
+
+    def stats(self) -> Dict:
+        with self._lock:
+            counts = dict(self._counts)
+        total = sum(counts.values())
+        return {
+            **counts,
+            "model_loaded": self.model is not None,
+            "escalation_rate": (counts["llm"] / total) if total else 0.0,
+        }
+
+
+def _load_model() -> Optional[NgramLogisticModel]:
+    try:
+        return NgramLogisticModel.load(config.INTENT_MODEL_PATH)
+    except Exception as e:
+        print(f"警告: [IntentClassifier] モデルの読み込みに失敗しました（ルールのみで判定します）: {e}")
+        return None
+
+
+# シングルトンとして保持
+intent_classifier = TieredIntentClassifier(model=_load_model())
+
+
+# =========================
+# オフライン学習・評価
+# =========================
+
+def load_samples(path: Path) -> List[Tuple[str, str]]:
+    """
+    判定ログ（JSONL: {"text": ..., "label": ...}）を読み込む。同じ入力は最後の判定を採用する。
+    """
+    samples: Dict[str, str] = {}
+    with path.open(encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            row = json.loads(line)
+            if row.get("label") in (DOC_DEPENDENT, GENERAL):
+                samples[normalize_query(row["text"])] = row["label"]
+    return list(samples.items())
+
+
+def evaluate(model: NgramLogisticModel, samples: List[Tuple[str, str]], threshold: float) -> Dict:
+    """
+    正解率と、しきい値でローカル判定できる割合（カバー率）・その正解率を返す。
+    """
+    correct = confident = confident_correct = 0
+    for text, label in samples:
+        p = model.predict_proba(text)
+        predicted = DOC_DEPENDENT if p >= 0.5 else GENERAL
+        correct += predicted == label
+        if p >= threshold or p <= 1.0 - threshold:
+            confident += 1
+            confident_correct += predicted == label
+    n = len(samples) or 1
+    return {
+        "samples": len(samples),
+        "accuracy": correct / n,
+        "coverage": confident / n,
+        "confident_accuracy": (confident_correct / confident) if confident else 0.0,
+        "escalation_rate": 1.0 - confident / n,
+    }
+
+
+def main(argv=None) -> None:
+    parser = argparse.ArgumentParser(description="ローカル意図分類器の学習・評価")
+    parser.add_argument("command", choices=["train", "eval"])
+    parser.add_argument("--log", type=Path, default=config.INTENT_LOG_PATH, help="判定ログ（JSONL）")
+    parser.add_argument("--model", type=Path, default=config.INTENT_MODEL_PATH, help="モデルの保存先")
+    parser.add_argument("--epochs", type=int, default=20)
+    parser.add_argument("--threshold", type=float, default=config.INTENT_LOCAL_THRESHOLD)
+    parser.add_argument("--holdout", type=float, default=0.2, help="train 時に評価用に取り分ける割合")
+    args = parser.parse_args(argv)
+
+    samples = load_samples(args.log)
+    if not samples:
+        raise SystemExit(f"学習データがありません: {args.log}")
+
+    if args.command == "train":
+        random.Random(0).shuffle(samples)
+        n_eval = int(len(samples) * args.holdout)
+        eval_set, train_set = samples[:n_eval], samples[n_eval:]
+        model = NgramLogisticModel()
+        model.fit(train_set, epochs=args.epochs)
+        model.save(args.model)
+        print(f"モデルを保存しました: {args.model}（学習 {len(train_set)} 件）")
+        if eval_set:
+            print(json.dumps(evaluate(model, eval_set, args.threshold), ensure_ascii=False, indent=2))
+    else:
+        model = NgramLogisticModel.load(args.model)
+        if model is None:
+            raise SystemExit(f"モデルがありません: {args.model}")
+        print(json.dumps(evaluate(model, samples, args.threshold), ensure_ascii=False, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,8 +1,19 @@
 # backend/app/agent/nodes.py
+# 各ノードは AgentState を受け取り、更新するフィールドだけを dict で返す
+# （steps / references はグラフ側のリデューサで追記される）
+
+import asyncio
+import threading
+import time
+from typing import Dict, List, Optional, Tuple
 
 from app.agent.types import AgentState, StepLog, Reference
-from app.rag.retriever import RAGRetriever
-from app.tools.web_search import run_web_search
+from app.agent.context_packer import pack_context
+from app.agent.history_compressor import compress_history
+from app.agent.intent_classifier import intent_classifier
+from app.rag.registry import get_retriever
+from app.tools.web_search import run_web_search, arun_web_search
+from app.services.blocking_pool import run_blocking, submit_blocking
 from app import config
 
 from langchain_openai import ChatOpenAI
@@ -17,115 +28,340 @@ llm = ChatOpenAI(
 )
 
 
+# ===== 投機的検索の計測 =====
+
+_speculation_lock = threading.Lock()
+_speculation_counts = {"used": 0, "wasted": 0, "failed": 0}
+
+
+def _count_speculation(outcome: str) -> None:
+    with _speculation_lock:
+        _speculation_counts[outcome] += 1
+
+
+def speculation_stats() -> Dict:
+    """
+    投機的検索の結果がどれだけ使われたか（ヒット率）を返す。
+    """
+    with _speculation_lock:
+        counts = dict(_speculation_counts)
+    total = sum(counts.values())
+    return {
+        "enabled": config.SPECULATIVE_RAG,
+        **counts,
+        "hit_rate": (counts["used"] / total) if total else 0.0,
+    }
+
+
 # ===== ノード1: 質問意図解析 =====
 
-def analyze_intent(state: AgentState) -> AgentState:
-    text = state.input.strip()
+DOC_KEYWORDS = ["この契約書", "以下の文書", "ドキュメント", "NDA", "業務委託", "雇用契約書"]
+
+CLASSIFIER_INSTRUCTION = (
+    "あなたは、ユーザーの質問が『手元の具体的な文書（契約書・規約・マニュアルなど）"
+    "に依存しているかどうか』を判定する分類器です。\n"
+    "出力は次のいずれか1語のみとし、説明や理由は書かないでください。\n"
+    "- doc_dependent\n"
+    "- general"
+)
+
+
+def _classifier_messages(text: str):
+    return [
+        SystemMessage(content=CLASSIFIER_INSTRUCTION),
+        HumanMessage(content=f"ユーザーの質問:\n{text}"),
+    ]
+
+
+def _intent_from_label(text: str, label: str):
+    """
+    分類器の出力ラベルから (intent, reason) を決める。
+    想定外の出力の場合はキーワードベースで判定する。
+    """
+    label = (label or "").strip().lower()
 
-    doc_keywords = ["この契約書", "以下の文書", "ドキュメント", "NDA", "業務委託", "雇用契約書"]
+    if label.startswith("doc"):
+        return "doc_dependent", "LLM判定: 手元の文書を前提とした質問と判断しました。"
+    if label.startswith("gen"):
+        return "general", "LLM判定: 一般知識で回答可能な質問と判断しました。"
+    if any(k in text for k in DOC_KEYWORDS):
+        return "doc_dependent", "LLM出力が想定外だったため、キーワードベースで文書依存と判定しました。"
+    return "general", "LLM出力が想定外だったため、キーワードベースで非文書依存と判定しました。"
 
-    intent = "general"
-    reason = "初期値（一般的な質問とみなす）です。"
 
+def _intent_from_error(text: str, e: Exception):
+    """
+    分類器の呼び出しに失敗した場合に、キーワードベースで (intent, reason) を決める。
+    """
+    print(f"警告: analyze_intent の LLM呼び出しに失敗しました: {e}")
+    if any(k in text for k in DOC_KEYWORDS):
+        return "doc_dependent", "LLM呼び出しに失敗したため、キーワードベースで文書依存と判定しました。"
+    return "general", "LLM呼び出しに失敗したため、キーワードベースで非文書依存と判定しました。"
+
+
+def plan_route(intent: str, question: str) -> List[str]:
+    """
+    意図解析の結果から、回答生成の前に実行するノードを決める。
+    - 文書依存なら "rag"、Web検索のトリガーがあれば "web_search"（両方なら並列に実行）
+    - どちらも不要なら直接 "answer"
+    """
+    targets = []
+    if intent == "doc_dependent":
+        targets.append("rag")
+    if needs_web_search(question):
+        targets.append("web_search")
+    return targets or ["answer"]
+
+
+ROUTE_LABELS = {"rag": "RAG検索", "web_search": "Web検索", "answer": "回答生成"}
+
+
+def _record_intent(state: AgentState, text: str, intent: str, reason: str) -> Dict:
+    route = "・".join(ROUTE_LABELS[t] for t in plan_route(intent, state.input))
+    return {
+        "intent": intent,
+        "source": "rag" if intent == "doc_dependent" else "llm",
+        "steps": [
+            StepLog(
+                step_idx=1,  # 通し番号はステートへのマージ時（merge_steps）に振り直される
+                agent_node="analysis",
+                step_input=f"Input: {text}",
+                step_output=(
+                    f"Intent: {'文書依存' if intent == 'doc_dependent' else '非文書依存'} ({reason})"
+                    f" → 次の処理: {route}"
+                ),
+            )
+        ],
+    }
+
+
+def _speculative_search(query: str) -> Optional[Dict]:
+    """
+    投機的検索（意図解析と同時に走らせるベクトル検索）。
+    失敗した場合は None を返し、RAG ノードで通常どおり検索し直す。
+    """
+    started = time.perf_counter()
     try:
-        classifier_instruction = (
-            "あなたは、ユーザーの質問が『手元の具体的な文書（契約書・規約・マニュアルなど）"
-            "に依存しているかどうか』を判定する分類器です。\n"
-            "出力は次のいずれか1語のみとし、説明や理由は書かないでください。\n"
-            "- doc_dependent\n"
-            "- general"
-        )
-        res = llm.invoke(
-            [
-                SystemMessage(content=classifier_instruction),
-                HumanMessage(content=f"ユーザーの質問:\n{text}"),
-            ]
+        index_count, results, by_article = _lookup_or_search(get_retriever(), query)
+    except Exception as e:
+        print(f"警告: 投機的検索に失敗しました: {e}")
+        return None
+    return {
+        "index_count": index_count,
+        "results": results,
+        "by_article": by_article,
+        "elapsed_ms": round((time.perf_counter() - started) * 1000, 1),
+    }
+
+
+def _resolve_speculation(intent: str, speculative: Optional[Dict], classifier_ms: float) -> Dict:
+    """
+    投機的検索の結果を採用するか破棄するかを決め、ステートの更新と計測情報を返す。
+    - 文書依存: 結果を speculative_rag としてステートに残し、RAG ノードで再利用する（used）
+    - 非文書依存: 結果は破棄する（wasted）
+    """
+    if intent != "doc_dependent":
+        outcome = "wasted"
+    elif speculative is None:
+        outcome = "failed"
+    else:
+        outcome = "used"
+    _count_speculation(outcome)
+    tool_calls = [
+        {
+            "tool": "speculative_rag",
+            "outcome": outcome,
+            "search_ms": speculative["elapsed_ms"] if outcome == "used" else None,
+            "classifier_ms": round(classifier_ms, 1),
+        }
+    ]
+    update = {"speculative_rag": speculative} if outcome == "used" else {}
+    return {"speculation": outcome, "tool_calls": tool_calls, "update": update}
+
+
+def _record_speculative_intent(state: AgentState, text: str, intent: str, reason: str, resolved: Dict) -> Dict:
+    update = _record_intent(state, text, intent, reason)
+    step = update["steps"][0]
+    update["steps"] = [
+        step.model_copy(
+            update={"speculation": resolved["speculation"], "tool_calls": resolved["tool_calls"]}
         )
-        label = (res.content or "").strip().lower()
-
-        if label.startswith("doc"):
-            intent = "doc_dependent"
-            reason = "LLM判定: 手元の文書を前提とした質問と判断しました。"
-        elif label.startswith("gen"):
-            intent = "general"
-            reason = "LLM判定: 一般知識で回答可能な質問と判断しました。"
-        else:
-            if any(k in text for k in doc_keywords):
-                intent = "doc_dependent"
-                reason = "LLM出力が想定外だったため、キーワードベースで文書依存と判定しました。"
-            else:
-                intent = "general"
-                reason = "LLM出力が想定外だったため、キーワードベースで非文書依存と判定しました。"
+    ]
+    update.update(resolved["update"])
+    return update
+
+
+def _classify_locally(text: str) -> Optional[Tuple[str, str]]:
+    """
+    ルール・ローカルモデル・キャッシュで判定できれば (intent, reason) を返す。
+    曖昧な場合は None（LLM にエスカレーションする）。
+    """
+    if not config.INTENT_LOCAL_CLASSIFIER:
+        return None
+    return intent_classifier.classify_local(text)
+
+
+def _intent_from_llm(text: str, label: str) -> Tuple[str, str]:
+    intent, reason = _intent_from_label(text, label)
+    # LLM が想定どおりのラベルを返した場合だけ、キャッシュと学習用ログに残す
+    if config.INTENT_LOCAL_CLASSIFIER and reason.startswith("LLM判定"):
+        intent_classifier.record_llm_decision(text, intent, reason)
+    return intent, reason
+
+
+def analyze_intent(state: AgentState) -> Dict:
+    text = state.input.strip()
+
+    # ローカルで確信を持って判定できる場合は LLM を呼ばない
+    local = _classify_locally(text)
+    if local is not None:
+        return _record_intent(state, text, *local)
+
+    # 投機モード: 分類器の LLM 呼び出しと並行してベクトル検索を始めておく
+    future = submit_blocking(_speculative_search, state.input) if config.SPECULATIVE_RAG else None
+    started = time.perf_counter()
 
+    try:
+        res = llm.invoke(_classifier_messages(text))
+        intent, reason = _intent_from_llm(text, res.content)
     except Exception as e:
-        print(f"警告: analyze_intent の LLM呼び出しに失敗しました: {e}")
-        if any(k in text for k in doc_keywords):
-            intent = "doc_dependent"
-            reason = "LLM呼び出しに失敗したため、キーワードベースで文書依存と判定しました。"
-        else:
-            intent = "general"
-            reason = "LLM呼び出しに失敗したため、キーワードベースで非文書依存と判定しました。"
-
-    state.intent = intent
-    state.source = "rag" if intent == "doc_dependent" else "llm"
-
-    state.steps.append(
-        StepLog(
-            step_idx=len(state.steps) + 1,
-            agent_node="analysis",
-            step_input=f"Input: {text}",
-            step_output=f"Intent: {'文書依存' if intent == 'doc_dependent' else '非文書依存'} ({reason})",
-        )
+        intent, reason = _intent_from_error(text, e)
+
+    if future is None:
+        return _record_intent(state, text, intent, reason)
+
+    classifier_ms = (time.perf_counter() - started) * 1000
+    if intent == "doc_dependent":
+        speculative = future.result()
+    else:
+        # 使わない結果は待たずに捨てる
+        future.cancel()
+        speculative = None
+    resolved = _resolve_speculation(intent, speculative, classifier_ms)
+    return _record_speculative_intent(state, text, intent, reason, resolved)
+
+
+async def aanalyze_intent(state: AgentState) -> Dict:
+    """
+    analyze_intent の非同期版（イベントループをブロックしない ainvoke を使う）
+    """
+    text = state.input.strip()
+
+    # ローカルで確信を持って判定できる場合は LLM を呼ばない
+    local = _classify_locally(text)
+    if local is not None:
+        return _record_intent(state, text, *local)
+
+    # 投機モード: 分類器の LLM 呼び出しと並行してベクトル検索を始めておく
+    task = (
+        asyncio.ensure_future(run_blocking(_speculative_search, state.input))
+        if config.SPECULATIVE_RAG
+        else None
     )
+    started = time.perf_counter()
 
-    return state
+    try:
+        res = await llm.ainvoke(_classifier_messages(text))
+        intent, reason = _intent_from_llm(text, res.content)
+    except Exception as e:
+        intent, reason = _intent_from_error(text, e)
+
+    if task is None:
+        return _record_intent(state, text, intent, reason)
+
+    classifier_ms = (time.perf_counter() - started) * 1000
+    if intent == "doc_dependent":
+        speculative = await task
+    else:
+        # 使わない結果は待たずに捨てる
+        task.cancel()
+        speculative = None
+    resolved = _resolve_speculation(intent, speculative, classifier_ms)
+    return _record_speculative_intent(state, text, intent, reason, resolved)
 
 
 # ===== ノード2: RAG 実行 =====
 
-def run_rag_if_needed(state: AgentState) -> AgentState:
+def _rag_step(query: str, msg: str, speculation: Optional[str] = None) -> StepLog:
+    return StepLog(
+        step_idx=1,  # 通し番号はステートへのマージ時（merge_steps）に振り直される
+        agent_node="rag",
+        step_input=f"Query: {query}",
+        step_output=msg,
+        speculation=speculation,
+    )
+
+
+def _search_index(retriever, query: str) -> Tuple[int, List[Dict]]:
+    """
+    インデックスの件数を確認し、空でなければ類似検索を行う。
+    :return: (インデックスのチャンク数, 検索結果)
+    """
+    index_count = retriever.chunk_count()
+    print(f"[run_rag_if_needed] index_count={index_count}")
+    if index_count == 0:
+        return index_count, []
+    # 多めに 10件取得
+    return index_count, retriever.search(query, n_results=10)
+
+
+def _lookup_or_search(retriever, query: str) -> Tuple[int, List[Dict], bool]:
+    """
+    質問に条番号（「第5条」など）があれば、ベクトル検索をせずに条文索引から直接取り出す。
+    なければ（または条文が見つからなければ）通常の検索を行う。
+    :return: (インデックスのチャンク数, 検索結果, 条番号で直接参照したか)
+    """
+    if config.ARTICLE_LOOKUP_ENABLED:
+        articles = retriever.lookup_articles(query)
+        if articles:
+            return retriever.chunk_count(), articles, True
+    index_count, results = _search_index(retriever, query)
+    return index_count, results, False
+
+
+def run_rag_if_needed(state: AgentState) -> Dict:
     # 文書依存でなければ RAG スキップ
     if getattr(state, "intent", None) != "doc_dependent":
         msg = "RAGスキップ: 非文書依存と判断されたため、手元文書は参照しませんでした。"
-        state.steps.append(
-            StepLog(
-                step_idx=len(state.steps) + 1,
-                agent_node="rag",
-                step_input="Skipped",
-                step_output=msg,
-            )
-        )
-        state.rag_result = []
-        state.source = "llm"
-        return state
+        return {
+            "rag_result": [],
+            "source": "llm",
+            "steps": [
+                StepLog(step_idx=1, agent_node="rag", step_input="Skipped", step_output=msg)
+            ],
+        }
 
     query = state.input
 
-    # ★ 毎回ここで RAGRetriever を new する
-    try:
-        retriever = RAGRetriever()
-    except Exception as e:
-        msg = (
-            "RAG実行: RAGRetriever の初期化に失敗しました。"
-            "環境変数や Chroma のパス設定を確認してください。"
-        )
-        print(f"警告: {msg} ({e})")
-        state.rag_result = []
-        state.intent = "general"
-        state.source = "llm"
-        state.steps.append(
-            StepLog(
-                step_idx=len(state.steps) + 1,
-                agent_node="rag",
-                step_input=f"Query: {query}",
-                step_output=msg,
+    # 失敗時・0件時は一般知識モードにフォールバックする
+    fallback = {"rag_result": [], "intent": "general", "source": "llm"}
+
+    # 意図解析と並行して実行した投機的検索の結果があれば、それを再利用する
+    speculative = getattr(state, "speculative_rag", None)
+    speculation = "used" if speculative is not None else None
+
+    retriever = None
+    if speculative is None:
+        # プロセス全体で共有している RAGRetriever を取得する（起動時にウォームアップ済み）
+        try:
+            retriever = get_retriever()
+        except Exception as e:
+            msg = (
+                "RAG実行: RAGRetriever の初期化に失敗しました。"
+                "環境変数や Chroma のパス設定を確認してください。"
             )
-        )
-        return state
+            print(f"警告: {msg} ({e})")
+            return {**fallback, "rag_error": str(e), "steps": [_rag_step(query, msg)]}
+
+    update: Dict = dict(fallback)
 
     try:
-        index_count = retriever.collection.count()
-        print(f"[run_rag_if_needed] index_count={index_count}")
+        # 投機的検索でも同じく、条番号があれば条文索引を先に引いている
+        if speculative is not None:
+            index_count, results = speculative["index_count"], speculative["results"]
+            by_article = speculative.get("by_article", False)
+        else:
+            index_count, results, by_article = _lookup_or_search(retriever, query)
 
         if index_count == 0:
             msg = (
@@ -133,13 +369,7 @@ def run_rag_if_needed(state: AgentState) -> AgentState:
                 f"インデックスが構築されていない可能性があります。"
             )
             print(f"警告: {msg}")
-            state.rag_result = []
-            state.intent = "general"
-            state.source = "llm"
         else:
-            # 多めに 10件取得
-            results = retriever.search(query, n_results=10)
-
             titles = [r.get("document_title", "（タイトル不明）") for r in results]
             print(
                 f"[run_rag_if_needed] query={query!r}, "
@@ -149,26 +379,28 @@ def run_rag_if_needed(state: AgentState) -> AgentState:
             if results:
                 sample_titles = "、".join(titles[:3])
                 msg = f"RAG実行: {len(results)}件ヒット（例: {sample_titles}）"
-                state.rag_result = results
-                # 参照リストを作成
-                for r in results:
-                    state.references.append(
+                if by_article:
+                    labels = "、".join(dict.fromkeys(r["article"] for r in results))
+                    msg = f"RAG実行: 条番号で直接参照しました（{labels}、{len(results)}件。例: {sample_titles}）"
+                update = {
+                    "rag_result": results,
+                    "source": "rag",
+                    # 参照リストを作成
+                    "references": [
                         Reference(
                             title=r.get("document_title", "不明"),
                             snippet=r.get("snippet", ""),
                             url=None # 文書アップロードの場合はURLなし
                         )
-                    )
-                state.source = "rag"
+                        for r in results
+                    ],
+                }
             else:
                 msg = (
                     f"RAG実行: 0件ヒット（インデックスには{index_count}件のチャンクがありますが、"
                     f"関連する文書が見つかりませんでした）。一般知識モードにフォールバックします。"
                 )
                 print(f"警告: {msg}")
-                state.rag_result = []
-                state.intent = "general"
-                state.source = "llm"
 
     except Exception as e:
         error_msg = f"RAG実行中にエラーが発生しました: {str(e)}"
@@ -176,106 +408,143 @@ def run_rag_if_needed(state: AgentState) -> AgentState:
         import traceback
         print(traceback.format_exc())
         msg = f"RAG実行: エラーが発生しました（{error_msg}）。一般知識モードにフォールバックします。"
-        state.rag_result = []
-        state.intent = "general"
-        state.source = "llm"
-
-    state.steps.append(
-        StepLog(
-            step_idx=len(state.steps) + 1,
-            agent_node="rag",
-            step_input=f"Query: {query}",
-            step_output=msg,
-        )
-    )
+        # 検索の失敗による一般知識での回答は、回答キャッシュに残さない（復旧後は検索し直す）
+        update = {**fallback, "rag_error": error_msg}
+
+    update["steps"] = [_rag_step(query, msg, speculation)]
+    return update
+
+
+async def arun_rag_if_needed(state: AgentState) -> Dict:
+    """
+    run_rag_if_needed の非同期版。
+    Chroma の検索や埋め込み計算はブロッキング処理なので、上限付きスレッドプールで実行する。
+    """
+    return await run_blocking(run_rag_if_needed, state)
 
-    return state
 
 # ===== ノード3: 検索 =====
-def run_web_search_if_needed(state: AgentState) -> AgentState:
+
+WEB_TRIGGER_WORDS = [
+    "最新",
+    "最近",
+    "今日",
+    "昨日",
+    "ニュース",
+    "相場",
+    "株価",
+    "金利",
+    "インフレ",
+    "為替",
+    "FX",
+    "web検索",
+    "Web検索",
+    "ネットで調べて",
+]
+
+
+def needs_web_search(question: str) -> bool:
     """
-    ユーザーの質問内容に応じて Web 検索を行う。
     - 「最新」「最近」「今日」「ニュース」「株価」「金利」などのキーワード
     - 「web検索」「ネットで調べて」などの明示的指示
-    が含まれる場合に Tavily で検索し、結果を state.web_search_result に格納する。
-    それ以外のときは何もせずそのまま返す。
+    が含まれる場合に True を返す。
     """
-    question = state.input
-
-    trigger_words = [
-        "最新",
-        "最近",
-        "今日",
-        "昨日",
-        "ニュース",
-        "相場",
-        "株価",
-        "金利",
-        "インフレ",
-        "為替",
-        "FX",
-        "web検索",
-        "Web検索",
-        "ネットで調べて",
-    ]
+    return any(word in question for word in WEB_TRIGGER_WORDS)
 
-    need_web = any(word in question for word in trigger_words)
 
-    if not need_web:
-        state.steps.append(
+def _record_web_search_skipped(state: AgentState) -> Dict:
+    return {
+        "steps": [
             StepLog(
-                step_idx=len(state.steps) + 1,
+                step_idx=1,
                 agent_node="web-search",
-                step_input=f"Keywords check: {question}",
+                step_input=f"Keywords check: {state.input}",
                 step_output="Web検索不要",
             )
-        )
-        return state
+        ]
+    }
 
-    # Web検索を実行
-    results = run_web_search(question, max_results=5)
-    state.web_search_result = results
-
-    # ログ
-    state.steps.append(
-        StepLog(
-            step_idx=len(state.steps) + 1,
-            agent_node="web-search",
-            step_input=f"Search Query: {question}",
-            step_output=f"Web検索実行: {len(results)}件ヒット",
-        )
-    )
 
-    # 参照リストに追加
-    for r in results:
-        state.references.append(
+def _record_web_search_results(state: AgentState, results) -> Dict:
+    # intent / source は RAG ノードと並列に実行されても衝突しないよう書き換えない
+    return {
+        "web_search_result": results,
+        # ログ
+        "steps": [
+            StepLog(
+                step_idx=1,
+                agent_node="web-search",
+                step_input=f"Search Query: {state.input}",
+                step_output=f"Web検索実行: {len(results)}件ヒット",
+            )
+        ],
+        # 参照リストに追加
+        "references": [
             Reference(
                 title=r.get("title", "No Title"),
                 url=r.get("url"),
                 snippet=r.get("content") or r.get("snippet")
             )
-        )
+            for r in results
+        ],
+    }
+
+
+def run_web_search_if_needed(state: AgentState) -> Dict:
+    """
+    ユーザーの質問内容に応じて Web 検索を行う。
+    トリガーとなるキーワード（needs_web_search 参照）が含まれる場合に Tavily で検索し、
+    結果を state.web_search_result に格納する。
+    それ以外のときは何もせずそのまま返す。
+    """
+    if not needs_web_search(state.input):
+        return _record_web_search_skipped(state)
+
+    # Web検索を実行
+    results = run_web_search(state.input, max_results=5)
+    return _record_web_search_results(state, results)
+
+
+async def arun_web_search_if_needed(state: AgentState) -> Dict:
+    """
+    run_web_search_if_needed の非同期版（Tavily の非同期クライアントを使う）
+    """
+    if not needs_web_search(state.input):
+        return _record_web_search_skipped(state)
 
-    return state
+    results = await arun_web_search(state.input, max_results=5)
+    return _record_web_search_results(state, results)
 
 
 # ===== ノード4: 回答生成 =====
 
 def _format_rag_context(rag_result) -> str:
+    """
+    RAG の検索結果を LLM に渡しやすいテキストに整形する。
+    隣接チャンクをつなぎ、重複を除いたうえで、トークン数の上限（config.RAG_CONTEXT_MAX_TOKENS）に入るだけ載せる。
+    上限に余りがあれば、抜粋を前後に広げる（config.RAG_CONTEXT_WIDEN_CHARS）。
+    """
     if not rag_result:
         return "（手元の文書から有用な情報は取得できませんでした）"
 
+    # 上限に余りがあれば、抜粋を文書ストアの全文から前後に広げる
+    try:
+        widen = get_retriever().widen
+    except Exception:
+        widen = None
+
     lines = []
-    for i, r in enumerate(rag_result[:3], start=1):
-        title = r.get("document_title", "（タイトル不明）")
-        snippet = r.get("snippet") or r.get("content") or ""
-        score = r.get("score")
+    for i, passage in enumerate(pack_context(rag_result, widen=widen), start=1):
+        title = passage.document_title
+        if passage.articles:
+            title += f"（{'・'.join(passage.articles)}）"
+        score = passage.score
         score_str = f"{score:.2f}" if isinstance(score, (int, float)) else "N/A"
 
         lines.append(
             f"[{i}] タイトル: {title}\n"
             f"    類似度スコア: {score_str}\n"
-            f"    本文抜粋: {snippet}"
+            f"    本文抜粋: {passage.text}"
         )
 
     return "\n\n".join(lines)
@@ -304,7 +573,7 @@ def _format_web_context(web_result) -> str:
     return "\n\n".join(lines)
 
 
-def generate_answer(state: AgentState) -> AgentState:
+def _build_answer_prompt(state: AgentState) -> str:
     # ---- RAG コンテキスト整形 ----
     rag_result = getattr(state, "rag_result", []) or []
     rag_context_text = _format_rag_context(rag_result)
@@ -328,13 +597,8 @@ def generate_answer(state: AgentState) -> AgentState:
             "不明な点や、手元の情報だけでは判断できない点があれば、その旨も明示してください。"
         )
 
-    # ---- 会話履歴（あれば）----
-    history_lines = []
-    for turn in getattr(state, "chat_history", [])[-5:]:
-        role = turn.get("role", "user")
-        content = turn.get("content", "")
-        history_lines.append(f"{role}: {content}")
-    history_text = "\n".join(history_lines) if history_lines else "（このセッションの会話履歴は使用していません）"
+    # ---- 会話履歴（直近のターンは原文、古いターンは方針に応じて要約・選択・省略）----
+    history_text = compress_history(getattr(state, "chat_history", []) or [], state.input).format()
 
     # ---- プロンプト組み立て ----
     prompt = f"""
@@ -345,7 +609,7 @@ def generate_answer(state: AgentState) -> AgentState:
 {state.input}
 ---
 
-これまでの会話履歴（参考・最大5ターン）:
+これまでの会話履歴（参考）:
 ---
 {history_text}
 ---
@@ -373,23 +637,51 @@ def generate_answer(state: AgentState) -> AgentState:
 これらを踏まえて、ユーザーの質問に対する回答を作成してください。
 """
 
+    return prompt
+
+
+def _record_answer(state: AgentState, answer: str) -> Dict:
+    return {
+        "output": answer,
+        "steps": [
+            StepLog(
+                step_idx=1,
+                agent_node="answer",
+                step_input="Context + Question",
+                step_output="回答生成完了",
+            )
+        ],
+    }
+
+
+def _answer_from_error(e: Exception) -> str:
+    error_msg = f"LLM呼び出しに失敗しました: {str(e)}"
+    print(f"Error in generate_answer: {error_msg}")
+    return f"申し訳ございません。回答の生成中にエラーが発生しました: {error_msg}"
+
+
+def generate_answer(state: AgentState) -> Dict:
+    prompt = _build_answer_prompt(state)
+
     try:
         res = llm.invoke(prompt)
         answer = res.content.strip()
     except Exception as e:
-        error_msg = f"LLM呼び出しに失敗しました: {str(e)}"
-        print(f"Error in generate_answer: {error_msg}")
-        answer = f"申し訳ございません。回答の生成中にエラーが発生しました: {error_msg}"
-
-    state.output = answer
-
-    state.steps.append(
-        StepLog(
-            step_idx=len(state.steps) + 1,
-            agent_node="answer",
-            step_input="Context + Question",
-            step_output="回答生成完了",
-        )
-    )
+        return {**_record_answer(state, _answer_from_error(e)), "error": str(e)}
+
+    return _record_answer(state, answer)
+
+
+async def agenerate_answer(state: AgentState) -> Dict:
+    """
+    generate_answer の非同期版（イベントループをブロックしない ainvoke を使う）
+    """
+    prompt = _build_answer_prompt(state)
+
+    try:
+        res = await llm.ainvoke(prompt)
+        answer = res.content.strip()
+    except Exception as e:
+        return {**_record_answer(state, _answer_from_error(e)), "error": str(e)}
 
-    return state
+    return _record_answer(state, answer)
@@ -1,5 +1,6 @@
 # エージェント内部の状態（State）を定義するファイル
-from typing import List, Optional, Dict
+import operator
+from typing import Annotated, List, Optional, Dict
 from pydantic import BaseModel, Field
 
 
@@ -11,12 +12,31 @@ class StepLog(BaseModel):
     - step_input: ステップへの入力概略
     - step_output: ステップの出力概略（人が理解できる形）
     - tool_calls: ツール呼び出しの詳細（オプション）
+    - speculation: 投機的検索の結果（"used" / "wasted" / "failed"、投機モードでない場合は None）
+    - cached: 回答キャッシュから返したステップの場合 True
     """
     step_idx: int
     agent_node: str
     step_input: str
     step_output: str
     tool_calls: Optional[List[Dict]] = None
+    speculation: Optional[str] = None
+    cached: Optional[bool] = None
+
+def merge_steps(left: Optional[List], right: Optional[List]) -> List[StepLog]:
+    """
+    steps のリデューサ。
+    各ノードが返した StepLog を追記し、step_idx を実行順の通し番号に振り直す。
+    並列に実行されたノード（rag / web_search）の更新もここで決定的にマージされる。
+    """
+    merged: List[StepLog] = []
+    for step in list(left or []) + list(right or []):
+        if isinstance(step, dict):
+            step = StepLog(**step)
+        idx = len(merged) + 1
+        merged.append(step if step.step_idx == idx else step.model_copy(update={"step_idx": idx}))
+    return merged
+
 
 class Reference(BaseModel):
     title: str
@@ -31,19 +51,26 @@ class AgentState(BaseModel):
     - input: ユーザーからの指示文
     - intent: 質問の意図（"doc_dependent" または "general"）
     - rag_result: RAG 検索の結果（必要な場合のみ）
+    - speculative_rag: 意図解析と並行して実行した投機的検索の結果（文書依存と判定された場合のみ保持）
     - output: LLM が生成した回答
-    - steps: 処理過程（StepLog のリスト）
+    - error: 回答生成に失敗した場合のエラー内容（キャッシュ対象外の判定に使う）
+    - rag_error: RAG 検索に失敗して一般知識モードにフォールバックした場合のエラー内容（同上）
+    - steps: 処理過程（StepLog のリスト、ノードの更新は merge_steps で追記）
     - chat_history: セッション内の会話履歴（将来拡張用）
     - source: 主な情報源（"rag" / "llm" / 将来 "web" など）
     """
     input: str
     intent: Optional[str] = None
     rag_result: Optional[List[Dict]] = None
+    speculative_rag: Optional[Dict] = None
     web_search_result: Optional[List[Dict]] = None
     output: Optional[str] = None
+    error: Optional[str] = None
+    rag_error: Optional[str] = None
     # ミュータブルなデフォルト値は default_factory を使う
-    steps: List[StepLog] = Field(default_factory=list)
+    steps: Annotated[List[StepLog], merge_steps] = Field(default_factory=list)
     chat_history: List[Dict[str, str]] = Field(default_factory=list)
 
-    references: List[Reference] = Field(default_factory=list)
+    # 並列ノード（rag / web_search）からの参照情報を連結する
+    references: Annotated[List[Reference], operator.add] = Field(default_factory=list)
     source: Optional[str] = None
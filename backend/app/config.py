@@ -40,6 +40,86 @@ CHROMA_DIR = BASE_DIR / "chroma_db"
 # コレクション名（テーブル名のようなもの）
 CHROMA_COLLECTION: str = "documents"
 
+# キャッシュ等のローカルデータ格納先（CHROMA_DIR と同じ階層 → backend/app/data）
+DATA_DIR = BASE_DIR / "data"
+
+
+# =========================
+# 埋め込みキャッシュ
+# =========================
+# クエリ埋め込みの LRU キャッシュ件数（メモリ上）
+QUERY_EMBEDDING_CACHE_SIZE: int = int(os.getenv("QUERY_EMBEDDING_CACHE_SIZE", "1024"))
+
+# クエリ埋め込みをディスクにも保存して再起動後も使うか（"0" で無効）
+QUERY_EMBEDDING_CACHE_DISK: bool = os.getenv("QUERY_EMBEDDING_CACHE_DISK", "1") != "0"
+QUERY_EMBEDDING_CACHE_PATH = DATA_DIR / "query_embeddings.sqlite3"
+
+# チャンク埋め込みの内容アドレス型ストア（取り込み・再構築時の再計算を避ける）
+CHUNK_EMBEDDING_CACHE_PATH = DATA_DIR / "chunk_embeddings.sqlite3"
+
+
+# =========================
+# 取り込みパイプライン
+# =========================
+# 埋め込みAPI 1リクエストあたりの最大チャンク数・最大トークン数（目安）
+EMBEDDING_BATCH_SIZE: int = int(os.getenv("EMBEDDING_BATCH_SIZE", "128"))
+EMBEDDING_BATCH_TOKENS: int = int(os.getenv("EMBEDDING_BATCH_TOKENS", "20000"))
+
+# 同時に埋め込みを計算するバッチ数
+EMBEDDING_CONCURRENCY: int = int(os.getenv("EMBEDDING_CONCURRENCY", "4"))
+
+# Chroma への1回あたりの書き込み件数
+CHROMA_WRITE_BATCH_SIZE: int = int(os.getenv("CHROMA_WRITE_BATCH_SIZE", "1000"))
+
+
+# =========================
+# 検索（ベクトル + キーワード）
+# =========================
+# 検索モード: "vector"（埋め込みの類似度）/ "lexical"（文字 n-gram の BM25）/ "hybrid"（両方を統合）
+RETRIEVAL_MODE: str = os.getenv("RETRIEVAL_MODE", "hybrid")
+
+# ハイブリッド検索の Reciprocal Rank Fusion の定数（大きいほど下位の順位も効く）
+RRF_K: int = int(os.getenv("RRF_K", "60"))
+
+# 回答生成のプロンプトに入れる手元文書の抜粋のトークン数の上限
+# （検索結果の隣接チャンクをつなぎ、重複を除いたうえで、この範囲に入るだけ詰める）
+RAG_CONTEXT_MAX_TOKENS: int = int(os.getenv("RAG_CONTEXT_MAX_TOKENS", "1500"))
+
+# 抜粋どうしの文字 3-gram の重なり（Jaccard 係数）がこれ以上なら、ほぼ同じ内容とみなして片方を除く
+RAG_CONTEXT_DEDUP_THRESHOLD: float = float(os.getenv("RAG_CONTEXT_DEDUP_THRESHOLD", "0.8"))
+
+# 上限に余りがあるとき、抜粋を文書ストアの全文から前後に広げる文字数（片側。0 で広げない）
+RAG_CONTEXT_WIDEN_CHARS: int = int(os.getenv("RAG_CONTEXT_WIDEN_CHARS", "300"))
+
+# キーワード検索用の転置インデックスの保存先（チャンクごとの索引語を SQLite に差分で保存する）
+LEXICAL_INDEX_PATH = DATA_DIR / "lexical_index.sqlite3"
+
+# 登録済み文書の一覧（doc_id・タイトル・チャンク数など）。文書一覧 API は Chroma を読まずにここから返す
+DOCUMENT_CATALOG_PATH = DATA_DIR / "document_catalog.sqlite3"
+
+# 文書の全文を1部だけ圧縮して保存し、チャンクは位置（char_start / char_end）で参照する（"0" で無効）
+# 有効な場合、Chroma にはチャンクの本文を保存せず、検索結果の抜粋はこのストアから取り出す
+DOCUMENT_STORE_ENABLED: bool = os.getenv("DOCUMENT_STORE_ENABLED", "1") != "0"
+DOCUMENT_STORE_DIR = DATA_DIR / "document_store"
+
+# 全文を圧縮する単位の文字数（読み出しはこの単位で展開する）と、展開済みブロックのキャッシュ件数
+DOCUMENT_STORE_BLOCK_CHARS: int = int(os.getenv("DOCUMENT_STORE_BLOCK_CHARS", "16384"))
+DOCUMENT_STORE_CACHE_BLOCKS: int = int(os.getenv("DOCUMENT_STORE_CACHE_BLOCKS", "256"))
+DOCUMENT_STORE_COMPRESS_LEVEL: int = int(os.getenv("DOCUMENT_STORE_COMPRESS_LEVEL", "6"))
+
+# 条・項・号の構造索引（文書ID・条番号 → 本文上の範囲）の保存先
+ARTICLE_INDEX_PATH = DATA_DIR / "article_index.sqlite3"
+
+# 質問に条番号（「第5条」など）があれば、ベクトル検索をせずに索引から条文を直接取り出す（"0" で無効）
+ARTICLE_LOOKUP_ENABLED: bool = os.getenv("ARTICLE_LOOKUP_ENABLED", "1") != "0"
+
+# 条番号で直接取り出すときに対象にする文書数の上限（質問に文書名がなく、同じ条を持つ文書が多い場合）
+ARTICLE_LOOKUP_MAX_DOCUMENTS: int = int(os.getenv("ARTICLE_LOOKUP_MAX_DOCUMENTS", "3"))
+
+# 文書一覧 API の1ページあたりの既定件数と上限
+DOCUMENT_LIST_DEFAULT_LIMIT: int = int(os.getenv("DOCUMENT_LIST_DEFAULT_LIMIT", "100"))
+DOCUMENT_LIST_MAX_LIMIT: int = int(os.getenv("DOCUMENT_LIST_MAX_LIMIT", "1000"))
+
 
 # =========================
 # RAGドキュメント
@@ -47,4 +127,124 @@ CHROMA_COLLECTION: str = "documents"
 # 文書配置ディレクトリ（backend/app/documents）
 DOCUMENTS_DIR = BASE_DIR / "documents"
 
-TAVILY_API_KEY = os.getenv("TAVILY_API_KEY")
\ No newline at end of file
+# 1チャンクあたりの最大トークン数（条・項の区切りを優先し、小さな条はこの範囲でまとめる）
+CHUNK_MAX_TOKENS: int = int(os.getenv("CHUNK_MAX_TOKENS", "500"))
+
+# インクリメンタル構築用マニフェスト（ファイルごとの mtime / size / 内容ハッシュ）
+INDEX_MANIFEST_PATH = DATA_DIR / "index_manifest.json"
+
+TAVILY_API_KEY = os.getenv("TAVILY_API_KEY")
+
+# Web検索結果のキャッシュ有効期間（秒）：株価・為替などは短く、一般的な検索は長く
+WEB_SEARCH_TTL_MARKET_SEC: float = float(os.getenv("WEB_SEARCH_TTL_MARKET_SEC", "60"))
+WEB_SEARCH_TTL_NEWS_SEC: float = float(os.getenv("WEB_SEARCH_TTL_NEWS_SEC", "600"))
+WEB_SEARCH_TTL_DEFAULT_SEC: float = float(os.getenv("WEB_SEARCH_TTL_DEFAULT_SEC", "3600"))
+
+# TTL 切れ後も、この期間内なら古い結果を返しつつ裏で更新する（stale-while-revalidate）
+WEB_SEARCH_STALE_SEC: float = float(os.getenv("WEB_SEARCH_STALE_SEC", "300"))
+
+# 検索1回あたりの待ち時間の上限（秒）とキャッシュ件数
+WEB_SEARCH_TIMEOUT_SEC: float = float(os.getenv("WEB_SEARCH_TIMEOUT_SEC", "10"))
+WEB_SEARCH_CACHE_SIZE: int = int(os.getenv("WEB_SEARCH_CACHE_SIZE", "256"))
+
+
+# =========================
+# 非同期実行
+# =========================
+# ブロッキング処理（Chroma 検索など）をイベントループ外で実行するスレッド数の上限
+BLOCKING_POOL_SIZE: int = int(os.getenv("BLOCKING_POOL_SIZE", "16"))
+
+# 文書パース（PDF / Word のテキスト抽出）を実行するプロセス数
+PARSE_POOL_SIZE: int = int(os.getenv("PARSE_POOL_SIZE", str(min(4, os.cpu_count() or 1))))
+
+# パース1ジョブあたりの制限時間（秒）と、ワーカープロセスのメモリ上限（MB、0 で無制限）
+PARSE_TIMEOUT_SEC: float = float(os.getenv("PARSE_TIMEOUT_SEC", "60"))
+PARSE_MEMORY_LIMIT_MB: int = int(os.getenv("PARSE_MEMORY_LIMIT_MB", "1024"))
+
+# PDF をページ範囲に分けて並列に抽出するときの1ジョブあたりのページ数
+PARSE_PDF_PAGES_PER_JOB: int = int(os.getenv("PARSE_PDF_PAGES_PER_JOB", "8"))
+
+# 1ページの抽出にこれ以上かかったら警告を出す（ミリ秒）
+PARSE_SLOW_PAGE_MS: float = float(os.getenv("PARSE_SLOW_PAGE_MS", "1000"))
+
+# アップロードファイルの最大サイズ（バイト）。一時ファイルに書き出しながら確認する
+UPLOAD_MAX_BYTES: int = int(os.getenv("UPLOAD_MAX_BYTES", str(50 * 1024 * 1024)))
+
+# アップロード・テキスト登録をバックグラウンドのジョブとして処理するか（"0" で従来どおり同期処理）
+INGEST_BACKGROUND: bool = os.getenv("INGEST_BACKGROUND", "1") != "0"
+
+# 取り込みジョブを同時に処理するワーカー数と、受け付けておける未完了ジョブ数の上限
+INGEST_WORKERS: int = int(os.getenv("INGEST_WORKERS", "2"))
+INGEST_MAX_PENDING: int = int(os.getenv("INGEST_MAX_PENDING", "100"))
+
+# 取り込みジョブの保存先（再起動後も未完了のジョブを再開する）と、処理待ちファイルの置き場所
+INGEST_JOBS_PATH = DATA_DIR / "ingest_jobs.sqlite3"
+INGEST_SPOOL_DIR = DATA_DIR / "ingest_spool"
+
+# 一括取り込み（複数ファイル・zip）で受け付けるファイル数と、合計サイズ（zip は展開後）の上限
+BULK_MAX_FILES: int = int(os.getenv("BULK_MAX_FILES", "2000"))
+BULK_MAX_BYTES: int = int(os.getenv("BULK_MAX_BYTES", str(1024 * 1024 * 1024)))
+
+# 一括取り込みで同時にパースするファイル数（PDF / Word の抽出自体はパース用プロセスプールで行う）
+BULK_PARSE_CONCURRENCY: int = int(os.getenv("BULK_PARSE_CONCURRENCY", str(max(2, PARSE_POOL_SIZE * 2))))
+
+# 投機的検索: 意図解析（LLM）と並行してベクトル検索を開始する（"1" で有効、オプトイン）
+SPECULATIVE_RAG: bool = os.getenv("SPECULATIVE_RAG", "0") == "1"
+
+
+# =========================
+# 意図分類（ローカル高速判定）
+# =========================
+# ルール＋ローカルモデルで判定し、曖昧な場合のみ LLM を呼ぶ（"0" で常に LLM）
+INTENT_LOCAL_CLASSIFIER: bool = os.getenv("INTENT_LOCAL_CLASSIFIER", "1") != "0"
+
+# ローカルモデルの確信度がこの値以上（または 1 - この値以下）ならローカルで確定する
+INTENT_LOCAL_THRESHOLD: float = float(os.getenv("INTENT_LOCAL_THRESHOLD", "0.9"))
+
+# 判定結果のキャッシュ件数（正規化した入力ごと）
+INTENT_CACHE_SIZE: int = int(os.getenv("INTENT_CACHE_SIZE", "4096"))
+
+# LLM の判定ログ（学習データ）と学習済みモデルの保存先
+INTENT_LOG_PATH = DATA_DIR / "intent_decisions.jsonl"
+INTENT_MODEL_PATH = DATA_DIR / "intent_model.json"
+
+
+# =========================
+# 回答キャッシュ
+# =========================
+# 同じ質問（＋同じ履歴・同じインデックス世代）への回答を再利用する（"0" で無効）
+ANSWER_CACHE_ENABLED: bool = os.getenv("ANSWER_CACHE_ENABLED", "1") != "0"
+ANSWER_CACHE_SIZE: int = int(os.getenv("ANSWER_CACHE_SIZE", "512"))
+ANSWER_CACHE_TTL_SEC: float = float(os.getenv("ANSWER_CACHE_TTL_SEC", "3600"))
+
+# 類似質問でもヒットさせる埋め込み類似度のしきい値（0 で完全一致のみ）
+ANSWER_CACHE_SIMILARITY: float = float(os.getenv("ANSWER_CACHE_SIMILARITY", "0"))
+
+# =========================
+# 会話履歴の圧縮
+# =========================
+# 直近のターンより古い会話の扱い: "truncate"（捨てる）/ "summary"（要約にまとめる）/ "retrieval"（質問に関連するターンだけ残す）
+HISTORY_POLICY: str = os.getenv("HISTORY_POLICY", "summary")
+
+# 原文のまま残す直近のターンのトークン数の上限
+HISTORY_RECENT_TOKENS: int = int(os.getenv("HISTORY_RECENT_TOKENS", "1000"))
+
+# 要約のトークン数の目安と、要約のキャッシュ件数（会話の先頭からのターンごと）
+HISTORY_SUMMARY_MAX_TOKENS: int = int(os.getenv("HISTORY_SUMMARY_MAX_TOKENS", "400"))
+HISTORY_SUMMARY_CACHE_SIZE: int = int(os.getenv("HISTORY_SUMMARY_CACHE_SIZE", "1024"))
+
+# 要約の更新（裏で実行）が間に合っていないターンを、原文のまま追加で残すトークン数の上限
+HISTORY_SUMMARY_PENDING_TOKENS: int = int(os.getenv("HISTORY_SUMMARY_PENDING_TOKENS", "800"))
+
+# retrieval 方針で、質問に関連する古いターンとして残すトークン数の上限
+HISTORY_RETRIEVAL_TOKENS: int = int(os.getenv("HISTORY_RETRIEVAL_TOKENS", "600"))
+
+# =========================
+# 会話セッション（サーバー側の履歴）
+# =========================
+# session_id を指定したリクエストでは、会話履歴をサーバー側に保存・読み出しする
+SESSION_STORE_ENABLED: bool = os.getenv("SESSION_STORE_ENABLED", "1") != "0"
+SESSION_STORE_PATH = DATA_DIR / "sessions.sqlite3"
+
+# 履歴をメモリに保持するセッション数の上限（LRU）
+SESSION_CACHE_SIZE: int = int(os.getenv("SESSION_CACHE_SIZE", "256"))
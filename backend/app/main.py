@@ -12,7 +12,15 @@ from fastapi.middleware.cors import CORSMiddleware
 # documents: 文書管理（アップロード・一覧・削除など）
 # agent: エージェント対話機能
 from app.routers import documents, agent
-from app.routers.documents import get_retriever  # 起動時にインデックスの状態を確認するため
+from app.rag.registry import registry  # 共有リソース（RAGRetriever）の起動・終了・readiness 管理
+from app.services import blocking_pool  # ブロッキング処理用の共有スレッドプール
+from app.services import parse_pool  # 文書パース用のプロセスプール
+from app.services.ingest_jobs import job_queue  # 文書取り込みのバックグラウンドジョブ
+from app.services.session_store import session_store  # サーバー側の会話セッション
+from app.agent.nodes import speculation_stats  # 投機的検索のヒット率
+from app.agent.intent_classifier import intent_classifier  # 意図分類の LLM エスカレーション率
+from app.agent.answer_cache import answer_cache  # 回答キャッシュのヒット率
+from app.tools.web_search import cache_stats as web_search_cache_stats  # Web検索キャッシュのヒット率
 
 # FastAPI アプリケーションのインスタンス作成
 app = FastAPI()
@@ -37,23 +45,31 @@ app.include_router(documents.router)
 app.include_router(agent.router)
 
 # =========================
-# 起動時イベント
+# 起動時・終了時イベント
 # =========================
 @app.on_event("startup")
 def startup_event():
     """
     アプリケーション起動時に実行される処理。
-    RAG用のベクトルDB（Chroma）のインデックス状態を確認し、ログ出力します。
+    共有 RAGRetriever を生成し、コレクション読み込みとダミー検索でウォームアップします。
+    その後、文書取り込みジョブのワーカーを起動します（前回未完了のジョブも再開します）。
+    失敗してもアプリ自体は停止させず、readiness 状態として記録します。
     """
-    try:
-        # RAGRetriever のインスタンスを取得（シングルトン的な挙動）
-        retriever = get_retriever()
-        # 現在登録されているチャンク数を取得
-        count = retriever.collection.count()
-        print(f"アプリケーション起動: インデックス確認完了（{count}件のチャンクが登録されています）")
-    except Exception as e:
-        # 起動時のエラーはログに出力するが、アプリ自体は停止させない
-        print(f"警告: 起動時のインデックス確認に失敗しました: {e}")
+    registry.startup()
+    job_queue.start()
+
+
+@app.on_event("shutdown")
+def shutdown_event():
+    """
+    アプリケーション終了時に実行される処理。
+    共有リソース（Chroma クライアント・スレッドプールなど）をクローズします。
+    """
+    job_queue.shutdown()
+    session_store.close()
+    registry.shutdown()
+    blocking_pool.shutdown()
+    parse_pool.shutdown()
 
 # =========================
 # ヘルスチェック
@@ -62,5 +78,16 @@ def startup_event():
 async def root():
     """
     サーバーの稼働確認（ヘルスチェック）用エンドポイント。
+    RAG リソースの readiness（ready / starting / error など）もあわせて返します。
     """
-    return {"status": "ok", "message": "general-ai-agent backend is running"}
+    return {
+        "status": "ok",
+        "message": "general-ai-agent backend is running",
+        "rag": registry.status(),
+        "speculation": speculation_stats(),
+        "intent_classifier": intent_classifier.stats(),
+        "answer_cache": answer_cache.stats(),
+        "ingest_jobs": job_queue.stats(),
+        "sessions": session_store.stats(),
+        "web_search_cache": web_search_cache_stats(),
+    }
@@ -0,0 +1,336 @@
+# backend/app/rag/article_index.py
+# 条・項・号の構造索引
+# - 取り込み時に本文の行を走査し、(文書ID, 条番号・項番号・号番号) → 本文上の範囲（char_start / char_end）を記録する
+# - 見出し（「第5条（解除）」の括弧内、または条の直前の行の「（解除）」）も記録する
+# - 質問に「第5条」「第5条第2項」などの条番号があれば、ベクトル検索をせずにこの索引と文書ストアから条文を直接取り出す
+
+import re
+import sqlite3
+import threading
+import unicodedata
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Dict, Iterable, Iterator, List, NamedTuple, Optional, Tuple, Union
+
+from app import config
+from app.rag.chunker import _NUM, ARTICLE_HEADING, MARKDOWN_HEADING, parse_number
+
+# 章・節・款の見出し（直前の条はここで終わる）
+CHAPTER_HEADING = re.compile(rf"^[ \t　]*第[ \t　]*{_NUM}[ \t　]*[章節款]")
+# 条の直前の行に置かれる見出し（例: "（秘密保持）"）
+CAPTION = re.compile(r"^[ \t　]*[（(]([^（）()\n]{1,40})[)）][ \t　]*$")
+# 項の行頭（例: "２　…", "2. …", "第2項"）。第1項は条の見出しの直後から始まるので番号を持たない
+PARAGRAPH = re.compile(rf"^[ \t　]*(?:第({_NUM})項|([0-9０-９]+)[ \t　．.])")
+# 号の行頭（例: "一　…"）
+ITEM = re.compile(r"^[ \t　]*([一二三四五六七八九十]+)[ \t　、．.]")
+
+# 質問中の条番号（例: "第5条", "5条の2", "第5条第2項第1号", "第五条2項"）
+# 「民法第5条」のような法令の条文は手元の文書の条ではないので除く
+ARTICLE_REF = re.compile(
+    rf"(?<![法令則第0-9０-９一二三四五六七八九十百千])第?[ 　]*({_NUM})[ 　]*条"
+    rf"(?:の({_NUM})(?![つ個]))?"
+    rf"(?:[ 　]*第?[ 　]*({_NUM})[ 　]*項)?"
+    rf"(?:[ 　]*第?[ 　]*({_NUM})[ 　]*号)?"
+)
+
+
+@dataclass
+class Section:
+    article: int
+    sub: int             # 枝番（「第5条の2」の 2。なければ 0）
+    paragraph: int       # 項番号（条全体なら 0）
+    item: int            # 号番号（項全体・条全体なら 0）
+    label: str           # 例: "第5条第2項"
+    heading: str         # 条の見出し（なければ ""）
+    start: int
+    end: int
+
+
+class ArticleRef(NamedTuple):
+    article: int
+    sub: int = 0
+    paragraph: int = 0
+    item: int = 0
+
+
+def _inline_heading(rest: str) -> str:
+    # 「第5条（解除）」の括弧内を見出しとする
+    m = re.match(r"[ \t　]*[（(]([^（）()\n]{1,40})[)）]", rest)
+    return m.group(1).strip() if m else ""
+
+
+def _article_label(text: str) -> str:
+    return unicodedata.normalize("NFKC", text).replace(" ", "").replace("　", "")
+
+
+class SectionScanner:
+    """
+    文書のテキストを流しながら、条・項・号の範囲を集める。
+    wrap() で包んだ content を読み終えたあと（または finish() のあと）、sections に結果が入る。
+    """
+
+    def __init__(self):
+        self.sections: List[Section] = []
+        self._buffer = ""
+        self._offset = 0
+        self._last_end = 0        # 直前の空でない行の終了位置
+        self._caption: Optional[Tuple[int, str, int]] = None  # (開始位置, 見出し, その前の行の終了位置)
+        self._article: Optional[Section] = None
+        self._paragraphs: List[Section] = []
+        self._paragraph: Optional[Section] = None
+        self._item: Optional[Section] = None
+        self._finished = False
+
+    # ---- 入力 ----
+
+    def wrap(self, content: Union[str, Iterable[str]]) -> Union[str, Iterable[str]]:
+        if isinstance(content, str):
+            self.feed(content)
+            self.finish()
+            return content
+        return self._iter(content)
+
+    def _iter(self, pieces: Iterable[str]) -> Iterator[str]:
+        for piece in pieces:
+            self.feed(piece)
+            yield piece
+        self.finish()
+
+    def feed(self, text: str) -> None:
+        self._buffer += text
+        while True:
+            pos = self._buffer.find("\n")
+            if pos < 0:
+                break
+            self._line(self._buffer[:pos + 1])
+            self._buffer = self._buffer[pos + 1:]
+
+    def finish(self) -> List[Section]:
+        if not self._finished:
+            if self._buffer:
+                self._line(self._buffer)
+                self._buffer = ""
+            self._close_article(self._last_end)
+            self._finished = True
+        return self.sections
+
+    # ---- 行ごとの処理 ----
+
+    def _line(self, line: str) -> None:
+        offset = self._offset
+        self._offset += len(line)
+        if not line.strip():
+            return
+        start = offset + len(line) - len(line.lstrip())
+        end = offset + len(line.rstrip())
+
+        m = ARTICLE_HEADING.match(line)
+        number = parse_number(m.group(2)) if m else None
+        if number is not None:
+            caption = self._caption
+            self._close_article(caption[2] if caption else self._last_end)
+            label = _article_label(m.group(1))
+            sub = label.split("の", 1)[1] if "の" in label else ""
+            self._article = Section(
+                article=number,
+                sub=(parse_number(sub) or 0) if sub else 0,
+                paragraph=0,
+                item=0,
+                label=label,
+                heading=_inline_heading(line[m.end():]) or (caption[1].strip() if caption else ""),
+                start=caption[0] if caption else start,
+                end=end,
+            )
+            self._paragraph = self._sub_section(paragraph=1, start=self._article.start)
+            self._caption = None
+            self._last_end = end
+            return
+
+        if CHAPTER_HEADING.match(line) or MARKDOWN_HEADING.match(line):
+            self._close_article(self._last_end)
+            self._caption = None
+            self._last_end = end
+            return
+
+        caption = CAPTION.match(line)
+        self._caption = (start, caption.group(1), self._last_end) if caption else None
+        if self._article is not None and caption is None:
+            self._mark_clause(line, start)
+        self._last_end = end
+
+    def _mark_clause(self, line: str, start: int) -> None:
+        # 番号が直前の項・号の続き（+1）のときだけ、新しい項・号の始まりとみなす
+        m = PARAGRAPH.match(line)
+        number = self._paragraph.paragraph + 1
+        if m and parse_number(m.group(1) or m.group(2)) == number:
+            self._close_item(self._last_end)
+            self._close_paragraph(self._last_end)
+            self._paragraph = self._sub_section(paragraph=number, start=start)
+            return
+        m = ITEM.match(line)
+        current = self._item.item if self._item is not None else 0
+        if m and parse_number(m.group(1)) == current + 1:
+            self._close_item(self._last_end)
+            self._item = self._sub_section(paragraph=self._paragraph.paragraph, item=current + 1, start=start)
+
+    def _sub_section(self, paragraph: int, start: int, item: int = 0) -> Section:
+        article = self._article
+        label = f"{article.label}第{paragraph}項"
+        if item:
+            label += f"第{item}号"
+        return Section(
+            article=article.article, sub=article.sub, paragraph=paragraph, item=item,
+            label=label, heading=article.heading, start=start, end=start,
+        )
+
+    def _close_item(self, end: int) -> None:
+        if self._item is not None:
+            self._item.end = end
+            self.sections.append(self._item)
+            self._item = None
+
+    def _close_paragraph(self, end: int) -> None:
+        if self._paragraph is not None:
+            self._paragraph.end = end
+            self._paragraphs.append(self._paragraph)
+            self._paragraph = None
+
+    def _close_article(self, end: int) -> None:
+        if self._article is None:
+            return
+        self._close_item(end)
+        self._close_paragraph(end)
+        self._article.end = end
+        self.sections.append(self._article)
+        # 項が1つしかない条は、条全体と同じ範囲なので記録しない
+        if len(self._paragraphs) > 1:
+            self.sections.extend(self._paragraphs)
+        self._article = None
+        self._paragraphs = []
+
+
+def scan_sections(text: str) -> List[Section]:
+    scanner = SectionScanner()
+    scanner.wrap(text)
+    return scanner.sections
+
+
+def parse_article_refs(question: str) -> List[ArticleRef]:
+    """
+    質問文から条番号の指定を取り出す（出てきた順、重複は除く）。
+    """
+    refs: List[ArticleRef] = []
+    for m in ARTICLE_REF.finditer(question):
+        article = parse_number(m.group(1))
+        if article is None:
+            continue
+        ref = ArticleRef(
+            article=article,
+            sub=(parse_number(m.group(2)) or 0) if m.group(2) else 0,
+            paragraph=(parse_number(m.group(3)) or 0) if m.group(3) else 0,
+            item=(parse_number(m.group(4)) or 0) if m.group(4) else 0,
+        )
+        if ref not in refs:
+            refs.append(ref)
+    return refs
+
+
+class ArticleIndex:
+    """
+    (文書ID, 条・項・号) → 本文上の範囲 を保存する SQLite のテーブル。
+    """
+
+    def __init__(self, path: Path = config.ARTICLE_INDEX_PATH):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(str(self.path), check_same_thread=False)
+        with self._lock:
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS sections ("
+                "doc_id TEXT NOT NULL, article INTEGER NOT NULL, sub INTEGER NOT NULL, "
+                "paragraph INTEGER NOT NULL, item INTEGER NOT NULL, label TEXT NOT NULL, "
+                "heading TEXT NOT NULL, char_start INTEGER NOT NULL, char_end INTEGER NOT NULL)"
+            )
+            self._conn.execute(
+                "CREATE INDEX IF NOT EXISTS sections_number ON sections (article, sub, paragraph, item)"
+            )
+            self._conn.execute("CREATE INDEX IF NOT EXISTS sections_doc ON sections (doc_id)")
+            # 走査済みの文書（条が1つもない文書も含む）。起動時の同期で走査し直さないために使う
+            self._conn.execute("CREATE TABLE IF NOT EXISTS documents (doc_id TEXT PRIMARY KEY)")
+            self._conn.commit()
+
+    def put_many(self, documents: Dict[str, List[Section]]) -> None:
+        """
+        文書ごとの条・項・号をまとめて入れ替える（1トランザクション）。
+        """
+        with self._lock:
+            with self._conn:
+                for doc_id, sections in documents.items():
+                    self._conn.execute("DELETE FROM sections WHERE doc_id = ?", (doc_id,))
+                    self._conn.execute("INSERT OR IGNORE INTO documents (doc_id) VALUES (?)", (doc_id,))
+                    self._conn.executemany(
+                        "INSERT INTO sections (doc_id, article, sub, paragraph, item, label, heading, "
+                        "char_start, char_end) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                        [
+                            (doc_id, s.article, s.sub, s.paragraph, s.item, s.label, s.heading, s.start, s.end)
+                            for s in sections
+                        ],
+                    )
+
+    def remove(self, doc_id: str) -> None:
+        with self._lock:
+            with self._conn:
+                self._conn.execute("DELETE FROM sections WHERE doc_id = ?", (doc_id,))
+                self._conn.execute("DELETE FROM documents WHERE doc_id = ?", (doc_id,))
+
+    def clear(self) -> None:
+        with self._lock:
+            with self._conn:
+                self._conn.execute("DELETE FROM sections")
+                self._conn.execute("DELETE FROM documents")
+
+    def document_ids(self) -> set:
+        with self._lock:
+            return {row[0] for row in self._conn.execute("SELECT doc_id FROM documents")}
+
+    def find(self, ref: ArticleRef) -> List[Tuple[str, Section]]:
+        """
+        条・項・号に一致する範囲を返す。指定された項・号が記録されていなければ、上位（項 → 条）で探し直す。
+        （「第1号」のように項を省略した号は第1項の号とみなす）
+        """
+        paragraph = ref.paragraph or (1 if ref.item else 0)
+        for p, i in ((paragraph, ref.item), (paragraph, 0), (0, 0)):
+            with self._lock:
+                rows = self._conn.execute(
+                    "SELECT doc_id, article, sub, paragraph, item, label, heading, char_start, char_end "
+                    "FROM sections WHERE article = ? AND sub = ? AND paragraph = ? AND item = ? "
+                    "ORDER BY doc_id, char_start",
+                    (ref.article, ref.sub, p, i),
+                ).fetchall()
+            if rows:
+                return [(row[0], Section(*row[1:])) for row in rows]
+        return []
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+
+
+def sync_with_store(index: ArticleIndex, doc_ids: Iterable[str], read_text) -> int:
+    """
+    まだ走査していない文書（索引を導入する前に登録した文書など）を、文書ストアの全文から走査して追加する。
+    :param read_text: doc_id → 全文（保存されていなければ None）
+    :return: 追加した文書数
+    """
+    indexed = index.document_ids()
+    added: Dict[str, List[Section]] = {}
+    for doc_id in doc_ids:
+        if doc_id in indexed:
+            continue
+        text = read_text(doc_id)
+        if text is not None:
+            added[doc_id] = scan_sections(text)
+    if added:
+        index.put_many(added)
+    return len(added)
@@ -1,4 +1,5 @@
 # backend/scripts/build_index.py
+import argparse           # コマンドライン引数（--incremental / --full）の解析用
 from pathlib import Path  # パス操作用
 import sys                # sys.path をいじるため
 
@@ -9,9 +10,27 @@ BASE_DIR = Path(__file__).resolve().parent.parent
 # → "from app.rag.index_builder import ..." ができるようになる
 sys.path.append(str(BASE_DIR))
 
-from app.rag.index_builder import build_index  # noqa: E402  # 上でsys.pathをいじった後にimportしているので警告抑制
+from app.rag.index_builder import build_index, format_summary  # noqa: E402  # 上でsys.pathをいじった後にimportしているので警告抑制
+
+
+def parse_args(argv=None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="documents/ から RAG インデックスを構築します。")
+    mode = parser.add_mutually_exclusive_group()
+    mode.add_argument(
+        "--incremental",
+        action="store_true",
+        help="マニフェストと比較し、追加・変更・削除されたファイルだけを反映する",
+    )
+    mode.add_argument(
+        "--full",
+        action="store_true",
+        help="コレクションを全削除して作り直す（デフォルト）",
+    )
+    return parser.parse_args(argv)
 
 
 if __name__ == "__main__":
     # このファイルを直接実行したときに、インデックス構築処理を行う
-    build_index()
+    args = parse_args()
+    summary = build_index(incremental=args.incremental)
+    print(format_summary(summary))
@@ -0,0 +1,227 @@
+# backend/app/rag/chunker.py
+# 契約書の構造を考慮したチャンク分割
+# - 「第X条」見出し・Markdown 見出しで節を区切り、節の途中では切らないようにする
+# - 1つの節がトークン上限を超える場合だけ、項・号の行頭 → 文末（。）→ 文字数の順に細かく分ける
+# - 小さな節はトークン上限まで1つのチャンクにまとめる（重複させないので埋め込み量が増えない）
+# - 入力は文字列でも、ページごとの文字列の iterable でもよく、チャンクは順に yield する
+# - 各チャンクには元テキスト上の位置（char_start / char_end）と条番号を記録する
+
+import re
+import unicodedata
+from dataclasses import dataclass, field
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple, Union
+
+from app import config
+from app.rag.ingest_pipeline import estimate_tokens
+
+
+_NUM = r"[0-9０-９一二三四五六七八九十百千]+"
+
+# 条の見出し（例: "第12条（秘密保持）", "第十二条の2 "）
+ARTICLE_HEADING = re.compile(rf"^[ \t　]*(第[ \t　]*({_NUM})[ \t　]*条(?:の{_NUM})?)(?=[\s　（(]|$)")
+# Markdown の見出し
+MARKDOWN_HEADING = re.compile(r"^#{1,6}[ \t]")
+# 項・号の行頭（例: "２　…", "第2項", "一　…", "(1)", "①"）
+CLAUSE_ITEM = re.compile(
+    rf"^[ \t　]*(?:第{_NUM}項|[0-9０-９]+[ \t　．.]|[一二三四五六七八九十]+[ \t　、．.]"
+    rf"|[（(]{_NUM}[)）]|[①-⑳])"
+)
+# 文の区切り（句点・感嘆符・疑問符・改行の直後）
+SENTENCE_END = re.compile(r"(?<=[。！？!?\n])")
+
+# 改行が来ないまま入力が続いた場合に、1行として扱う最大文字数
+MAX_LINE_CHARS = 65536
+
+_KANJI_DIGITS = {"一": 1, "二": 2, "三": 3, "四": 4, "五": 5, "六": 6, "七": 7, "八": 8, "九": 9}
+_KANJI_UNITS = {"十": 10, "百": 100, "千": 1000}
+
+
+def parse_number(text: str) -> Optional[int]:
+    """
+    算用数字（全角含む）・漢数字の番号を整数にする（例: "12" / "１２" / "十二" → 12）。
+    """
+    text = unicodedata.normalize("NFKC", text)
+    if text.isdigit():
+        return int(text)
+    total, current = 0, 0
+    for ch in text:
+        if ch in _KANJI_DIGITS:
+            current = _KANJI_DIGITS[ch]
+        elif ch in _KANJI_UNITS:
+            total += (current or 1) * _KANJI_UNITS[ch]
+            current = 0
+        else:
+            return None
+    return total + current or None
+
+
+@dataclass
+class Chunk:
+    text: str
+    start: int                      # 元テキスト上の開始位置（文字単位）
+    end: int                        # 元テキスト上の終了位置（この位置の文字は含まない）
+    articles: List[Tuple[str, int]] = field(default_factory=list)  # [(見出し, 条番号), ...]
+
+    def metadata(self) -> Dict:
+        """
+        Chroma のメタデータに追加する位置・条番号の情報
+        """
+        meta: Dict = {"char_start": self.start, "char_end": self.end}
+        if self.articles:
+            meta["article"] = self.articles[0][0]
+            meta["article_start"] = self.articles[0][1]
+            meta["article_end"] = self.articles[-1][1]
+        return meta
+
+
+def _iter_lines(source: Union[str, Iterable[str]]) -> Iterator[str]:
+    """
+    入力を改行付きの行に分けて順に返す（行をつなげると元のテキストに戻る）。
+    """
+    if isinstance(source, str):
+        for m in re.finditer(r"[^\n]*\n|[^\n]+$", source):
+            yield m.group()
+        return
+
+    buffer = ""
+    for piece in source:
+        buffer += piece
+        while True:
+            pos = buffer.find("\n")
+            if pos < 0:
+                break
+            yield buffer[:pos + 1]
+            buffer = buffer[pos + 1:]
+        if len(buffer) > MAX_LINE_CHARS:
+            yield buffer
+            buffer = ""
+    if buffer:
+        yield buffer
+
+
+def _article_of(line: str) -> Optional[Tuple[str, int]]:
+    m = ARTICLE_HEADING.match(line)
+    if not m:
+        return None
+    label = unicodedata.normalize("NFKC", m.group(1)).replace(" ", "")
+    number = parse_number(m.group(2))
+    return (label, number) if number is not None else None
+
+
+class _Packer:
+    """
+    連続するテキスト片をトークン上限まで1つのチャンクに詰める。
+    """
+
+    def __init__(self, max_tokens: int):
+        self.max_tokens = max_tokens
+        self.parts: List[str] = []
+        self.start = 0
+        self.tokens = 0
+        self.articles: List[Tuple[str, int]] = []
+
+    def fits(self, tokens: int) -> bool:
+        return self.tokens + tokens <= self.max_tokens
+
+    def add(self, text: str, offset: int, tokens: int, article: Optional[Tuple[str, int]]) -> Iterator[Chunk]:
+        if self.parts and not self.fits(tokens):
+            yield from self.flush()
+        if not self.parts:
+            self.start = offset
+        self.parts.append(text)
+        self.tokens += tokens
+        if article is not None and article not in self.articles:
+            self.articles.append(article)
+
+    def add_split(self, text: str, offset: int, article: Optional[Tuple[str, int]]) -> Iterator[Chunk]:
+        """
+        上限を超えるテキストは文末 → 文字数の順に分けてから詰める。
+        """
+        tokens = estimate_tokens(text)
+        if tokens <= self.max_tokens:
+            yield from self.add(text, offset, tokens, article)
+            return
+        for sentence in SENTENCE_END.split(text):
+            if not sentence:
+                continue
+            sentence_tokens = estimate_tokens(sentence)
+            if sentence_tokens <= self.max_tokens:
+                yield from self.add(sentence, offset, sentence_tokens, article)
+            else:
+                # 句点のない長文は文字数で切る（日本語は1文字≒1トークン）
+                for i in range(0, len(sentence), self.max_tokens):
+                    piece = sentence[i:i + self.max_tokens]
+                    yield from self.add(piece, offset + i, estimate_tokens(piece), article)
+            offset += len(sentence)
+
+    def flush(self) -> Iterator[Chunk]:
+        if not self.parts:
+            return
+        text = "".join(self.parts)
+        start, end = self.start, self.start + len(text)
+        stripped = text.strip()
+        if stripped:
+            lead = len(text) - len(text.lstrip())
+            yield Chunk(
+                text=stripped,
+                start=start + lead,
+                end=start + lead + len(stripped),
+                articles=self.articles,
+            )
+        self.parts, self.tokens, self.articles = [], 0, []
+
+
+def iter_chunks(
+    source: Union[str, Iterable[str]],
+    max_tokens: int = config.CHUNK_MAX_TOKENS,
+) -> Iterator[Chunk]:
+    """
+    テキスト（またはページごとのテキストの iterable）を構造に沿ってチャンクに分け、順に返す。
+    """
+    packer = _Packer(max_tokens)
+
+    # 現在の節（条・Markdown 見出しで始まるまとまり）
+    section: List[Tuple[str, int]] = []
+    section_tokens = 0
+    section_article: Optional[Tuple[str, int]] = None
+    overflow = False  # 節が上限を超え、行ごとに詰めている途中か
+
+    def end_section() -> Iterator[Chunk]:
+        nonlocal section, section_tokens, overflow
+        if overflow:
+            # 長い節は行ごとに詰め終わっている。その続きに次の節を混ぜない
+            yield from packer.flush()
+        elif section:
+            # 条の途中で切らないよう、入りきらなければ新しいチャンクから始める
+            yield from packer.add("".join(l for l, _ in section), section[0][1], section_tokens, section_article)
+        section, section_tokens, overflow = [], 0, False
+
+    offset = 0
+    for line in _iter_lines(source):
+        article = _article_of(line)
+        if article is not None or MARKDOWN_HEADING.match(line):
+            yield from end_section()
+            # Markdown の見出しで条の範囲は終わったとみなす
+            section_article = article
+
+        if overflow:
+            # 項・号の行頭で、チャンクが半分以上埋まっていればそこで区切る
+            if CLAUSE_ITEM.match(line) and packer.tokens * 2 >= max_tokens:
+                yield from packer.flush()
+            yield from packer.add_split(line, offset, section_article)
+        else:
+            section.append((line, offset))
+            section_tokens += estimate_tokens(line)
+            if section_tokens > max_tokens:
+                # 節が上限を超えたので、ここまでの行を項・号の区切りを優先しつつ詰めていく
+                overflow = True
+                yield from packer.flush()
+                for buffered, buffered_offset in section:
+                    if CLAUSE_ITEM.match(buffered) and packer.tokens * 2 >= max_tokens:
+                        yield from packer.flush()
+                    yield from packer.add_split(buffered, buffered_offset, section_article)
+                section = []
+        offset += len(line)
+
+    yield from end_section()
+    yield from packer.flush()
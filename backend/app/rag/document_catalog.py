@@ -0,0 +1,263 @@
+# backend/app/rag/document_catalog.py
+# 登録済み文書の一覧（カタログ）
+# - 文書ごとに doc_id・タイトル・チャンク数・サイズ・内容ハッシュ・登録日時を SQLite に保存する
+# - 文書の追加・削除のたびにトランザクションで更新し、総チャンク数もメモリ上に保持する
+# - 文書一覧・件数の確認で Chroma を読まずに済むようにする（Chroma と食い違っていれば起動時に作り直す）
+
+import hashlib
+import sqlite3
+import threading
+import time
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple, Union
+
+from app import config
+
+# 一覧の並び替えに使える列
+SORT_FIELDS = ("created_at", "updated_at", "title", "chunk_count", "size")
+
+# IN 句に渡すハッシュの最大数（SQLite の変数の上限より小さくしておく）
+_IN_BATCH = 500
+
+
+@dataclass
+class CatalogEntry:
+    doc_id: str
+    title: str
+    chunk_count: int
+    size: int                            # 登録したテキストのバイト数（UTF-8）
+    sha256: Optional[str] = None         # 登録したテキストのハッシュ
+    source_sha256: Optional[str] = None  # 元ファイルのハッシュ（アップロード・一括登録のとき）
+
+
+class ContentMeter:
+    """
+    文書のテキストを流しながら、バイト数とハッシュを数える。
+    """
+
+    def __init__(self):
+        self.size = 0
+        self._digest = hashlib.sha256()
+
+    def _update(self, text: str) -> None:
+        data = text.encode("utf-8")
+        self.size += len(data)
+        self._digest.update(data)
+
+    def wrap(self, content: Union[str, Iterable[str]]) -> Union[str, Iterable[str]]:
+        if isinstance(content, str):
+            self._update(content)
+            return content
+        return self._iter(content)
+
+    def _iter(self, pieces: Iterable[str]) -> Iterator[str]:
+        for piece in pieces:
+            self._update(piece)
+            yield piece
+
+    @property
+    def sha256(self) -> str:
+        return self._digest.hexdigest()
+
+
+class DocumentCatalog:
+    """
+    doc_id → 文書情報 を保存する SQLite のテーブル。
+    """
+
+    def __init__(self, path: Path = config.DOCUMENT_CATALOG_PATH):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(str(self.path), check_same_thread=False)
+        with self._lock:
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS documents ("
+                "doc_id TEXT PRIMARY KEY, title TEXT NOT NULL, chunk_count INTEGER NOT NULL, "
+                "size INTEGER NOT NULL, sha256 TEXT, source_sha256 TEXT, "
+                "created_at REAL NOT NULL, updated_at REAL NOT NULL)"
+            )
+            self._conn.execute(
+                "CREATE INDEX IF NOT EXISTS documents_source_sha256 ON documents (source_sha256)"
+            )
+            # document_id を持たないチャンク（古い形式のデータなど）の数
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS catalog_meta (key TEXT PRIMARY KEY, value INTEGER NOT NULL)"
+            )
+            self._conn.commit()
+            self._total = self._load_total()
+
+    def _load_total(self) -> int:
+        # ロックを保持した状態で呼ぶこと
+        (documents,) = self._conn.execute("SELECT COALESCE(SUM(chunk_count), 0) FROM documents").fetchone()
+        row = self._conn.execute("SELECT value FROM catalog_meta WHERE key = 'untracked_chunks'").fetchone()
+        return documents + (row[0] if row else 0)
+
+    @property
+    def total_chunks(self) -> int:
+        """
+        コレクション全体のチャンク数（メモリ上の値を返すだけなので Chroma にも SQLite にもアクセスしない）
+        """
+        return self._total
+
+    def __len__(self) -> int:
+        with self._lock:
+            (count,) = self._conn.execute("SELECT COUNT(*) FROM documents").fetchone()
+        return count
+
+    # ---- 更新 ----
+
+    def put_many(self, entries: Iterable[CatalogEntry]) -> None:
+        """
+        文書情報をまとめて追加・更新する（1トランザクション）。既存の文書は登録日時を引き継ぐ。
+        """
+        with self._lock:
+            with self._conn:
+                self._put(entries)
+            self._total = self._load_total()
+
+    def _put(self, entries: Iterable[CatalogEntry]) -> None:
+        # ロックを保持し、トランザクションの中で呼ぶこと
+        now = time.time()
+        for entry in entries:
+            self._conn.execute(
+                "INSERT INTO documents (doc_id, title, chunk_count, size, sha256, source_sha256, "
+                "created_at, updated_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?) "
+                "ON CONFLICT(doc_id) DO UPDATE SET title = excluded.title, "
+                "chunk_count = excluded.chunk_count, size = excluded.size, sha256 = excluded.sha256, "
+                "source_sha256 = excluded.source_sha256, updated_at = excluded.updated_at",
+                (entry.doc_id, entry.title, entry.chunk_count, entry.size, entry.sha256,
+                 entry.source_sha256, now, now),
+            )
+
+    def remove(self, doc_id: str) -> bool:
+        with self._lock:
+            with self._conn:
+                removed = self._conn.execute("DELETE FROM documents WHERE doc_id = ?", (doc_id,)).rowcount
+            self._total = self._load_total()
+        return removed > 0
+
+    def replace_all(self, entries: Iterable[CatalogEntry], untracked_chunks: int = 0) -> None:
+        """
+        カタログ全体を入れ替える（インデックスの全件構築・作り直し用）。
+        """
+        with self._lock:
+            with self._conn:
+                self._conn.execute("DELETE FROM documents")
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO catalog_meta (key, value) VALUES ('untracked_chunks', ?)",
+                    (untracked_chunks,),
+                )
+                self._put(entries)
+            self._total = self._load_total()
+
+    # ---- 参照 ----
+
+    def get(self, doc_id: str) -> Optional[Dict]:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT doc_id, title, chunk_count, size, sha256, source_sha256, created_at, updated_at "
+                "FROM documents WHERE doc_id = ?",
+                (doc_id,),
+            ).fetchone()
+        return _to_dict(row) if row else None
+
+    def list(
+        self,
+        offset: int = 0,
+        limit: Optional[int] = None,
+        sort: str = "created_at",
+        descending: bool = False,
+    ) -> Tuple[List[Dict], int]:
+        """
+        文書の一覧を並び替えて返す。
+        :return: (そのページの文書, 全文書数)
+        """
+        if sort not in SORT_FIELDS:
+            raise ValueError(f"未対応の並び替え項目です: {sort}（{' / '.join(SORT_FIELDS)} のいずれか）")
+        direction = "DESC" if descending else "ASC"
+        with self._lock:
+            (total,) = self._conn.execute("SELECT COUNT(*) FROM documents").fetchone()
+            rows = self._conn.execute(
+                "SELECT doc_id, title, chunk_count, size, sha256, source_sha256, created_at, updated_at "
+                f"FROM documents ORDER BY {sort} {direction}, doc_id {direction} LIMIT ? OFFSET ?",
+                (-1 if limit is None else limit, offset),
+            ).fetchall()
+        return [_to_dict(row) for row in rows], total
+
+    def find_by_source_hash(self, hashes: Iterable[str]) -> Dict[str, str]:
+        """
+        元ファイルのハッシュから登録済みの文書IDを引く（{source_sha256: doc_id}）。
+        """
+        hashes = list(dict.fromkeys(hashes))
+        found: Dict[str, str] = {}
+        with self._lock:
+            for i in range(0, len(hashes), _IN_BATCH):
+                batch = hashes[i:i + _IN_BATCH]
+                rows = self._conn.execute(
+                    "SELECT source_sha256, doc_id FROM documents "
+                    f"WHERE source_sha256 IN ({', '.join('?' * len(batch))}) ORDER BY created_at",
+                    batch,
+                ).fetchall()
+                for source_sha256, doc_id in rows:
+                    found.setdefault(source_sha256, doc_id)
+        return found
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+
+
+def _to_dict(row: Tuple) -> Dict:
+    doc_id, title, chunk_count, size, sha256, source_sha256, created_at, updated_at = row
+    return {
+        "document_id": doc_id,
+        "document_title": title,
+        "chunk_count": chunk_count,
+        "size": size,
+        "sha256": sha256,
+        "source_sha256": source_sha256,
+        "created_at": created_at,
+        "updated_at": updated_at,
+    }
+
+
+def sync_with_collection(catalog: DocumentCatalog, collection, page_size: int = 1000) -> Optional[int]:
+    """
+    カタログの総チャンク数がコレクションと一致しない場合、コレクションのメタデータから作り直す。
+    （カタログを導入する前のデータや、別プロセスでの更新に追従するため）
+    :return: 作り直した場合は文書数、一致していた場合は None
+    """
+    if catalog.total_chunks == collection.count():
+        return None
+
+    docs: Dict[str, CatalogEntry] = {}
+    untracked = 0
+    offset = 0
+    while True:
+        page = collection.get(include=["documents", "metadatas"], limit=page_size, offset=offset)
+        ids = page.get("ids") or []
+        if not ids:
+            break
+        for text, meta in zip(page.get("documents") or [], page.get("metadatas") or []):
+            doc_id = (meta or {}).get("document_id")
+            if not doc_id:
+                untracked += 1
+                continue
+            entry = docs.get(doc_id)
+            if entry is None:
+                entry = docs[doc_id] = CatalogEntry(
+                    doc_id=doc_id,
+                    title=meta.get("document_title") or "（タイトル不明）",
+                    chunk_count=0,
+                    size=0,
+                    source_sha256=meta.get("source_sha256"),
+                )
+            entry.chunk_count += 1
+            # 元のテキスト全体は残っていないので、チャンクの合計で近似する
+            entry.size += len((text or "").encode("utf-8"))
+        offset += len(ids)
+
+    catalog.replace_all(docs.values(), untracked_chunks=untracked)
+    return len(docs)
@@ -4,6 +4,11 @@ from pathlib import Path           # パス操作用
 from typing import List            # 型ヒント用の List
 
 from app import config             # 先ほどの config.py を読み込む
+from app.services.document_parser import (  # PDF / Word もアップロードと同じパーサーで読む
+    SUPPORTED_EXTENSIONS,
+    get_extension,
+    parse_document_bytes,
+)
 
 
 # Document という名前のシンプルなデータ構造を定義
@@ -15,12 +20,7 @@ class Document:
     content: str   # ファイルの中身（テキスト）
 
 
-def load_documents() -> List[Document]:
-    """
-    documents/ ディレクトリにある .txt / .md ファイルをすべて読み込み、
-    Document オブジェクトのリストとして返す。
-    """
-    docs: List[Document] = []
+def _check_documents_dir() -> Path:
     doc_dir = config.DOCUMENTS_DIR  # backend/documents のパス
 
     # ディレクトリ自体が存在しない場合はエラー
@@ -29,28 +29,50 @@ def load_documents() -> List[Document]:
             f"DOCUMENTS_DIR が存在しません: {doc_dir}\n"
             "デプロイ環境では documents/ ディレクトリが含まれていることを確認してください。"
         )
+    return doc_dir
+
+
+def list_document_paths() -> List[Path]:
+    """
+    documents/ ディレクトリにある対応形式（.txt / .md / .pdf / .docx など）の
+    ファイルパスをファイル名順に返す（中身は読まない）。
+    """
+    doc_dir = _check_documents_dir()
+    return sorted(
+        path for path in doc_dir.iterdir()
+        # ディレクトリや未対応の拡張子はスキップ
+        if path.is_file() and get_extension(path.name) in SUPPORTED_EXTENSIONS
+    )
+
+
+def load_document(path: Path) -> Document:
+    """
+    1ファイルを読み込み、Document を返す。
+    PDF / Word は services/document_parser でテキストを抽出する。
+    """
+    content = parse_document_bytes(path.name, path.read_bytes())
+    # ファイル名（拡張子なし）を ID・タイトルとして使う
+    return Document(id=path.stem, title=path.stem, path=path, content=content)
+
+
+def load_documents() -> List[Document]:
+    """
+    documents/ ディレクトリにある対応形式のファイルをすべて読み込み、
+    Document オブジェクトのリストとして返す。
+    """
+    docs: List[Document] = []
 
     # documents/ 配下のファイルを1つずつ見る
-    for path in doc_dir.iterdir():
-        # ディレクトリはスキップ
-        if not path.is_file():
-            continue
-        # 拡張子が .txt または .md のものだけを対象にする
-        if path.suffix.lower() not in [".txt", ".md"]:
-            continue
-
-        # ファイル内容をUTF-8で読み込む
-        content = path.read_text(encoding="utf-8")
-        # ファイル名（拡張子なし）を ID として使う
-        doc_id = path.stem
-        # ファイル名（拡張子なし）をタイトルとして使う
-        title = path.stem
-
-        # Document インスタンスを作成してリストに追加
-        docs.append(Document(id=doc_id, title=title, path=path, content=content))
+    for path in list_document_paths():
+        try:
+            docs.append(load_document(path))
+        except Exception as e:
+            # 読み取れないファイルはスキップして続行
+            detail = getattr(e, "detail", e)
+            print(f"警告: {path.name} の読み込みに失敗したためスキップします: {detail}")
 
     # 有効な文書が1つもなければエラーにする
     if not docs:
-        raise RuntimeError(f"DOCUMENTS_DIR に有効な文書がありません: {doc_dir}")
+        raise RuntimeError(f"DOCUMENTS_DIR に有効な文書がありません: {config.DOCUMENTS_DIR}")
 
     return docs
@@ -0,0 +1,284 @@
+# backend/app/rag/document_store.py
+# 文書の全文を1部だけ、圧縮してディスクに保存するストア
+# - チャンクは Chroma に本文を持たず、メタデータの位置（char_start / char_end）でこのストアを参照する
+# - 全文を一定文字数のブロックに分けてブロックごとに圧縮し、ファイルは mmap で開く
+#   （読み出しは必要なブロックだけを展開するので、長い文書でも一部分を安く取り出せる）
+# - 書き込みはストリーミングで行い、完了した時点で一時ファイルを置き換える（途中の状態は見えない）
+#
+# ファイル形式: [圧縮ブロック]... [ブロック位置の表 (uint64 × (ブロック数 + 1))] [フッター]
+#   フッター = MAGIC + (表の位置, ブロック数, ブロックの文字数, 全体の文字数)
+
+import hashlib
+import mmap
+import os
+import shutil
+import struct
+import tempfile
+import threading
+import zlib
+from collections import OrderedDict
+from pathlib import Path
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple, Union
+
+from app import config
+
+MAGIC = b"DSTORE01"
+_FOOTER = struct.Struct("<8sQQQQ")
+_OFFSET = struct.Struct("<Q")
+
+
+class DocumentWriter:
+    """
+    1文書分の全文を少しずつ受け取り、圧縮して一時ファイルに書き出す。
+    commit() で保存先に置き換え、abort() で破棄する。
+    """
+
+    def __init__(self, store: "DocumentStore", doc_id: str):
+        self.store = store
+        self.doc_id = doc_id
+        self.block_chars = store.block_chars
+        store.directory.mkdir(parents=True, exist_ok=True)
+        fd, self._tmp_path = tempfile.mkstemp(suffix=".tmp", dir=str(store.directory))
+        self._file = os.fdopen(fd, "wb")
+        self._buffer = ""
+        self._offsets: List[int] = [0]
+        self._total_chars = 0
+        self._closed = False
+
+    def _write_block(self, block: str) -> None:
+        data = zlib.compress(block.encode("utf-8"), config.DOCUMENT_STORE_COMPRESS_LEVEL)
+        self._file.write(data)
+        self._offsets.append(self._offsets[-1] + len(data))
+
+    def write(self, text: str) -> None:
+        self._buffer += text
+        self._total_chars += len(text)
+        while len(self._buffer) >= self.block_chars:
+            self._write_block(self._buffer[:self.block_chars])
+            self._buffer = self._buffer[self.block_chars:]
+
+    def wrap(self, content: Union[str, Iterable[str]]) -> Union[str, Iterable[str]]:
+        """
+        content をそのまま返しつつ、流れてきたテキストを書き出す。
+        """
+        if isinstance(content, str):
+            self.write(content)
+            return content
+        return self._iter(content)
+
+    def _iter(self, pieces: Iterable[str]) -> Iterator[str]:
+        for piece in pieces:
+            self.write(piece)
+            yield piece
+
+    def commit(self) -> None:
+        if self._closed:
+            return
+        if self._buffer:
+            self._write_block(self._buffer)
+            self._buffer = ""
+        table_offset = self._offsets[-1]
+        for offset in self._offsets:
+            self._file.write(_OFFSET.pack(offset))
+        self._file.write(_FOOTER.pack(
+            MAGIC, table_offset, len(self._offsets) - 1, self.block_chars, self._total_chars,
+        ))
+        self._file.close()
+        self._closed = True
+        os.replace(self._tmp_path, self.store.path_for(self.doc_id))
+        self.store._invalidate(self.doc_id)
+
+    def abort(self) -> None:
+        if self._closed:
+            return
+        self._file.close()
+        self._closed = True
+        try:
+            os.unlink(self._tmp_path)
+        except FileNotFoundError:
+            pass
+
+
+class _Reader:
+    """
+    保存済みの1文書を mmap で開いたもの
+    """
+
+    def __init__(self, path: Path):
+        with open(path, "rb") as f:
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, table_offset, n_blocks, block_chars, total_chars = _FOOTER.unpack_from(
+            self._mmap, len(self._mmap) - _FOOTER.size
+        )
+        if magic != MAGIC:
+            self._mmap.close()
+            raise ValueError(f"文書ストアのファイル形式が不正です: {path}")
+        self.n_blocks = n_blocks
+        self.block_chars = block_chars
+        self.total_chars = total_chars
+        self._offsets = [
+            _OFFSET.unpack_from(self._mmap, table_offset + i * _OFFSET.size)[0]
+            for i in range(n_blocks + 1)
+        ]
+
+    def block(self, index: int) -> str:
+        data = self._mmap[self._offsets[index]:self._offsets[index + 1]]
+        return zlib.decompress(data).decode("utf-8")
+
+    def close(self) -> None:
+        self._mmap.close()
+
+
+class DocumentStore:
+    """
+    doc_id → 全文 を保存するストア。
+    展開したブロックと開いたファイルは LRU でメモリに保持する。
+    """
+
+    def __init__(
+        self,
+        directory: Path = config.DOCUMENT_STORE_DIR,
+        block_chars: int = config.DOCUMENT_STORE_BLOCK_CHARS,
+        cache_blocks: int = config.DOCUMENT_STORE_CACHE_BLOCKS,
+        max_open_files: int = 64,
+    ):
+        self.directory = Path(directory)
+        self.block_chars = block_chars
+        self.cache_blocks = cache_blocks
+        self.max_open_files = max_open_files
+        self._lock = threading.Lock()
+        self._readers: "OrderedDict[str, _Reader]" = OrderedDict()
+        self._blocks: "OrderedDict[Tuple[str, int], str]" = OrderedDict()
+
+    def path_for(self, doc_id: str) -> Path:
+        # doc_id にはファイル名に使えない文字が含まれうるのでハッシュをファイル名にする
+        name = hashlib.sha256(doc_id.encode("utf-8")).hexdigest()[:40]
+        return self.directory / f"{name}.doc"
+
+    # ---- 書き込み ----
+
+    def writer(self, doc_id: str) -> DocumentWriter:
+        return DocumentWriter(self, doc_id)
+
+    def put(self, doc_id: str, text: str) -> None:
+        writer = self.writer(doc_id)
+        try:
+            writer.write(text)
+            writer.commit()
+        except BaseException:
+            writer.abort()
+            raise
+
+    def delete(self, doc_id: str) -> bool:
+        self._invalidate(doc_id)
+        try:
+            os.unlink(self.path_for(doc_id))
+            return True
+        except FileNotFoundError:
+            return False
+
+    def clear(self) -> None:
+        with self._lock:
+            for reader in self._readers.values():
+                reader.close()
+            self._readers.clear()
+            self._blocks.clear()
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+    def _invalidate(self, doc_id: str) -> None:
+        with self._lock:
+            reader = self._readers.pop(doc_id, None)
+            if reader is not None:
+                reader.close()
+            for key in [key for key in self._blocks if key[0] == doc_id]:
+                del self._blocks[key]
+
+    # ---- 読み出し ----
+
+    def _reader(self, doc_id: str) -> Optional[_Reader]:
+        # ロックを保持した状態で呼ぶこと
+        reader = self._readers.get(doc_id)
+        if reader is not None:
+            self._readers.move_to_end(doc_id)
+            return reader
+        path = self.path_for(doc_id)
+        if not path.exists():
+            return None
+        reader = self._readers[doc_id] = _Reader(path)
+        while len(self._readers) > self.max_open_files:
+            _, oldest = self._readers.popitem(last=False)
+            oldest.close()
+        return reader
+
+    def _block(self, doc_id: str, reader: _Reader, index: int) -> str:
+        # ロックを保持した状態で呼ぶこと
+        key = (doc_id, index)
+        block = self._blocks.get(key)
+        if block is not None:
+            self._blocks.move_to_end(key)
+            return block
+        block = self._blocks[key] = reader.block(index)
+        while len(self._blocks) > self.cache_blocks:
+            self._blocks.popitem(last=False)
+        return block
+
+    def length(self, doc_id: str) -> Optional[int]:
+        """
+        保存されている全文の文字数（保存されていなければ None）
+        """
+        with self._lock:
+            reader = self._reader(doc_id)
+            return reader.total_chars if reader is not None else None
+
+    def read(self, doc_id: str, start: int = 0, end: Optional[int] = None) -> Optional[str]:
+        """
+        全文の [start, end) の範囲（文字単位）を返す。保存されていなければ None。
+        """
+        with self._lock:
+            reader = self._reader(doc_id)
+            if reader is None:
+                return None
+            end = reader.total_chars if end is None else min(end, reader.total_chars)
+            start = max(0, start)
+            if start >= end:
+                return ""
+            first = start // reader.block_chars
+            last = (end - 1) // reader.block_chars
+            text = "".join(self._block(doc_id, reader, i) for i in range(first, last + 1))
+        offset = first * reader.block_chars
+        return text[start - offset:end - offset]
+
+    def chunk_text(self, meta: Dict) -> Optional[str]:
+        """
+        チャンクのメタデータ（document_id・char_start・char_end）から本文を取り出す。
+        位置の記録がない・保存されていない場合は None。
+        """
+        doc_id, start, end = meta.get("document_id"), meta.get("char_start"), meta.get("char_end")
+        if not doc_id or start is None or end is None:
+            return None
+        return self.read(doc_id, start, end)
+
+    def iter_text(self, doc_id: str) -> Iterator[str]:
+        """
+        全文をブロックごとに先頭から順に返す（展開したブロックはキャッシュに載せない）。
+        保存されていなければ何も返さない。
+        """
+        index = 0
+        while True:
+            with self._lock:
+                reader = self._reader(doc_id)
+                if reader is None or index >= reader.n_blocks:
+                    return
+                block = reader.block(index)
+            yield block
+            index += 1
+
+    def __contains__(self, doc_id: str) -> bool:
+        return self.path_for(doc_id).exists()
+
+    def close(self) -> None:
+        with self._lock:
+            for reader in self._readers.values():
+                reader.close()
+            self._readers.clear()
+            self._blocks.clear()
@@ -0,0 +1,249 @@
+# backend/app/rag/embedding_cache.py
+# 埋め込みベクトルのキャッシュ
+# - QueryEmbeddingCache: 検索クエリの埋め込みを LRU（メモリ）＋ 任意のディスク（SQLite）で保持する
+# - ChunkEmbeddingStore: 取り込み時のチャンク埋め込みを内容アドレス（テキスト + モデルのハッシュ）で保持する
+
+import hashlib
+import sqlite3
+import threading
+import unicodedata
+from array import array
+from collections import OrderedDict
+from pathlib import Path
+from typing import Callable, Dict, List, Optional, Sequence
+
+
+def normalize_query(text: str) -> str:
+    """
+    キャッシュキー用にクエリ文字列を正規化する。
+    - NFKC 正規化（全角英数・半角カナなどを統一）
+    - 前後の空白除去・連続する空白の圧縮
+    - 英字の小文字化
+    """
+    text = unicodedata.normalize("NFKC", text or "")
+    return " ".join(text.split()).lower()
+
+
+def make_key(text: str, model: str) -> str:
+    """
+    （埋め込みモデル名 + テキスト）のハッシュをキーとして返す
+    """
+    return hashlib.sha256(f"{model}\n{text}".encode("utf-8")).hexdigest()
+
+
+def _pack(vector: Sequence[float]) -> bytes:
+    return array("f", [float(v) for v in vector]).tobytes()
+
+
+def _unpack(blob: bytes) -> List[float]:
+    values = array("f")
+    values.frombytes(blob)
+    return values.tolist()
+
+
+class SQLiteEmbeddingStore:
+    """
+    key → 埋め込みベクトル を保存するシンプルな SQLite ストア。
+    ベクトルは float32 のバイト列として保存する。
+    """
+
+    def __init__(self, path: Path, table: str = "embeddings"):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.table = table
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(str(self.path), check_same_thread=False)
+        with self._lock:
+            self._conn.execute(
+                f"CREATE TABLE IF NOT EXISTS {self.table} ("
+                "key TEXT PRIMARY KEY, embedding BLOB NOT NULL)"
+            )
+            self._conn.commit()
+
+    def get(self, key: str) -> Optional[List[float]]:
+        with self._lock:
+            row = self._conn.execute(
+                f"SELECT embedding FROM {self.table} WHERE key = ?", (key,)
+            ).fetchone()
+        return _unpack(row[0]) if row else None
+
+    def get_many(self, keys: Sequence[str]) -> Dict[str, List[float]]:
+        found: Dict[str, List[float]] = {}
+        unique_keys = list(dict.fromkeys(keys))
+        # SQLite のプレースホルダ上限を超えないよう分割して問い合わせる
+        for start in range(0, len(unique_keys), 500):
+            part = unique_keys[start:start + 500]
+            placeholders = ",".join("?" for _ in part)
+            with self._lock:
+                rows = self._conn.execute(
+                    f"SELECT key, embedding FROM {self.table} WHERE key IN ({placeholders})",
+                    part,
+                ).fetchall()
+            for key, blob in rows:
+                found[key] = _unpack(blob)
+        return found
+
+    def put(self, key: str, embedding: Sequence[float]) -> None:
+        self.put_many({key: embedding})
+
+    def put_many(self, items: Dict[str, Sequence[float]]) -> None:
+        if not items:
+            return
+        with self._lock:
+            self._conn.executemany(
+                f"INSERT OR REPLACE INTO {self.table} (key, embedding) VALUES (?, ?)",
+                [(k, _pack(v)) for k, v in items.items()],
+            )
+            self._conn.commit()
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+
+
+class QueryEmbeddingCache:
+    """
+    検索クエリの埋め込みキャッシュ。
+    - メモリ上はサイズ上限付きの LRU
+    - disk_path を指定した場合は SQLite にも保存し、再起動後も再利用する
+    - キーは（正規化したクエリ + 埋め込みモデル名）
+    """
+
+    def __init__(self, model: str, max_size: int = 1024, disk_path: Optional[Path] = None):
+        self.model = model
+        self.max_size = max_size
+        self._lru: "OrderedDict[str, List[float]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._disk: Optional[SQLiteEmbeddingStore] = None
+        if disk_path is not None:
+            try:
+                self._disk = SQLiteEmbeddingStore(disk_path, table="query_embeddings")
+            except Exception as e:
+                # ディスクキャッシュが使えなくてもメモリキャッシュだけで動作させる
+                print(f"警告: [QueryEmbeddingCache] ディスクキャッシュを開けませんでした: {e}")
+
+        # 計測用カウンタ
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+    def key_for(self, query: str) -> str:
+        return make_key(normalize_query(query), self.model)
+
+    def _remember(self, key: str, embedding: List[float]) -> None:
+        # ロックを保持した状態で呼ぶこと
+        self._lru[key] = embedding
+        self._lru.move_to_end(key)
+        while len(self._lru) > self.max_size:
+            self._lru.popitem(last=False)
+
+    def get(self, query: str) -> Optional[List[float]]:
+        key = self.key_for(query)
+        with self._lock:
+            embedding = self._lru.get(key)
+            if embedding is not None:
+                self._lru.move_to_end(key)
+                self.hits += 1
+                return embedding
+
+        if self._disk is not None:
+            embedding = self._disk.get(key)
+            if embedding is not None:
+                with self._lock:
+                    self._remember(key, embedding)
+                    self.hits += 1
+                    self.disk_hits += 1
+                return embedding
+
+        with self._lock:
+            self.misses += 1
+        return None
+
+    def put(self, query: str, embedding: Sequence[float]) -> None:
+        key = self.key_for(query)
+        vector = [float(v) for v in embedding]
+        with self._lock:
+            self._remember(key, vector)
+        if self._disk is not None:
+            try:
+                self._disk.put(key, vector)
+            except Exception as e:
+                print(f"警告: [QueryEmbeddingCache] ディスクへの保存に失敗しました: {e}")
+
+    def stats(self) -> Dict:
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "size": len(self._lru),
+                "max_size": self.max_size,
+                "hits": self.hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "hit_rate": (self.hits / total) if total else 0.0,
+                "disk_enabled": self._disk is not None,
+            }
+
+    def close(self) -> None:
+        if self._disk is not None:
+            self._disk.close()
+            self._disk = None
+
+
+class ChunkEmbeddingStore:
+    """
+    チャンク埋め込みの内容アドレス型ストア。
+    キーは hash(埋め込みモデル名 + チャンク本文) なので、
+    同じ文書の再アップロードやインデックス再構築では埋め込みAPIを呼ばずに済む。
+    """
+
+    def __init__(self, model: str, path: Path):
+        self.model = model
+        self._store = SQLiteEmbeddingStore(path, table="chunk_embeddings")
+        self._lock = threading.Lock()
+
+        # 計測用カウンタ
+        self.hits = 0
+        self.misses = 0
+
+    def key_for(self, text: str) -> str:
+        return make_key(text, self.model)
+
+    def embed(
+        self,
+        texts: Sequence[str],
+        embedding_func: Callable[[List[str]], Sequence[Sequence[float]]],
+    ) -> List[List[float]]:
+        """
+        texts の埋め込みを返す。
+        ストアに存在しないもの（キャッシュミス）だけをまとめて embedding_func に渡す。
+        """
+        keys = [self.key_for(t) for t in texts]
+        found = self._store.get_many(keys)
+
+        # 未計算のテキスト（同一テキストは1回だけ計算する）
+        missing: Dict[str, str] = {}
+        for key, text in zip(keys, texts):
+            if key not in found and key not in missing:
+                missing[key] = text
+
+        if missing:
+            vectors = embedding_func(list(missing.values()))
+            computed = {
+                key: [float(v) for v in vector]
+                for key, vector in zip(missing.keys(), vectors)
+            }
+            self._store.put_many(computed)
+            found.update(computed)
+
+        with self._lock:
+            self.misses += len(missing)
+            self.hits += len(keys) - len(missing)
+
+        return [found[key] for key in keys]
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return {"hits": self.hits, "misses": self.misses}
+
+    def close(self) -> None:
+        self._store.close()
@@ -1,61 +1,219 @@
 # backend/app/rag/index_builder.py
-from typing import List
+import hashlib
+import json
+from pathlib import Path
+from typing import Dict, List, Optional
 import chromadb
 from chromadb.utils import embedding_functions
 
 from app import config
-from app.rag.document_loader import load_documents, Document
+from app.rag.document_loader import (
+    load_documents,
+    load_document,
+    list_document_paths,
+    Document,
+)
+from app.rag.article_index import ArticleIndex, scan_sections
+from app.rag.document_catalog import CatalogEntry, DocumentCatalog
+from app.rag.document_store import DocumentStore
+from app.rag.embedding_cache import ChunkEmbeddingStore
+from app.rag.ingest_pipeline import ChunkRecord, IngestionPipeline
+from app.rag.lexical_index import LexicalIndex
+from app.rag.chunker import iter_chunks
 
 
-def chunk_text(text: str, chunk_size: int = 500, overlap: int = 100) -> List[str]:
+def chunk_text(text: str, max_tokens: int = config.CHUNK_MAX_TOKENS) -> List[str]:
     """
-    長いテキストをチャンクに分割する。
+    長いテキストをチャンクに分割する（条・項・文の区切りを考慮。詳細は rag/chunker.py）。
     """
-    chunks: List[str] = []
-    start = 0
-    length = len(text)
+    return [chunk.text for chunk in iter_chunks(text, max_tokens)]
 
-    while start < length:
-        end = min(start + chunk_size, length)
-        chunk = text[start:end]
-        chunks.append(chunk)
-        if end == length:
-            break
-        start = end - overlap
 
-    return chunks
-
-
-def build_index() -> None:
+def _open_collection():
     """
-    documents/ から文書を読み込み、
-    チャンク化 → 埋め込み計算 → Chroma に登録する。
+    Chroma クライアント・埋め込み関数・コレクションを用意する。
     """
-    # 1) 文書読み込み
-    docs = load_documents()
-
-    # 2) Chroma クライアント作成
     client = chromadb.PersistentClient(path=str(config.CHROMA_DIR))
-
-    # 3) 埋め込み関数
     openai_ef = embedding_functions.OpenAIEmbeddingFunction(
         api_key=config.OPENAI_API_KEY,
         model_name=config.EMBEDDING_MODEL,
     )
-
-    collection_name = config.CHROMA_COLLECTION
-
-    # 4) 既存コレクション取得（なければ作成）
+    # 既存コレクション取得（なければ作成）
     collection = client.get_or_create_collection(
-        name=collection_name,
+        name=config.CHROMA_COLLECTION,
         embedding_function=openai_ef,
     )
+    return collection, openai_ef
+
+
+def _open_store() -> Optional[DocumentStore]:
+    """
+    文書の全文を保存するストア（無効化されている場合は None）
+    """
+    return DocumentStore(config.DOCUMENT_STORE_DIR) if config.DOCUMENT_STORE_ENABLED else None
+
+
+def _open_lexical(store: Optional[DocumentStore]) -> LexicalIndex:
+    """
+    キーワード検索用の索引（文書ストアがある場合、チャンクの本文は索引に保存しない）
+    """
+    return LexicalIndex(config.LEXICAL_INDEX_PATH, text_for=store.chunk_text if store is not None else None)
+
+
+def _chunk_records(doc: Document) -> List[ChunkRecord]:
+    """
+    文書をチャンク化し、Chroma に登録するレコードのリストを作る。
+    """
+    return [
+        ChunkRecord(
+            id=f"{doc.id}_chunk_{idx}",
+            text=chunk.text,
+            metadata={
+                "document_id": doc.id,
+                "document_title": doc.title,
+                "chunk_index": idx,
+                **chunk.metadata(),
+            },
+        )
+        for idx, chunk in enumerate(iter_chunks(doc.content))
+    ]
+
+
+def _catalog_entry(doc: Document, records: List[ChunkRecord], source_sha256: str) -> CatalogEntry:
+    """
+    文書カタログに記録する文書情報
+    """
+    content = doc.content.encode("utf-8")
+    return CatalogEntry(
+        doc_id=doc.id,
+        title=doc.title,
+        chunk_count=len(records),
+        size=len(content),
+        sha256=hashlib.sha256(content).hexdigest(),
+        source_sha256=source_sha256,
+    )
+
+
+def _add_chunks(collection, openai_ef, records: List[ChunkRecord]) -> int:
+    """
+    取り込みパイプラインでバッチごとに埋め込みを計算（内容が変わっていないチャンクは
+    ストアから再利用）し、Chroma に分割して登録する。
+    """
+    chunk_store = ChunkEmbeddingStore(
+        model=config.EMBEDDING_MODEL,
+        path=config.CHUNK_EMBEDDING_CACHE_PATH,
+    )
+    try:
+        # 全文を文書ストアに保存している場合、Chroma にはチャンクの本文を書き込まない
+        written = IngestionPipeline(
+            collection, openai_ef, chunk_store,
+            store_documents=not config.DOCUMENT_STORE_ENABLED,
+        ).run(records)
+        stats = chunk_store.stats()
+        print(f"埋め込み: キャッシュ利用 {stats['hits']} 件 / 新規計算 {stats['misses']} 件")
+    finally:
+        chunk_store.close()
+    return written
+
+
+def _delete_document_chunks(collection, doc_id: str) -> int:
+    """
+    document_id に紐づくチャンクをすべて削除し、削除件数を返す。
+    """
+    ids = collection.get(where={"document_id": doc_id}, include=[]).get("ids") or []
+    if ids:
+        collection.delete(ids=ids)
+    return len(ids)
+
+
+# =========================
+# マニフェスト（インクリメンタル構築用）
+# =========================
+
+def _file_hash(path: Path) -> str:
+    digest = hashlib.sha256()
+    with path.open("rb") as f:
+        for block in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def _fingerprint(path: Path) -> Dict:
+    """
+    マニフェストに記録するファイル情報（mtime / size / 内容ハッシュ）
+    """
+    stat = path.stat()
+    return {
+        "mtime": stat.st_mtime,
+        "size": stat.st_size,
+        "sha256": _file_hash(path),
+    }
+
+
+def load_manifest() -> Dict[str, Dict]:
+    """
+    マニフェスト（ファイル名 → {doc_id, mtime, size, sha256, chunk_count}）を読み込む。
+    存在しない・壊れている場合は空として扱う。
+    """
+    path = config.INDEX_MANIFEST_PATH
+    if not path.exists():
+        return {}
+    try:
+        return json.loads(path.read_text(encoding="utf-8")).get("files", {})
+    except Exception as e:
+        print(f"警告: マニフェストの読み込みに失敗しました（空として扱います）: {e}")
+        return {}
+
+
+def save_manifest(files: Dict[str, Dict]) -> None:
+    path = config.INDEX_MANIFEST_PATH
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = path.with_suffix(".tmp")
+    tmp_path.write_text(
+        json.dumps({"files": files}, ensure_ascii=False, indent=2),
+        encoding="utf-8",
+    )
+    # 書き込み途中で落ちてもマニフェストが壊れないよう置き換える
+    tmp_path.replace(path)
+
+
+def _empty_summary() -> Dict[str, List[str]]:
+    return {"added": [], "updated": [], "removed": [], "skipped": [], "failed": []}
 
-    # 5) すでにデータが入っている場合は、「中身だけ」全削除（コレクション自体は残す）
+
+# =========================
+# インデックス構築
+# =========================
+
+def build_index(incremental: bool = False) -> Dict[str, List[str]]:
+    """
+    documents/ から文書を読み込み、
+    チャンク化 → 埋め込み計算 → Chroma に登録する。
+    :param incremental: True の場合はマニフェストと比較し、
+                        追加・変更・削除されたファイルだけを反映する
+    :return: {"added": [...], "updated": [...], "removed": [...], "skipped": [...], "failed": [...]}
+    """
+    if incremental:
+        return _build_incremental()
+    return _build_full()
+
+
+def _build_full() -> Dict[str, List[str]]:
+    """
+    コレクションの中身を全削除してから、documents/ の全ファイルを登録し直す。
+    """
+    # 1) 文書読み込み
+    docs = load_documents()
+
+    # 2) コレクション取得
+    collection, openai_ef = _open_collection()
+    collection_name = config.CHROMA_COLLECTION
+
+    # 3) すでにデータが入っている場合は、「中身だけ」全削除（コレクション自体は残す）
     try:
         existing_count = collection.count()
         if existing_count > 0:
-            all_docs = collection.get()  # 小規模前提なので全部取得でOK
+            all_docs = collection.get(include=[])
             all_ids = all_docs.get("ids", [])
             if all_ids:
                 collection.delete(ids=all_ids)
@@ -64,32 +222,195 @@ def build_index() -> None:
         # ここでのエラーは致命的ではないのでログだけ出して続行
         print(f"既存データ削除時にエラー（無視して続行）: {e}")
 
-    # 6) 新しいデータを追加
-    ids: List[str] = []
-    documents: List[str] = []
-    metadatas: List[dict] = []
+    # 4) 新しいデータを追加
+    records: List[ChunkRecord] = []
+    manifest: Dict[str, Dict] = {}
+    entries: List[CatalogEntry] = []
+    summary = _empty_summary()
+
+    # 文書の全文も入れ替える（チャンクより先に保存し、登録したチャンクの本文を読めるようにする）
+    store = _open_store()
+    if store is not None:
+        store.clear()
 
     for doc in docs:
-        chunks = chunk_text(doc.content)
-        for idx, chunk in enumerate(chunks):
-            chunk_id = f"{doc.id}_chunk_{idx}"
-            ids.append(chunk_id)
-            documents.append(chunk)
-            metadatas.append(
-                {
-                    "document_id": doc.id,
-                    "document_title": doc.title,
-                    "chunk_index": idx,
-                }
-            )
-
-    if not ids:
+        doc_records = _chunk_records(doc)
+        records.extend(doc_records)
+        if store is not None and doc_records:
+            store.put(doc.id, doc.content)
+        fingerprint = _fingerprint(doc.path)
+        manifest[doc.path.name] = {
+            "doc_id": doc.id,
+            "chunk_count": len(doc_records),
+            **fingerprint,
+        }
+        if doc_records:
+            entries.append(_catalog_entry(doc, doc_records, fingerprint["sha256"]))
+        summary["added"].append(doc.path.name)
+
+    if store is not None:
+        store.close()
+    if not records:
         raise RuntimeError("チャンクが1つも生成されませんでした。")
 
-    collection.add(
-        ids=ids,
-        documents=documents,
-        metadatas=metadatas,
-    )
+    written = _add_chunks(collection, openai_ef, records)
+    save_manifest(manifest)
 
-    print(f"インデックス作成完了: {len(ids)} チャンクを登録しました。")
+    # キーワード検索用の索引も作り直す
+    lexical = _open_lexical(store)
+    try:
+        lexical.clear()
+        lexical.add(records)
+    finally:
+        lexical.close()
+
+    # 文書カタログも入れ替える
+    catalog = DocumentCatalog(config.DOCUMENT_CATALOG_PATH)
+    try:
+        catalog.replace_all(entries)
+    finally:
+        catalog.close()
+
+    # 条・項・号の構造索引も作り直す
+    indexed = {entry.doc_id for entry in entries}
+    articles = ArticleIndex(config.ARTICLE_INDEX_PATH)
+    try:
+        articles.clear()
+        articles.put_many({doc.id: scan_sections(doc.content) for doc in docs if doc.id in indexed})
+    finally:
+        articles.close()
+
+    print(f"インデックス作成完了: {written} チャンクを登録しました。")
+    return summary
+
+
+def _build_incremental() -> Dict[str, List[str]]:
+    """
+    マニフェストと documents/ の現状を比較し、差分だけを反映する。
+    - 新規ファイル: 追加
+    - mtime / size が変わり、かつ内容ハッシュも変わったファイル: 再登録
+    - 消えたファイル: チャンクを削除
+    - それ以外: スキップ
+    """
+    manifest = load_manifest()
+    collection, openai_ef = _open_collection()
+    catalog = DocumentCatalog(config.DOCUMENT_CATALOG_PATH)
+    articles = ArticleIndex(config.ARTICLE_INDEX_PATH)
+    store = _open_store()
+    lexical = _open_lexical(store)
+    try:
+        return _apply_incremental(manifest, collection, openai_ef, lexical, catalog, store, articles)
+    finally:
+        lexical.close()
+        catalog.close()
+        articles.close()
+        if store is not None:
+            store.close()
+
+
+def _apply_incremental(
+    manifest: Dict[str, Dict],
+    collection,
+    openai_ef,
+    lexical: LexicalIndex,
+    catalog: DocumentCatalog,
+    store: Optional[DocumentStore] = None,
+    articles: Optional[ArticleIndex] = None,
+) -> Dict[str, List[str]]:
+    summary = _empty_summary()
+    new_manifest: Dict[str, Dict] = {}
+
+    paths = list_document_paths()
+    for path in paths:
+        name = path.name
+        entry = manifest.get(name)
+        stat = path.stat()
+
+        # mtime と size が同じなら中身は読まずにスキップ
+        if (
+            entry
+            and entry.get("sha256")
+            and entry.get("mtime") == stat.st_mtime
+            and entry.get("size") == stat.st_size
+        ):
+            new_manifest[name] = entry
+            summary["skipped"].append(name)
+            continue
+
+        fingerprint = _fingerprint(path)
+        # タイムスタンプだけ変わって内容が同じ場合もスキップ
+        if entry and entry.get("sha256") == fingerprint["sha256"]:
+            new_manifest[name] = {**entry, **fingerprint}
+            summary["skipped"].append(name)
+            continue
+
+        try:
+            doc = load_document(path)
+            doc_records = _chunk_records(doc)
+            # 以前のチャンク（同じ doc_id で登録済みのもの）を消してから登録する
+            _delete_document_chunks(collection, doc.id)
+            lexical.remove_document(doc.id)
+            catalog.remove(doc.id)
+            if store is not None:
+                store.delete(doc.id)
+            if articles is not None:
+                articles.remove(doc.id)
+            if doc_records:
+                if store is not None:
+                    store.put(doc.id, doc.content)
+                _add_chunks(collection, openai_ef, doc_records)
+                lexical.add(doc_records)
+                catalog.put_many([_catalog_entry(doc, doc_records, fingerprint["sha256"])])
+                if articles is not None:
+                    articles.put_many({doc.id: scan_sections(doc.content)})
+        except Exception as e:
+            detail = getattr(e, "detail", e)
+            print(f"警告: {name} の登録に失敗しました: {detail}")
+            summary["failed"].append(name)
+            if entry:
+                # 失敗したファイルは次回も再試行されるよう旧情報のまま残さない
+                new_manifest[name] = {**entry, "sha256": None}
+            continue
+
+        new_manifest[name] = {"doc_id": doc.id, "chunk_count": len(doc_records), **fingerprint}
+        summary["updated" if entry else "added"].append(name)
+
+    # マニフェストにあって、ディレクトリから消えたファイル
+    current_names = {p.name for p in paths}
+    for name, entry in manifest.items():
+        if name in current_names:
+            continue
+        doc_id = entry.get("doc_id") or Path(name).stem
+        deleted = _delete_document_chunks(collection, doc_id)
+        lexical.remove_document(doc_id)
+        catalog.remove(doc_id)
+        if store is not None:
+            store.delete(doc_id)
+        if articles is not None:
+            articles.remove(doc_id)
+        print(f"{name}: 削除されたファイルのチャンク {deleted} 件を削除しました。")
+        summary["removed"].append(name)
+
+    save_manifest(new_manifest)
+    return summary
+
+
+def format_summary(summary: Dict[str, List[str]]) -> str:
+    """
+    build_index の結果サマリーを表示用の文字列にする。
+    """
+    labels = [
+        ("added", "追加"),
+        ("updated", "更新"),
+        ("removed", "削除"),
+        ("skipped", "スキップ"),
+        ("failed", "失敗"),
+    ]
+    lines = []
+    for key, label in labels:
+        names = summary.get(key, [])
+        line = f"{label}: {len(names)} 件"
+        if names and key != "skipped":
+            line += f"（{', '.join(names)}）"
+        lines.append(line)
+    return "\n".join(lines)
@@ -0,0 +1,191 @@
+# backend/app/rag/ingest_pipeline.py
+# 大量チャンクの取り込みパイプライン
+# - チャンクをトークン数を考慮したバッチにまとめる
+# - 同時実行数を制限しつつ、複数バッチの埋め込みを並列に計算する
+# - Chroma へは一定件数ごとに分割して書き込む
+# - 埋め込みはバッチ完了ごとに ChunkEmbeddingStore に保存されるので、
+#   途中で失敗しても再実行時に完了済みバッチは再計算しない
+# - 文書の全文を文書ストアに保存している場合は、Chroma にチャンクの本文を書き込まない
+#   （本文は検索時にメタデータの位置から取り出す）
+
+import time
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from dataclasses import dataclass
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Set
+
+from app import config
+from app.rag.embedding_cache import ChunkEmbeddingStore
+
+
+@dataclass
+class ChunkRecord:
+    id: str          # Chroma に登録するチャンクID
+    text: str        # チャンク本文
+    metadata: dict   # document_id / document_title / chunk_index など
+
+
+def estimate_tokens(text: str) -> int:
+    """
+    トークン数のおおまかな見積もり。
+    日本語などの非ASCII文字は1文字≒1トークン、ASCII は4文字≒1トークンとみなす。
+    """
+    non_ascii = sum(1 for ch in text if ord(ch) > 127)
+    ascii_chars = len(text) - non_ascii
+    return non_ascii + (ascii_chars + 3) // 4
+
+
+def iter_batches(
+    records: Iterable[ChunkRecord],
+    max_tokens: int,
+    max_size: int,
+) -> Iterator[List[ChunkRecord]]:
+    """
+    チャンクを「合計トークン数 <= max_tokens」かつ「件数 <= max_size」のバッチに分ける。
+    1チャンクだけで max_tokens を超える場合は単独のバッチにする。
+    """
+    batch: List[ChunkRecord] = []
+    batch_tokens = 0
+    for record in records:
+        tokens = estimate_tokens(record.text)
+        if batch and (batch_tokens + tokens > max_tokens or len(batch) >= max_size):
+            yield batch
+            batch, batch_tokens = [], 0
+        batch.append(record)
+        batch_tokens += tokens
+    if batch:
+        yield batch
+
+
+def _print_progress(embedded: int, written: int) -> None:
+    print(f"[IngestionPipeline] embedded={embedded}, written={written}")
+
+
+class IngestionPipeline:
+    """
+    トークン考慮バッチ × 並列埋め込み × 分割書き込みでチャンクを Chroma に登録するクラス。
+    """
+
+    def __init__(
+        self,
+        collection,
+        embedding_func: Callable,
+        chunk_store: ChunkEmbeddingStore,
+        batch_tokens: int = config.EMBEDDING_BATCH_TOKENS,
+        batch_size: int = config.EMBEDDING_BATCH_SIZE,
+        concurrency: int = config.EMBEDDING_CONCURRENCY,
+        write_batch_size: int = config.CHROMA_WRITE_BATCH_SIZE,
+        max_retries: int = 2,
+        progress: Optional[Callable[[int, int], None]] = _print_progress,
+        store_documents: bool = True,
+    ):
+        self.collection = collection
+        self.embedding_func = embedding_func
+        self.chunk_store = chunk_store
+        self.batch_tokens = batch_tokens
+        self.batch_size = batch_size
+        self.concurrency = max(1, concurrency)
+        self.write_batch_size = write_batch_size
+        self.max_retries = max_retries
+        self.progress = progress
+        self.store_documents = store_documents
+
+    def _embed_batch(self, batch: List[ChunkRecord]) -> List[List[float]]:
+        """
+        1バッチ分の埋め込みを計算する（一時的なエラーはバックオフしてリトライ）。
+        """
+        texts = [r.text for r in batch]
+        for attempt in range(self.max_retries + 1):
+            try:
+                return self.chunk_store.embed(texts, self.embedding_func)
+            except Exception as e:
+                if attempt >= self.max_retries:
+                    raise
+                wait_sec = 2 ** attempt
+                print(
+                    f"警告: [IngestionPipeline] 埋め込みに失敗しました（{wait_sec}秒後に再試行）: {e}"
+                )
+                time.sleep(wait_sec)
+        return []  # ここには到達しない
+
+    def embed(self, records: List[ChunkRecord]) -> List[List[float]]:
+        """
+        チャンクの埋め込みだけを（バッチに分けて並列に）計算して返す。Chroma には書き込まない。
+        書き込みのタイミングを呼び出し側で決めたい場合（文書の差し替えなど）に使う。
+        """
+        batches = list(iter_batches(records, self.batch_tokens, self.batch_size))
+        with ThreadPoolExecutor(max_workers=self.concurrency) as pool:
+            results = list(pool.map(self._embed_batch, batches))
+        return [embedding for batch in results for embedding in batch]
+
+    def write(self, records: List[ChunkRecord], embeddings: List[List[float]]) -> None:
+        # 再実行時に同じIDが既にあっても失敗しないよう upsert で書き込む
+        for start in range(0, len(records), self.write_batch_size):
+            part = records[start:start + self.write_batch_size]
+            self.collection.upsert(
+                ids=[r.id for r in part],
+                documents=[r.text for r in part] if self.store_documents else None,
+                metadatas=[r.metadata for r in part],
+                embeddings=embeddings[start:start + self.write_batch_size],
+            )
+
+    def run(self, records: Iterable[ChunkRecord]) -> int:
+        """
+        チャンクを埋め込んで Chroma に登録し、登録件数を返す。
+        records はジェネレータでもよい（同時に保持するのは実行中のバッチ分だけ）。
+        """
+        embedded = 0
+        written = 0
+        pending_records: List[ChunkRecord] = []
+        pending_embeddings: List[List[float]] = []
+
+        def flush(force: bool = False) -> None:
+            nonlocal written, pending_records, pending_embeddings
+            if not pending_records or (not force and len(pending_records) < self.write_batch_size):
+                return
+            self.write(pending_records, pending_embeddings)
+            written += len(pending_records)
+            pending_records, pending_embeddings = [], []
+            if self.progress:
+                self.progress(embedded, written)
+
+        batches = iter_batches(records, self.batch_tokens, self.batch_size)
+        in_flight: Dict[Future, List[ChunkRecord]] = {}
+
+        with ThreadPoolExecutor(max_workers=self.concurrency) as pool:
+            try:
+                for batch in batches:
+                    # 実行中のバッチ数が上限に達したら、どれかが終わるまで待つ
+                    while len(in_flight) >= self.concurrency:
+                        done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+                        embedded += self._collect(done, in_flight, pending_records, pending_embeddings)
+                        flush()
+                    in_flight[pool.submit(self._embed_batch, batch)] = batch
+
+                while in_flight:
+                    done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+                    embedded += self._collect(done, in_flight, pending_records, pending_embeddings)
+                    flush()
+            except Exception:
+                # 失敗しても、埋め込み済みのバッチはストアに残っているため再実行時に再利用される
+                for future in in_flight:
+                    future.cancel()
+                raise
+
+        flush(force=True)
+        return written
+
+    @staticmethod
+    def _collect(
+        done: Set[Future],
+        in_flight: Dict[Future, List[ChunkRecord]],
+        pending_records: List[ChunkRecord],
+        pending_embeddings: List[List[float]],
+    ) -> int:
+        count = 0
+        for future in done:
+            batch = in_flight.pop(future)
+            embeddings = future.result()
+            pending_records.extend(batch)
+            pending_embeddings.extend(embeddings)
+            count += len(batch)
+        return count
@@ -0,0 +1,364 @@
+# backend/app/rag/lexical_index.py
+# チャンク本文の語彙（キーワード）検索用インデックス
+# - 日本語は単語区切りがないため、文字 2-gram / 3-gram を索引語にする
+# - スコアは BM25（条文番号・当事者名・定義語などの完全一致に強い）
+# - 文書の追加・削除に合わせて差分で更新し、SQLite に保存する
+#   （チャンクごとに索引語の出現回数を1行で持ち、更新はそのチャンクの行だけを書き換える。
+#    転置インデックスは読み込み時にメモリ上で組み立てる）
+# - 文書ストアがある場合、位置の分かるチャンクの本文は持たず、検索結果の本文はストアから読み出す
+# - 検索は埋め込み API を呼ばず、メモリ上の転置インデックスだけで完結する
+
+import heapq
+import json
+import math
+import re
+import sqlite3
+import threading
+import unicodedata
+from collections import Counter
+from pathlib import Path
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+
+from app.rag.ingest_pipeline import ChunkRecord
+
+
+# 保存形式のバージョン（形式を変えたら上げる → 古いデータは作り直し）
+INDEX_VERSION = 3
+
+# まとめて書き込む行数
+_WRITE_BATCH = 1000
+
+# 検索結果に含める、チャンクの位置を表すメタデータ（コンテキストの組み立てで隣接チャンクの判定に使う）
+POSITION_KEYS = ("chunk_index", "char_start", "char_end", "article")
+
+# BM25 のパラメータ
+BM25_K1 = 1.2
+BM25_B = 0.75
+
+_SPACES = re.compile(r"\s+")
+
+
+def _normalize(text: str) -> str:
+    # 全角・半角の揺れ（"第１２条" と "第12条" など）と大文字・小文字を吸収する
+    return unicodedata.normalize("NFKC", text).lower()
+
+
+def position_of(metadata: Optional[Dict]) -> Dict:
+    """
+    チャンクのメタデータから位置の情報（POSITION_KEYS）だけを取り出す。
+    """
+    return {key: metadata[key] for key in POSITION_KEYS if metadata and metadata.get(key) is not None}
+
+
+def char_ngrams(text: str, sizes: Tuple[int, ...] = (2, 3)) -> List[str]:
+    """
+    テキストを文字 n-gram（既定は 2-gram と 3-gram）に分解する。
+    空白をまたぐ n-gram は作らない。1文字だけの語はそのまま索引語にする。
+    """
+    grams: List[str] = []
+    for run in _SPACES.split(_normalize(text)):
+        if not run:
+            continue
+        if len(run) == 1:
+            grams.append(run)
+            continue
+        for n in sizes:
+            grams.extend(run[i:i + n] for i in range(len(run) - n + 1))
+    return grams
+
+
+class LexicalIndex:
+    """
+    文字 n-gram の転置インデックス（BM25）。
+    検索・更新はスレッドセーフ。path を指定した場合は、更新のたびにその差分を SQLite に書き込む。
+    text_for を指定した場合、位置（char_start / char_end）の分かるチャンクの本文は保存せず、
+    検索結果の本文は text_for({"document_id", "char_start", "char_end", ...}) で取り出す。
+    """
+
+    def __init__(
+        self,
+        path: Optional[Path] = None,
+        text_for: Optional[Callable[[Dict], Optional[str]]] = None,
+    ):
+        # chunk_id → {"document_id", "document_title", "text"（保存しない場合は None）, "length", "position"}
+        self._chunks: Dict[str, Dict] = {}
+        # 索引語 → {chunk_id: 出現回数}
+        self._postings: Dict[str, Dict[str, int]] = {}
+        self._total_length = 0
+        self._lock = threading.RLock()
+        self.text_for = text_for
+        self.path = Path(path) if path is not None else None
+        self._conn: Optional[sqlite3.Connection] = None
+        if self.path is not None:
+            self._open()
+
+    def __len__(self) -> int:
+        return len(self._chunks)
+
+    def chunk_ids(self) -> set:
+        with self._lock:
+            return set(self._chunks)
+
+    # ---- 保存・読み込み ----
+
+    def _open(self) -> None:
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._conn = sqlite3.connect(str(self.path), check_same_thread=False)
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS lexical_chunks ("
+            "chunk_id TEXT PRIMARY KEY, document_id TEXT, document_title TEXT, text TEXT, "
+            "length INTEGER NOT NULL, position TEXT NOT NULL, terms TEXT NOT NULL)"
+        )
+        self._conn.execute(
+            "CREATE INDEX IF NOT EXISTS lexical_chunks_document_id ON lexical_chunks (document_id)"
+        )
+        self._conn.execute("CREATE TABLE IF NOT EXISTS lexical_meta (key TEXT PRIMARY KEY, value INTEGER NOT NULL)")
+        row = self._conn.execute("SELECT value FROM lexical_meta WHERE key = 'version'").fetchone()
+        if row is None or row[0] != INDEX_VERSION:
+            if row is not None:
+                print("警告: [LexicalIndex] 保存形式が古いため作り直します。")
+            self._conn.execute("DELETE FROM lexical_chunks")
+            self._conn.execute(
+                "INSERT OR REPLACE INTO lexical_meta (key, value) VALUES ('version', ?)", (INDEX_VERSION,)
+            )
+        self._conn.commit()
+
+        try:
+            rows = self._conn.execute(
+                "SELECT chunk_id, document_id, document_title, text, length, position, terms FROM lexical_chunks"
+            )
+            for chunk_id, document_id, title, text, length, position, terms in rows:
+                self._chunks[chunk_id] = {
+                    "document_id": document_id,
+                    "document_title": title,
+                    "text": text,
+                    "length": length,
+                    "position": json.loads(position),
+                }
+                self._total_length += length
+                for gram, tf in json.loads(terms).items():
+                    self._postings.setdefault(gram, {})[chunk_id] = tf
+        except Exception as e:
+            print(f"警告: [LexicalIndex] 読み込みに失敗しました（空として扱います）: {e}")
+            self._chunks.clear()
+            self._postings.clear()
+            self._total_length = 0
+
+    @classmethod
+    def load(cls, path: Path, text_for: Optional[Callable[[Dict], Optional[str]]] = None) -> "LexicalIndex":
+        """
+        保存済みのインデックスを読み込む。存在しない・壊れている場合は空のインデックスを返す。
+        """
+        return cls(path, text_for)
+
+    def _write(self, rows: List[Tuple]) -> None:
+        # ロックを保持した状態で呼ぶこと
+        if self._conn is None or not rows:
+            return
+        self._conn.executemany(
+            "INSERT OR REPLACE INTO lexical_chunks "
+            "(chunk_id, document_id, document_title, text, length, position, terms) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?)",
+            rows,
+        )
+        rows.clear()
+
+    def close(self) -> None:
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
+    # ---- 更新 ----
+
+    def _terms_of(self, chunk_id: str, chunk: Dict) -> Iterable[str]:
+        # ロックを保持した状態で呼ぶこと（本文を持たないチャンクは、保存した索引語を使う）
+        if chunk["text"] is not None:
+            return set(char_ngrams(chunk["text"]))
+        if self._conn is not None:
+            row = self._conn.execute("SELECT terms FROM lexical_chunks WHERE chunk_id = ?", (chunk_id,)).fetchone()
+            if row is not None:
+                return json.loads(row[0]).keys()
+        # 本文も保存した索引語もなければ、転置インデックス全体から探す
+        return [gram for gram, postings in self._postings.items() if chunk_id in postings]
+
+    def _keeps_text(self, position: Dict) -> bool:
+        return self.text_for is None or "char_start" not in position or "char_end" not in position
+
+    def _text_of(self, chunk: Dict) -> str:
+        if chunk["text"] is not None:
+            return chunk["text"]
+        if self.text_for is None:
+            # 本文を持たない索引を text_for なしで開いた場合（索引の作成だけを行うときなど）
+            return ""
+        return self.text_for({"document_id": chunk["document_id"], **chunk["position"]}) or ""
+
+    def _remove_chunk(self, chunk_id: str, terms: Optional[Iterable[str]] = None) -> None:
+        # ロックを保持した状態で呼ぶこと（SQLite の行は呼び出し側で消す）
+        chunk = self._chunks.get(chunk_id)
+        if chunk is None:
+            return
+        if terms is None:
+            terms = self._terms_of(chunk_id, chunk)
+        del self._chunks[chunk_id]
+        self._total_length -= chunk["length"]
+        for gram in terms:
+            postings = self._postings.get(gram)
+            if postings is None:
+                continue
+            postings.pop(chunk_id, None)
+            if not postings:
+                del self._postings[gram]
+
+    def add(self, records: Iterable[ChunkRecord]) -> int:
+        """
+        チャンクを索引に追加する（同じIDがあれば置き換える）。
+        """
+        count = 0
+        rows: List[Tuple] = []
+        with self._lock:
+            for record in records:
+                if rows and record.id in {row[0] for row in rows}:
+                    # 同じ呼び出しの中で同じIDを置き換える場合は、先に書き込んでから索引語を読む
+                    self._write(rows)
+                self._remove_chunk(record.id)
+                grams = Counter(char_ngrams(record.text))
+                length = sum(grams.values())
+                position = position_of(record.metadata)
+                chunk = {
+                    "document_id": record.metadata.get("document_id"),
+                    "document_title": record.metadata.get("document_title"),
+                    "text": record.text if self._keeps_text(position) else None,
+                    "length": length,
+                    "position": position,
+                }
+                self._chunks[record.id] = chunk
+                self._total_length += length
+                for gram, tf in grams.items():
+                    self._postings.setdefault(gram, {})[record.id] = tf
+                count += 1
+                if self._conn is not None:
+                    rows.append((
+                        record.id, chunk["document_id"], chunk["document_title"], chunk["text"], length,
+                        json.dumps(chunk["position"], ensure_ascii=False),
+                        json.dumps(grams, ensure_ascii=False),
+                    ))
+                    if len(rows) >= _WRITE_BATCH:
+                        self._write(rows)
+            self._write(rows)
+            if self._conn is not None:
+                self._conn.commit()
+        return count
+
+    def remove_document(self, document_id: str) -> int:
+        """
+        document_id に紐づくチャンクをすべて索引から削除し、削除件数を返す。
+        """
+        with self._lock:
+            ids = [cid for cid, c in self._chunks.items() if c["document_id"] == document_id]
+            saved: Dict[str, Iterable[str]] = {}
+            if self._conn is not None:
+                saved = {
+                    chunk_id: json.loads(terms).keys()
+                    for chunk_id, terms in self._conn.execute(
+                        "SELECT chunk_id, terms FROM lexical_chunks WHERE document_id = ?", (document_id,)
+                    )
+                }
+            for chunk_id in ids:
+                self._remove_chunk(chunk_id, saved.get(chunk_id))
+            if self._conn is not None:
+                self._conn.execute("DELETE FROM lexical_chunks WHERE document_id = ?", (document_id,))
+                self._conn.commit()
+        return len(ids)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._chunks.clear()
+            self._postings.clear()
+            self._total_length = 0
+            if self._conn is not None:
+                self._conn.execute("DELETE FROM lexical_chunks")
+                self._conn.commit()
+
+    # ---- 検索 ----
+
+    def search(self, query: str, n_results: int = 10) -> List[Dict]:
+        """
+        BM25 で検索し、RAGRetriever.search と同じ形式の結果を返す。
+        """
+        grams = set(char_ngrams(query))
+        with self._lock:
+            n_chunks = len(self._chunks)
+            if not grams or n_chunks == 0:
+                return []
+            avg_length = self._total_length / n_chunks or 1.0
+
+            scores: Dict[str, float] = {}
+            for gram in grams:
+                postings = self._postings.get(gram)
+                if not postings:
+                    continue
+                df = len(postings)
+                idf = math.log(1.0 + (n_chunks - df + 0.5) / (df + 0.5))
+                for chunk_id, tf in postings.items():
+                    length = self._chunks[chunk_id]["length"]
+                    norm = BM25_K1 * (1.0 - BM25_B + BM25_B * length / avg_length)
+                    scores[chunk_id] = scores.get(chunk_id, 0.0) + idf * tf * (BM25_K1 + 1.0) / (tf + norm)
+
+            top = [
+                (chunk_id, self._chunks[chunk_id], score)
+                for chunk_id, score in heapq.nlargest(n_results, scores.items(), key=lambda item: item[1])
+            ]
+
+        # 本文を持たないチャンクは、ロックの外で文書ストアから読み出す
+        return [
+            {
+                "chunk_id": chunk_id,
+                "document_id": chunk["document_id"],
+                "document_title": chunk["document_title"] or "（タイトル不明）",
+                "snippet": self._text_of(chunk),
+                "score": score,
+                **chunk["position"],
+            }
+            for chunk_id, chunk, score in top
+        ]
+
+
+def iter_collection_records(
+    collection,
+    page_size: int = 1000,
+    text_for: Optional[Callable[[Dict], Optional[str]]] = None,
+) -> Iterator[ChunkRecord]:
+    """
+    Chroma のコレクションに登録済みのチャンクをページ単位で読み出す（索引の作り直し用）。
+    :param text_for: 本文を Chroma に保存していないチャンクの本文をメタデータから取り出す関数
+                     （文書ストアから位置で読み出す場合など）
+    """
+    offset = 0
+    while True:
+        page = collection.get(include=["documents", "metadatas"], limit=page_size, offset=offset)
+        ids = page.get("ids") or []
+        if not ids:
+            return
+        texts = page.get("documents") or [None] * len(ids)
+        for chunk_id, text, meta in zip(ids, texts, page.get("metadatas") or []):
+            if text is None and text_for is not None:
+                text = text_for(meta or {})
+            yield ChunkRecord(id=chunk_id, text=text or "", metadata=meta or {})
+        offset += len(ids)
+
+
+def sync_with_collection(
+    index: LexicalIndex,
+    collection,
+    text_for: Optional[Callable[[Dict], Optional[str]]] = None,
+) -> Optional[int]:
+    """
+    索引のチャンクIDがコレクションと一致しない場合、コレクションから作り直す。
+    :return: 作り直した場合は索引のチャンク数、一致していた場合は None
+    """
+    ids = set(collection.get(include=[]).get("ids") or [])
+    if ids == index.chunk_ids():
+        return None
+    index.clear()
+    return index.add(iter_collection_records(collection, text_for=text_for))
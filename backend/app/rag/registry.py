@@ -0,0 +1,133 @@
+# backend/app/rag/registry.py
+# プロセス全体で共有する RAG リソース（RAGRetriever など）を管理するレジストリ
+# - 起動時に1度だけ生成・ウォームアップし、終了時にクローズする
+# - エージェントのノードと documents ルーターの両方から同じインスタンスを使う
+
+import threading
+from typing import Dict, Optional
+
+from app.rag.retriever import RAGRetriever
+
+
+# レジストリの状態
+STATE_NOT_STARTED = "not_started"
+STATE_STARTING = "starting"
+STATE_READY = "ready"
+STATE_ERROR = "error"
+STATE_CLOSED = "closed"
+
+
+class ResourceRegistry:
+    """
+    共有リソースの生成・ウォームアップ・クローズと、readiness 状態を管理するクラス。
+    - startup(): RAGRetriever を生成し、コレクション読み込み＋ダミー検索でウォームアップ
+    - get_retriever(): 共有インスタンスを返す（未初期化なら遅延生成）
+    - shutdown(): リソースを解放する
+    - status(): ヘルスチェック用の状態を返す
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._retriever: Optional[RAGRetriever] = None
+        self.state: str = STATE_NOT_STARTED
+        self.error: Optional[str] = None
+        self.chunk_count: Optional[int] = None
+
+    def _create_retriever(self) -> RAGRetriever:
+        # ロックを保持した状態で呼ぶこと
+        if self._retriever is None:
+            self._retriever = RAGRetriever()
+        return self._retriever
+
+    def startup(self) -> None:
+        """
+        アプリケーション起動時に呼び出す。
+        失敗してもアプリは止めず、state=error として記録する。
+        """
+        with self._lock:
+            self.state = STATE_STARTING
+            self.error = None
+            try:
+                retriever = self._create_retriever()
+                self.chunk_count = retriever.warm_up()
+                self.state = STATE_READY
+                print(
+                    f"[ResourceRegistry] ready. "
+                    f"インデックス確認完了（{self.chunk_count}件のチャンクが登録されています）"
+                )
+            except Exception as e:
+                self.state = STATE_ERROR
+                self.error = str(e)
+                print(f"警告: [ResourceRegistry] 起動時の初期化に失敗しました: {e}")
+
+    def get_retriever(self) -> RAGRetriever:
+        """
+        共有 RAGRetriever を返す。
+        startup() 前や初期化失敗後に呼ばれた場合はここで生成を試みる（失敗時は例外）。
+        """
+        retriever = self._retriever
+        if retriever is not None:
+            return retriever
+
+        with self._lock:
+            if self.state == STATE_CLOSED:
+                raise RuntimeError("リソースレジストリはすでにクローズされています。")
+            try:
+                retriever = self._create_retriever()
+            except Exception as e:
+                self.state = STATE_ERROR
+                self.error = str(e)
+                raise
+            if self.state != STATE_READY:
+                self.state = STATE_READY
+                self.error = None
+            return retriever
+
+    def shutdown(self) -> None:
+        """
+        アプリケーション終了時に呼び出し、共有リソースを解放する。
+        """
+        with self._lock:
+            if self._retriever is not None:
+                try:
+                    self._retriever.close()
+                except Exception as e:
+                    print(f"警告: [ResourceRegistry] RAGRetriever のクローズに失敗しました: {e}")
+            self._retriever = None
+            self.state = STATE_CLOSED
+            print("[ResourceRegistry] closed.")
+
+    @property
+    def is_ready(self) -> bool:
+        return self.state == STATE_READY
+
+    def status(self) -> Dict:
+        """
+        ヘルスチェックで返す readiness 情報
+        """
+        status = {
+            "state": self.state,
+            "ready": self.is_ready,
+            "chunk_count": self.chunk_count,
+            "error": self.error,
+        }
+        if self._retriever is not None:
+            status["query_embedding_cache"] = self._retriever.query_cache.stats()
+            status["chunk_embedding_store"] = self._retriever.chunk_store.stats()
+            status["lexical_index_chunks"] = len(self._retriever.lexical)
+            status["catalog"] = {
+                "documents": len(self._retriever.catalog),
+                "chunks": self._retriever.chunk_count(),
+            }
+        return status
+
+
+# シングルトンとして保持
+registry = ResourceRegistry()
+
+
+def get_retriever() -> RAGRetriever:
+    """
+    共有 RAGRetriever を取得するショートカット
+    """
+    return registry.get_retriever()
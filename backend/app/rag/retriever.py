@@ -2,12 +2,28 @@
 # - ベクトル検索（Chroma）を利用して
 #   ユーザーの質問に近い文書チャンクを取り出す
 
-from typing import List, Dict
+import hashlib
+import threading
+import unicodedata
+from typing import Callable, List, Dict, Iterable, Iterator, Optional, Tuple, Union
 import chromadb
 from chromadb.utils import embedding_functions
 
 from app import config
-from app.rag.index_builder import chunk_text
+from app.rag.article_index import ArticleIndex, Section, SectionScanner, parse_article_refs
+from app.rag.article_index import sync_with_store as sync_articles
+from app.rag.chunker import iter_chunks
+from app.rag.document_catalog import CatalogEntry, ContentMeter, DocumentCatalog
+from app.rag.document_catalog import sync_with_collection as sync_catalog
+from app.rag.document_store import DocumentStore, DocumentWriter
+from app.rag.embedding_cache import QueryEmbeddingCache, ChunkEmbeddingStore
+from app.rag.ingest_pipeline import ChunkRecord, IngestionPipeline
+from app.rag.lexical_index import LexicalIndex, position_of, sync_with_collection
+from app.rag.rwlock import ReadWriteLock
+
+
+# 検索モード
+SEARCH_MODES = ("vector", "lexical", "hybrid")
 
 
 class RAGRetriever:
@@ -37,6 +53,29 @@ class RAGRetriever:
         except Exception as e:
             raise RuntimeError(f"埋め込み関数の作成に失敗しました: {e}")
 
+        # インデックスの世代番号（文書の追加・削除のたびに増える）
+        # 回答キャッシュなど、インデックスの内容に依存するキャッシュの無効化に使う
+        self.generation = 0
+        self._generation_lock = threading.Lock()
+
+        # 検索と文書の差し替え・削除の排他（差し替え途中の文書が検索に出ないようにする）
+        self._rw_lock = ReadWriteLock()
+        # 同じ文書を同時に差し替えないよう、差し替えは1件ずつ行う
+        self._update_lock = threading.Lock()
+
+        # クエリ埋め込みキャッシュ（同じ質問で埋め込みAPIを再度呼ばないため）
+        self.query_cache = QueryEmbeddingCache(
+            model=config.EMBEDDING_MODEL,
+            max_size=config.QUERY_EMBEDDING_CACHE_SIZE,
+            disk_path=config.QUERY_EMBEDDING_CACHE_PATH if config.QUERY_EMBEDDING_CACHE_DISK else None,
+        )
+
+        # チャンク埋め込みストア（同じ内容のチャンクは再計算しない）
+        self.chunk_store = ChunkEmbeddingStore(
+            model=config.EMBEDDING_MODEL,
+            path=config.CHUNK_EMBEDDING_CACHE_PATH,
+        )
+
         # コレクション取得（既存 or 作成）
         try:
             self.collection = self.client.get_or_create_collection(
@@ -60,61 +99,139 @@ class RAGRetriever:
         except Exception as e:
             raise RuntimeError(f"コレクションの取得に失敗しました: {e}")
 
+        # 文書の一覧（Chroma と総チャンク数が合わなければ作り直す）
+        self.catalog = DocumentCatalog(config.DOCUMENT_CATALOG_PATH)
+        try:
+            rebuilt = sync_catalog(self.catalog, self.collection)
+            if rebuilt is not None:
+                print(f"[RAGRetriever] 文書カタログを作り直しました（{rebuilt}件）")
+        except Exception as e:
+            print(f"警告: [RAGRetriever] 文書カタログの同期に失敗しました: {e}")
+
+        # 文書の全文（圧縮して1部だけ保存する）。チャンクの本文は位置を指定してここから取り出す
+        self.store = DocumentStore(config.DOCUMENT_STORE_DIR) if config.DOCUMENT_STORE_ENABLED else None
+
+        # 条・項・号の構造索引（まだ走査していない文書があれば、文書ストアの全文から追加する）
+        self.articles = ArticleIndex(config.ARTICLE_INDEX_PATH)
+        if self.store is not None:
+            try:
+                doc_ids = [d["document_id"] for d in self.catalog.list()[0]]
+                added = sync_articles(self.articles, doc_ids, self.store.read)
+                if added:
+                    print(f"[RAGRetriever] 条文索引に {added} 件の文書を追加しました")
+            except Exception as e:
+                print(f"警告: [RAGRetriever] 条文索引の同期に失敗しました: {e}")
+
+        # キーワード検索用の転置インデックス（Chroma と中身がずれていれば作り直す）
+        # （文書ストアがある場合、本文は索引に持たずストアから読み出す）
+        self.lexical = LexicalIndex(
+            config.LEXICAL_INDEX_PATH,
+            text_for=self.store.chunk_text if self.store is not None else None,
+        )
+        try:
+            rebuilt = sync_with_collection(self.lexical, self.collection, text_for=self._stored_text)
+            if rebuilt is not None:
+                print(f"[RAGRetriever] キーワード索引を作り直しました（{rebuilt}件）")
+        except Exception as e:
+            # キーワード索引がなくてもベクトル検索は使えるので続行する
+            print(f"警告: [RAGRetriever] キーワード索引の同期に失敗しました: {e}")
+
+    def _bump_generation(self) -> None:
+        with self._generation_lock:
+            self.generation += 1
+
+    def warm_up(self) -> int:
+        """
+        起動直後のウォームアップ処理。
+        コレクションを読み込み、ダミー検索を1回実行して
+        埋め込み関数・HNSW インデックスを温めておく。
+        :return: 登録済みチャンク数
+        """
+        count = self.collection.count()
+        if count > 0:
+            try:
+                self.collection.query(query_embeddings=[self.embed_query("warm-up")], n_results=1)
+            except Exception as e:
+                # ダミー検索の失敗は致命的ではないのでログのみ
+                print(f"警告: [RAGRetriever.warm_up] ダミー検索に失敗しました: {e}")
+        return count
+
+    def chunk_count(self) -> int:
+        """
+        登録済みのチャンク数（カタログが保持している値。Chroma にはアクセスしない）
+        """
+        return self.catalog.total_chunks
 
-    def search(self, query: str, n_results: int = 10) -> List[Dict]:
+    def embed_query(self, query: str) -> List[float]:
+        """
+        クエリの埋め込みベクトルを返す。
+        キャッシュにあればそれを使い、なければ埋め込みAPIを呼んでキャッシュに保存する。
+        """
+        embedding = self.query_cache.get(query)
+        if embedding is None:
+            embedding = [float(v) for v in self.embedding_func([query])[0]]
+            self.query_cache.put(query, embedding)
+        return embedding
+
+    def close(self) -> None:
+        """
+        Chroma クライアントとキャッシュを解放する（アプリ終了時に呼び出す）。
+        """
+        self.query_cache.close()
+        self.chunk_store.close()
+        self.catalog.close()
+        self.articles.close()
+        self.lexical.close()
+        if self.store is not None:
+            self.store.close()
+        close = getattr(self.client, "close", None)
+        if callable(close):
+            close()
+        else:
+            # close() を持たないバージョンでは共有システムのキャッシュを破棄する
+            self.client.clear_system_cache()
+        self.collection = None
+        self.client = None
+
+
+    def search(self, query: str, n_results: int = 10, mode: Optional[str] = None) -> List[Dict]:
         """
-        類似検索を実行して結果を返す関数
+        検索を実行して結果を返す関数
         :param query: ユーザー質問
         :param n_results: 取得上限（デフォルト 10）
+        :param mode: "vector"（類似検索）/ "lexical"（キーワード検索）/ "hybrid"（両方を RRF で統合）
+                     省略時は config.RETRIEVAL_MODE
         :return: [{
+            "chunk_id": "...",
             "document_id": "...",
             "document_title": "...",
             "snippet": "...",
-            "score": 0.92
+            "score": 0.92,
+            "chunk_index": 3, "char_start": 1200, "char_end": 1650, "article": "第5条"  # 記録がある場合のみ
         }, ...]
         """
-        try:
-            collection_count = self.collection.count()
-            if collection_count == 0:
-                print("警告: インデックスが空のため、検索結果は0件です")
-                return []
-
-            # n_results はコレクションの件数を超えないようにしておく
-            n = min(n_results, collection_count)
+        mode = mode or config.RETRIEVAL_MODE
+        if mode not in SEARCH_MODES:
+            raise ValueError(f"未対応の検索モードです: {mode}（{' / '.join(SEARCH_MODES)} のいずれか）")
 
-            # Chroma の検索メソッド
-            results = self.collection.query(
-                query_texts=[query],
-                n_results=n,
-            )
-
-            # デバッグログ
-            raw_docs = results.get("documents") or []
-            raw_count = len(raw_docs[0]) if raw_docs else 0
-            print(
-                f"[RAGRetriever.search] query={query!r}, "
-                f"n_results={n}, raw_result_count={raw_count}"
-            )
-
-            docs: List[Dict] = []
-
-            if results.get("metadatas") and results.get("documents") and results.get("distances"):
-                for metadatas, docs_list, distances in zip(
-                    results["metadatas"], results["documents"], results["distances"]
-                ):
-                    for meta, doc, dist in zip(metadatas, docs_list, distances):
-                        title = meta.get("document_title") if meta else "（タイトル不明）"
-                        docs.append(
-                            {
-                                "document_id": meta.get("document_id") if meta else None,
-                                "document_title": title,
-                                "snippet": doc or "",
-                                "score": float(1.0 - dist) if dist is not None else 0.0,
-                            }
-                        )
+        try:
+            # 文書の差し替え中は、差し替えが終わるまで待ってから検索する
+            with self._rw_lock.read():
+                if mode == "lexical":
+                    # 埋め込み API を呼ばずにメモリ上の索引だけで検索する
+                    docs = self.lexical.search(query, n_results)
+                elif mode == "vector":
+                    docs = self._vector_search(query, n_results)
+                else:
+                    # 統合前にそれぞれ多めに取っておく
+                    depth = n_results * 2
+                    docs = reciprocal_rank_fusion(
+                        [self._vector_search(query, depth), self.lexical.search(query, depth)],
+                        n_results,
+                    )
 
             print(
-                "[RAGRetriever.search] hits="
+                f"[RAGRetriever.search] mode={mode}, hits="
                 f"{len(docs)}, titles={[d['document_title'] for d in docs]}"
             )
 
@@ -127,45 +244,159 @@ class RAGRetriever:
             # エラーが発生しても空のリストを返して処理を続行
             return []
 
-    def list_documents(self) -> List[Dict]:
+    def _vector_search(self, query: str, n_results: int) -> List[Dict]:
         """
-        Chroma に入っているメタデータから、
-        document_id ごとに {document_id, document_title, chunk_count} を集計して返す。
+        Chroma の類似検索（score = 1 - 距離）
         """
-        try:
-            # メタデータだけ全件取得
-            data = self.collection.get(include=["metadatas"])
-            metadatas = data.get("metadatas", []) or []
+        collection_count = self.chunk_count()
+        if collection_count == 0:
+            print("警告: インデックスが空のため、検索結果は0件です")
+            return []
 
-            docs_by_id: Dict[str, Dict] = {}
+        # n_results はコレクションの件数を超えないようにしておく
+        n = min(n_results, collection_count)
 
-            for meta in metadatas:
-                if not meta:
-                    continue
+        # Chroma の検索メソッド（埋め込みはキャッシュ経由で事前に計算して渡す）
+        results = self.collection.query(
+            query_embeddings=[self.embed_query(query)],
+            n_results=n,
+        )
 
-                doc_id = meta.get("document_id")
-                if not doc_id:
-                    # 既存のNDAなど、document_idを持たないものがあればスキップ
-                    continue
+        # デバッグログ
+        raw_ids = results.get("ids") or []
+        raw_count = len(raw_ids[0]) if raw_ids else 0
+        print(
+            f"[RAGRetriever.search] query={query!r}, "
+            f"n_results={n}, raw_result_count={raw_count}"
+        )
 
-                title = meta.get("document_title") or "（タイトル不明）"
+        docs: List[Dict] = []
+
+        if results.get("metadatas") and results.get("distances"):
+            documents = results.get("documents") or [[None] * len(ids) for ids in results["ids"]]
+            for ids, metadatas, docs_list, distances in zip(
+                results["ids"], results["metadatas"], documents, results["distances"]
+            ):
+                for chunk_id, meta, doc, dist in zip(ids, metadatas, docs_list, distances):
+                    title = meta.get("document_title") if meta else "（タイトル不明）"
+                    if doc is None:
+                        # 本文を Chroma に保存していないチャンクは、文書ストアから位置で取り出す
+                        doc = self._stored_text(meta or {})
+                    docs.append(
+                        {
+                            "chunk_id": chunk_id,
+                            "document_id": meta.get("document_id") if meta else None,
+                            "document_title": title,
+                            "snippet": doc or "",
+                            "score": float(1.0 - dist) if dist is not None else 0.0,
+                            **position_of(meta),
+                        }
+                    )
+
+        return docs
+
+    def _stored_text(self, meta: Dict) -> Optional[str]:
+        """
+        チャンクのメタデータ（document_id・char_start・char_end）から本文を文書ストアで取り出す。
+        """
+        if self.store is None:
+            return None
+        return self.store.chunk_text(meta)
 
-                if doc_id not in docs_by_id:
-                    docs_by_id[doc_id] = {
-                        "document_id": doc_id,
-                        "document_title": title,
-                        "chunk_count": 0,
-                    }
+    def widen(self, hit: Dict, before: int = 500, after: int = 500) -> Dict:
+        """
+        検索結果のチャンクの前後の文章を含めて抜粋を広げる（前後 before / after 文字）。
+        位置の記録がない・全文が保存されていない場合は hit をそのまま返す。
+        """
+        start, end = hit.get("char_start"), hit.get("char_end")
+        if self.store is None or not hit.get("document_id") or start is None or end is None:
+            return hit
+        start, end = max(0, start - before), end + after
+        text = self.store.read(hit["document_id"], start, end)
+        if text is None:
+            return hit
+        return {**hit, "snippet": text, "char_start": start, "char_end": start + len(text)}
+
+    def lookup_articles(self, question: str, max_documents: Optional[int] = None) -> List[Dict]:
+        """
+        質問に条番号（「第5条」「第5条第2項」など）があれば、条文索引と文書ストアから
+        その条・項・号の本文をそのまま取り出す（埋め込み API もベクトル検索も使わない）。
+        同じ条を持つ文書が複数ある場合は、質問に文書名があればその文書、なければキーワード検索で
+        関連の高い順に max_documents 件までを対象にする。
+        :return: search() と同じ形式の結果（条番号がない・見つからない場合は空）
+        """
+        refs = parse_article_refs(question)
+        if not refs or self.store is None:
+            return []
+        max_documents = config.ARTICLE_LOOKUP_MAX_DOCUMENTS if max_documents is None else max_documents
+
+        with self._rw_lock.read():
+            found: Dict[str, List[Section]] = {}
+            for ref in refs:
+                for doc_id, section in self.articles.find(ref):
+                    found.setdefault(doc_id, []).append(section)
+            if not found:
+                return []
 
-                docs_by_id[doc_id]["chunk_count"] += 1
+            titles = {doc_id: (self.catalog.get(doc_id) or {}).get("document_title") for doc_id in found}
+            hits: List[Dict] = []
+            for doc_id in self._select_documents(question, titles, max_documents):
+                for section in found[doc_id]:
+                    text = self.store.read(doc_id, section.start, section.end)
+                    if not text:
+                        continue
+                    hits.append({
+                        "chunk_id": f"{doc_id}#{section.label}",
+                        "document_id": doc_id,
+                        "document_title": titles[doc_id] or "（タイトル不明）",
+                        "snippet": text,
+                        "score": 1.0,
+                        "char_start": section.start,
+                        "char_end": section.end,
+                        "article": section.label,
+                        "heading": section.heading,
+                    })
 
-            return list(docs_by_id.values())
+        print(
+            f"[RAGRetriever.lookup_articles] refs={[tuple(r) for r in refs]}, "
+            f"documents={len(found)}, hits={[h['article'] for h in hits]}"
+        )
+        return hits
 
-        except Exception as e:
-            print(f"list_documents 中にエラーが発生しました: {e}")
-            import traceback
-            print(traceback.format_exc())
-            return []
+    def _select_documents(self, question: str, titles: Dict[str, Optional[str]], limit: int) -> List[str]:
+        """
+        条番号で取り出す文書を選ぶ（質問に文書名があればその文書、なければキーワード検索の順位順）。
+        """
+        normalized = _normalize_title(question)
+        mentioned = [
+            doc_id for doc_id, title in titles.items()
+            if title and _normalize_title(title) and _normalize_title(title) in normalized
+        ]
+        if mentioned:
+            return mentioned[:limit]
+        doc_ids = list(titles)
+        if len(doc_ids) <= limit:
+            return doc_ids
+        ranked: List[str] = []
+        for hit in self.lexical.search(question, 50):
+            if hit.get("document_id") in titles and hit["document_id"] not in ranked:
+                ranked.append(hit["document_id"])
+        ranked += [doc_id for doc_id in doc_ids if doc_id not in ranked]
+        return ranked[:limit]
+
+    def list_documents(
+        self,
+        offset: int = 0,
+        limit: Optional[int] = None,
+        sort: str = "created_at",
+        descending: bool = False,
+    ) -> Tuple[List[Dict], int]:
+        """
+        文書カタログから {document_id, document_title, chunk_count, size, ...} の一覧を返す。
+        Chroma にはアクセスしないため、チャンク数が多くても一覧の取得は軽い。
+        :return: (そのページの文書, 全文書数)
+        """
+        return self.catalog.list(offset=offset, limit=limit, sort=sort, descending=descending)
 
     def delete_document(self, document_id: str) -> int:
         """
@@ -173,18 +404,29 @@ class RAGRetriever:
         削除したチャンク数を返す。
         """
         try:
-            # まず該当するレコードの id を取得
-            result = self.collection.get(
-                where={"document_id": document_id},
-                include=[]
-            )
-            ids = result.get("ids") or []
-            if not ids:
-                # 一致するデータなし
-                return 0
-
-            # 取得した id 群を削除
-            self.collection.delete(ids=ids)
+            # 差し替え中の文書は、差し替えが終わってから削除する
+            with self._update_lock:
+                # まず該当するレコードの id を取得
+                result = self.collection.get(
+                    where={"document_id": document_id},
+                    include=[]
+                )
+                ids = result.get("ids") or []
+                if not ids:
+                    # 一致するデータなし（チャンクを書き込む前に登録が失敗した文書の全文だけは消しておく）
+                    if self.store is not None:
+                        self.store.delete(document_id)
+                    return 0
+
+                # 取得した id 群を削除
+                with self._rw_lock.write():
+                    self.collection.delete(ids=ids)
+                    self.catalog.remove(document_id)
+                    self.lexical.remove_document(document_id)
+                    self.articles.remove(document_id)
+                    if self.store is not None:
+                        self.store.delete(document_id)
+            self._bump_generation()
 
             return len(ids)
         except Exception as e:
@@ -193,46 +435,304 @@ class RAGRetriever:
             print(traceback.format_exc())
             return 0
 
-
-    def add_document(self, doc_id: str, title: str, content: str) -> int:
+    def add_document(
+        self,
+        doc_id: str,
+        title: str,
+        content: Union[str, Iterable[str]],
+        progress: Optional[Callable[[int, int], None]] = None,
+        metadata: Optional[Dict] = None,
+    ) -> int:
         """
         任意のテキスト文書をチャンク化してコレクションに追加する。
         :param doc_id: 文書ID（ユニークであれば任意）
         :param title: 文書タイトル（表示用）
-        :param content: 文書全体のテキスト内容
+        :param content: 文書全体のテキスト内容、またはページごとのテキストの iterable
+                        （iterable の場合は読み込みながらチャンク化・埋め込みを進めるため、
+                        全文をメモリに載せない）
+        :param progress: 進捗の通知先 progress(埋め込み済みチャンク数, 登録済みチャンク数)
+        :param metadata: すべてのチャンクに追加するメタデータ（例: source_sha256）
         :return: 追加されたチャンク数
         """
-        chunks = chunk_text(content)
-        ids: List[str] = []
-        documents: List[str] = []
-        metadatas: List[dict] = []
-
-        for idx, chunk in enumerate(chunks):
-            chunk_id = f"{doc_id}_chunk_{idx}"
-            ids.append(chunk_id)
-            documents.append(chunk)
-            metadatas.append(
-                {
-                    "document_id": doc_id,
-                    "document_title": title,
-                    "chunk_index": idx,
-                }
+        counts = self.add_documents([(doc_id, title, content, metadata)], progress=progress)
+        return counts.get(doc_id, 0)
+
+    def add_documents(
+        self,
+        documents: Iterable[Tuple[str, str, Union[str, Iterable[str]], Optional[Dict]]],
+        progress: Optional[Callable[[int, int], None]] = None,
+    ) -> Dict[str, int]:
+        """
+        複数の文書 (doc_id, title, content, metadata) をまとめて登録する。
+        すべての文書のチャンクを1つのパイプラインに流すため、小さな文書が続いても
+        埋め込みの API 呼び出しと Chroma への書き込みは大きなバッチのまま行われる。
+        :return: doc_id ごとの追加チャンク数（documents を読んだ順）
+        """
+        counts: Dict[str, int] = {}
+        entries: List[CatalogEntry] = []
+        writers: List[DocumentWriter] = []
+        sections: Dict[str, List[Section]] = {}
+        # キーワード索引には Chroma・カタログへの登録が終わってから載せる
+        # （文書ストアがある場合は本文を持たず、載せるときにストアから読み出す）
+        lexical_pending: List[ChunkRecord] = []
+
+        def records() -> Iterator[ChunkRecord]:
+            for doc_id, title, content, metadata in documents:
+                counts[doc_id] = 0
+                meter = ContentMeter()
+                scanner = SectionScanner()
+                content = scanner.wrap(meter.wrap(content))
+                if self.store is not None:
+                    # 全文を先に文書ストアへ書き出して確定させ、チャンクはストアから読み直して作る
+                    # （チャンクが Chroma に書き込まれた時点で、本文を必ずストアから読めるようにする）
+                    writer = self.store.writer(doc_id)
+                    writers.append(writer)
+                    for piece in [content] if isinstance(content, str) else content:
+                        writer.write(piece)
+                    writer.commit()
+                    if not isinstance(content, str):
+                        # ブロックごとに読み直すので、全文をメモリに載せない
+                        content = self.store.iter_text(doc_id)
+                for idx, chunk in enumerate(iter_chunks(content)):
+                    counts[doc_id] += 1
+                    record = ChunkRecord(
+                        id=f"{doc_id}_chunk_{idx}",
+                        text=chunk.text,
+                        metadata={
+                            **(metadata or {}),
+                            "document_id": doc_id,
+                            "document_title": title,
+                            "chunk_index": idx,
+                            **chunk.metadata(),
+                        },
+                    )
+                    lexical_pending.append(
+                        record if self.store is None
+                        else ChunkRecord(id=record.id, text="", metadata=record.metadata)
+                    )
+                    yield record
+                if self.store is not None and not counts[doc_id]:
+                    # チャンクが1つもなければ全文も残さない
+                    self.store.delete(doc_id)
+                if counts[doc_id]:
+                    sections[doc_id] = scanner.finish()
+                    entries.append(CatalogEntry(
+                        doc_id=doc_id,
+                        title=title,
+                        chunk_count=counts[doc_id],
+                        size=meter.size,
+                        sha256=meter.sha256,
+                        source_sha256=(metadata or {}).get("source_sha256"),
+                    ))
+
+        # バッチごとに埋め込みを並列計算して分割登録する
+        # （ストアを先に確認し、キャッシュミスの分だけ API で計算する）
+        try:
+            pipeline = IngestionPipeline(
+                self.collection, self.embedding_func, self.chunk_store,
+                store_documents=self.store is None,
             )
-
-        if not ids:
-            return 0
-
-        self.collection.add(
-            ids=ids,
-            documents=documents,
-            metadatas=metadatas,
-        )
+            if progress is not None:
+                pipeline.progress = progress
+            added = pipeline.run(records())
+        except Exception:
+            for writer in writers:
+                writer.abort()
+            raise
+
+        if added == 0:
+            return counts
+        # Chroma への登録がすべて終わってから、一覧・条文索引・キーワード索引に載せる
+        with self._rw_lock.write():
+            self.catalog.put_many(entries)
+            self.articles.put_many(sections)
+            self.lexical.add(
+                record if record.text else
+                ChunkRecord(id=record.id, text=self._stored_text(record.metadata) or "", metadata=record.metadata)
+                for record in lexical_pending
+            )
+        self._bump_generation()
 
         # 追加後の総件数をログで確認できるように
-        new_count = self.collection.count()
+        new_count = self.chunk_count()
         print(
-            f"[RAGRetriever.add_document] doc_id={doc_id}, "
-            f"added_chunks={len(ids)}, total_chunks={new_count}"
+            f"[RAGRetriever.add_documents] documents={len(counts)}, "
+            f"added_chunks={added}, total_chunks={new_count}"
         )
 
-        return len(ids)
\ No newline at end of file
+        return counts
+
+    def update_document(
+        self,
+        doc_id: str,
+        content: Union[str, Iterable[str]],
+        title: Optional[str] = None,
+        metadata: Optional[Dict] = None,
+    ) -> Optional[Dict]:
+        """
+        登録済みの文書の内容を差し替える（文書IDはそのまま）。
+        新しい内容をチャンク化し、既存のチャンクと本文のハッシュで突き合わせて
+        - 変わらないチャンク: ID・埋め込みをそのまま残し、位置などのメタデータだけ更新する
+        - 新しいチャンク: 埋め込みを計算して追加する
+        - なくなったチャンク: 削除する
+        埋め込みの計算は先に済ませ、Chroma・キーワード索引・カタログへの反映は
+        書き込みロックの中でまとめて行うため、検索で差し替え途中の状態が見えることはない。
+        :param title: 新しいタイトル（省略時は現在のタイトルを引き継ぐ）
+        :param metadata: すべてのチャンクに追加するメタデータ（例: source_sha256）
+        :return: {"chunks", "kept", "added", "removed", "title"}。文書が見つからない場合は None
+        :raises ValueError: 新しい内容からチャンクが1つも作れなかった場合
+        """
+        with self._update_lock:
+            existing = self.collection.get(
+                where={"document_id": doc_id},
+                include=["documents", "metadatas"],
+            )
+            old_ids = existing.get("ids") or []
+            if not old_ids:
+                return None
+            old_metas = existing.get("metadatas") or [{}] * len(old_ids)
+            if title is None:
+                title = next((m.get("document_title") for m in old_metas if m and m.get("document_title")), doc_id)
+
+            # 本文のハッシュ → 既存のチャンクID（同じ本文が複数あれば chunk_index 順に使う）
+            old_by_hash: Dict[str, List[str]] = {}
+            order = sorted(
+                range(len(old_ids)),
+                key=lambda i: (old_metas[i] or {}).get("chunk_index", 0),
+            )
+            old_texts = existing.get("documents") or [None] * len(old_ids)
+            for i in order:
+                # 本文を Chroma に保存していないチャンクは、差し替え前の全文から取り出して突き合わせる
+                text = old_texts[i] if old_texts[i] is not None else self._stored_text(old_metas[i] or {})
+                old_by_hash.setdefault(_text_hash(text or ""), []).append(old_ids[i])
+            old_meta_by_id = {old_ids[i]: old_metas[i] or {} for i in range(len(old_ids))}
+
+            meter = ContentMeter()
+            scanner = SectionScanner()
+            content = scanner.wrap(meter.wrap(content))
+            # 新しい全文は一時ファイルに書き出しておき、書き込みロックの中で差し替える
+            writer = self.store.writer(doc_id) if self.store is not None else None
+            if writer is not None:
+                content = writer.wrap(content)
+            try:
+                kept: List[ChunkRecord] = []
+                added: List[ChunkRecord] = []
+                used_ids = set(old_ids)
+                for idx, chunk in enumerate(iter_chunks(content)):
+                    chunk_meta = {
+                        **(metadata or {}),
+                        "document_id": doc_id,
+                        "document_title": title,
+                        "chunk_index": idx,
+                        **chunk.metadata(),
+                    }
+                    digest = _text_hash(chunk.text)
+                    candidates = old_by_hash.get(digest)
+                    if candidates:
+                        kept.append(ChunkRecord(id=candidates.pop(0), text=chunk.text, metadata=chunk_meta))
+                        continue
+                    # 新しいチャンクのIDは本文のハッシュから作る（既存のIDとは重ならないようにする）
+                    chunk_id = f"{doc_id}_chunk_{digest[:16]}"
+                    n = 1
+                    while chunk_id in used_ids:
+                        n += 1
+                        chunk_id = f"{doc_id}_chunk_{digest[:16]}_{n}"
+                    used_ids.add(chunk_id)
+                    added.append(ChunkRecord(id=chunk_id, text=chunk.text, metadata=chunk_meta))
+
+                if not kept and not added:
+                    raise ValueError("新しい内容からチャンクを作成できませんでした。")
+                kept_ids = {r.id for r in kept}
+                removed_ids = [chunk_id for chunk_id in old_ids if chunk_id not in kept_ids]
+
+                # 新しいチャンクの埋め込みだけを計算する（ストアにあれば API は呼ばない）
+                pipeline = IngestionPipeline(
+                    self.collection, self.embedding_func, self.chunk_store,
+                    store_documents=self.store is None,
+                )
+                embeddings = pipeline.embed(added) if added else []
+
+                with self._rw_lock.write():
+                    if added:
+                        pipeline.write(added, embeddings)
+                    if kept:
+                        # Chroma の update はメタデータを上書きではなくマージするため、なくなったキーは None で消す
+                        self.collection.update(
+                            ids=[r.id for r in kept],
+                            metadatas=[
+                                {
+                                    **{key: None for key in old_meta_by_id[r.id] if key not in r.metadata},
+                                    **r.metadata,
+                                }
+                                for r in kept
+                            ],
+                        )
+                    if removed_ids:
+                        self.collection.delete(ids=removed_ids)
+                    self.lexical.remove_document(doc_id)
+                    self.lexical.add(kept + added)
+                    self.catalog.put_many([CatalogEntry(
+                        doc_id=doc_id,
+                        title=title,
+                        chunk_count=len(kept) + len(added),
+                        size=meter.size,
+                        sha256=meter.sha256,
+                        source_sha256=(metadata or {}).get("source_sha256"),
+                    )])
+                    self.articles.put_many({doc_id: scanner.finish()})
+                    if writer is not None:
+                        writer.commit()
+                    self._bump_generation()
+            finally:
+                # 確定しなかった（途中で失敗した）一時ファイルは破棄する
+                if writer is not None:
+                    writer.abort()
+
+        print(
+            f"[RAGRetriever.update_document] doc_id={doc_id}, kept={len(kept)}, "
+            f"added={len(added)}, removed={len(removed_ids)}"
+        )
+        return {
+            "title": title,
+            "chunks": len(kept) + len(added),
+            "kept": len(kept),
+            "added": len(added),
+            "removed": len(removed_ids),
+        }
+
+    def find_by_source_hash(self, hashes: Iterable[str]) -> Dict[str, str]:
+        """
+        元ファイルの SHA-256 から、登録済みの文書IDを引く（文書カタログを参照する）。
+        :return: {sha256: document_id}（登録されていないハッシュは含まない）
+        """
+        return self.catalog.find_by_source_hash(hashes)
+
+def _normalize_title(text: str) -> str:
+    # 拡張子・全角半角・大文字小文字の違いを無視して文書名を比べる
+    text = unicodedata.normalize("NFKC", text).lower()
+    stem, dot, ext = text.rpartition(".")
+    return stem if dot and stem and ext.isalnum() and len(ext) <= 5 else text
+
+
+def _text_hash(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+def reciprocal_rank_fusion(rankings: List[List[Dict]], n_results: int, k: Optional[int] = None) -> List[Dict]:
+    """
+    複数の検索結果を Reciprocal Rank Fusion（score = Σ 1 / (k + 順位)）で統合する。
+    score は「すべての結果で1位」のとき 1.0 になるよう正規化する。
+    """
+    k = config.RRF_K if k is None else k
+    fused: Dict[str, Dict] = {}
+    scores: Dict[str, float] = {}
+    for ranking in rankings:
+        for rank, doc in enumerate(ranking, start=1):
+            key = doc.get("chunk_id") or doc.get("snippet")
+            # 同じチャンクは先に出てきた結果（ベクトル検索側）の情報を使う
+            fused.setdefault(key, doc)
+            scores[key] = scores.get(key, 0.0) + 1.0 / (k + rank)
+
+    best = len(rankings) / (k + 1)
+    ordered = sorted(scores.items(), key=lambda item: item[1], reverse=True)[:n_results]
+    return [{**fused[key], "score": score / best} for key, score in ordered]
@@ -5,15 +5,22 @@ AIエージェントとの対話を行うためのAPIルーターです。
 LangGraphで構築されたエージェントを呼び出し、ユーザーの入力に応答します。
 """
 
-from typing import List
+import json
+from typing import AsyncIterator, Dict, List, Optional
 from fastapi import APIRouter, HTTPException
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, StreamingResponse
 from pydantic import BaseModel
 
-# 構築済みのエージェント実行インスタンス（シングルトン）をインポート
-from app.agent.graph_builder import agent_executor
+# 構築済みのエージェント実行インスタンス（非同期版シングルトン）をインポート
+from app.agent.graph_builder import async_agent_executor
 # ログや参照情報の型定義
 from app.agent.types import StepLog, Reference
+from app.agent.answer_cache import answer_cache, is_cacheable
+from app.agent.history_compressor import history_summarizer
+from app.rag.registry import registry
+from app.services.blocking_pool import run_blocking
+from app.services.session_store import is_valid_session_id, session_store
+from app import config
 
 
 router = APIRouter(
@@ -37,7 +44,15 @@ class AskRequest(BaseModel):
     エージェントへの問い合わせリクエスト
     """
     input: str                         # 最新のユーザー入力
-    history: List[Message] | None = None  # 過去の会話履歴（オプション）
+    history: List[Message] | None = None  # 過去の会話履歴（オプション。session_id 指定時は使わない）
+    session_id: Optional[str] = None   # サーバー側の会話セッションID（POST /sessions で発行。指定時は履歴をサーバーから読み出す）
+    instructions: Optional[str] = None  # この質問にだけ付ける指示（回答プロファイルなど。会話履歴には保存しない）
+
+class SessionCreateRequest(BaseModel):
+    """
+    会話セッションの作成リクエスト
+    """
+    history: List[Message] | None = None  # ブラウザに残っている会話をサーバー側へ移す場合に指定
 
 class AskResponse(BaseModel):
     """
@@ -46,6 +61,202 @@ class AskResponse(BaseModel):
     output: str                    # エージェントの最終回答テキスト
     steps: List[StepLog]           # 思考プロセス（ステップごとのログ）
     references: List[Reference]    # 回答に使用した参照情報（RAG/Web検索結果）
+    session_id: Optional[str] = None  # 会話セッションID（session_id 指定時のみ）
+
+
+# =================================================================
+# ヘルパー関数
+# =================================================================
+
+def _request_history(messages: Optional[List[Message]]) -> List[Dict]:
+    # 会話履歴の変換（内部処理用フォーマットへ）
+    if not messages:
+        return []
+    return [{"role": m.role, "content": m.content} for m in messages]
+
+
+def _check_sessions_enabled() -> None:
+    if not config.SESSION_STORE_ENABLED:
+        raise HTTPException(status_code=404, detail="サーバー側の会話セッションは無効です。")
+
+
+def _check_session_id(session_id: str) -> None:
+    _check_sessions_enabled()
+    if not is_valid_session_id(session_id):
+        raise HTTPException(
+            status_code=400,
+            detail="session_id の形式が不正です（POST /api/agent/sessions で発行した ID を指定してください）。",
+        )
+
+
+def _session_not_found(session_id: str) -> HTTPException:
+    # サーバーのデータが消えた場合など。クライアントはセッションを作り直して履歴を移す
+    return HTTPException(
+        status_code=404,
+        detail=f"session_id='{session_id}' の会話セッションは見つかりませんでした。",
+    )
+
+
+def _session_id_for(request: AskRequest) -> Optional[str]:
+    """
+    サーバー側の会話セッションを使う場合はその ID を返す（使わない場合は None）。
+    """
+    if not request.session_id:
+        return None
+    _check_session_id(request.session_id)
+    return request.session_id
+
+
+def _open_session(session_id: str) -> List[Dict]:
+    """
+    セッションの会話履歴を読み出す。
+    保存済みの要約は要約キャッシュに戻し、再起動後も古いターンを要約し直さずに済むようにする。
+    """
+    history = session_store.history(session_id)
+    if history is None:
+        raise _session_not_found(session_id)
+
+    summary, covered = session_store.summary(session_id)
+    if summary and covered <= len(history) and history_summarizer.lookup(history[:covered])[1] < covered:
+        history_summarizer.put(history[:covered], summary)
+    return history
+
+
+def _record_session(session_id: str, history: List[Dict], user_input: str, output: str) -> None:
+    """
+    回答できたターン（ユーザー入力と回答）をセッションに追記し、その時点の要約も保存する。
+    """
+    session_store.append(
+        session_id,
+        [{"role": "user", "content": user_input}, {"role": "assistant", "content": output}],
+    )
+    summary, covered = history_summarizer.lookup(history)
+    if summary:
+        session_store.save_summary(session_id, summary, covered)
+
+
+async def _prepare_state(request: AskRequest, session_id: Optional[str]) -> Dict:
+    if session_id is None:
+        return _build_initial_state(request, _request_history(request.history))
+    history = await run_blocking(_open_session, session_id)
+    return _build_initial_state(request, history)
+
+
+async def _save_session(
+    session_id: Optional[str], request: AskRequest, initial_state: Dict, output: str
+) -> None:
+    # 回答が得られなかったターンは記録しない（ユーザー入力と回答を必ず対にして残す）
+    if session_id is None or not output:
+        return
+    try:
+        await run_blocking(
+            # 履歴にはユーザーが入力した文だけを残す（instructions を含めると履歴・要約が毎回膨らむ）
+            _record_session, session_id, initial_state["chat_history"], request.input, output
+        )
+    except Exception as e:
+        # 履歴の保存に失敗しても回答は返す
+        print(f"警告: 会話セッションへの保存に失敗しました（session_id={session_id}）: {e}")
+
+
+def _agent_input(request: AskRequest) -> str:
+    # 指示（回答プロファイルなど）がある場合は、ユーザーの入力の前に付けてエージェントに渡す
+    if not request.instructions or not request.instructions.strip():
+        return request.input
+    return f"{request.instructions.strip()}\n\n--- ユーザーからの指示 ---\n{request.input}"
+
+
+def _build_initial_state(request: AskRequest, history_list: List[Dict]) -> Dict:
+    """
+    リクエストからエージェントの初期ステートを作成する。
+    ここに必要な情報をすべて詰めてエージェントに渡す。
+    """
+    return {
+        "input": _agent_input(request),  # ユーザーの質問（指示付き）
+        "steps": [],                  # 実行ログ（空リストで開始）
+        "intent": None,               # 意図解析結果（最初はNone）
+        "source": None,               # 主な情報源（最初はNone）
+        "rag_result": [],             # RAG結果（最初は空）
+        "chat_history": history_list, # 会話履歴リスト
+    }
+
+
+def _sse_event(event: str, data) -> str:
+    """
+    Server-Sent Events の1イベント分の文字列を作る。
+    """
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+
+def _dump(item) -> Dict:
+    return item.model_dump() if isinstance(item, BaseModel) else dict(item)
+
+
+def _index_context():
+    """
+    回答キャッシュ用に、現在のインデックス世代番号と質問の埋め込み関数を返す。
+    RAGRetriever が使えない場合は (0, None)。
+    """
+    try:
+        retriever = registry.get_retriever()
+    except Exception:
+        return 0, None
+    return retriever.generation, retriever.embed_query
+
+
+async def _lookup_cache(initial_state: Dict, generation: int, embed) -> Optional[Dict]:
+    """
+    回答キャッシュを検索し、ヒットした場合はレスポンス用の結果（output / steps / references）を返す。
+    返す steps にはすべて cached=True を付け、最後にキャッシュ利用のステップを追加する。
+    """
+    if not config.ANSWER_CACHE_ENABLED:
+        return None
+
+    # 類似検索では埋め込みの計算（ブロッキング）が入るためスレッドプールで実行する
+    hit = await run_blocking(
+        answer_cache.lookup,
+        initial_state["input"],
+        initial_state["chat_history"],
+        generation,
+        embed,
+    )
+    if hit is None:
+        return None
+
+    entry = hit["entry"]
+    steps = [StepLog(**{**s, "cached": True}) for s in entry.steps]
+    match = "完全一致" if hit["match"] == "exact" else f"類似質問（類似度 {hit['similarity']:.2f}）"
+    steps.append(
+        StepLog(
+            step_idx=len(steps) + 1,
+            agent_node="cache",
+            step_input=f"Input: {initial_state['input']}",
+            step_output=f"回答キャッシュ: {match}でヒットしたため、保存済みの回答を返しました。",
+            cached=True,
+        )
+    )
+    return {
+        "output": entry.output,
+        "steps": steps,
+        "references": [Reference(**r) for r in entry.references],
+        "source": entry.source,
+    }
+
+
+async def _store_cache(initial_state: Dict, generation: int, embed, result: Dict) -> None:
+    if not config.ANSWER_CACHE_ENABLED or not is_cacheable(result):
+        return
+    try:
+        await run_blocking(
+            answer_cache.store,
+            initial_state["input"],
+            initial_state["chat_history"],
+            generation,
+            result,
+            embed,
+        )
+    except Exception as e:
+        # キャッシュ保存の失敗で回答を失敗させない
+        print(f"警告: 回答キャッシュへの保存に失敗しました: {e}")
 
 
 # =================================================================
@@ -60,40 +271,40 @@ async def ask_agent(request: AskRequest):
     処理内容:
     1. フロントエンドから質問と履歴を受け取る
     2. LangGraph エージェントのステートを初期化
-    3. エージェントを実行 (invoke)
+    3. エージェントを非同期に実行 (ainvoke)
     4. 結果（回答、ログ、参照情報）を返す
     """
+    session_id = _session_id_for(request)
     try:
         # デバッグログ出力
-        print(f"[API] /api/agent/ask called. input={request.input[:50]!r}")
-
-        # 会話履歴の変換（内部処理用フォーマットへ）
-        history_list = []
-        if request.history:
-            history_list = [
-                {"role": m.role, "content": m.content}
-                for m in request.history
-            ]
-
-        # エージェントの初期ステートを作成
-        # ここに必要な情報をすべて詰めてエージェントに渡す
-        initial_state = {
-            "input": request.input,       # ユーザーの質問
-            "steps": [],                  # 実行ログ（空リストで開始）
-            "intent": None,               # 意図解析結果（最初はNone）
-            "source": None,               # 主な情報源（最初はNone）
-            "rag_result": [],             # RAG結果（最初は空）
-            "chat_history": history_list, # 会話履歴リスト
-        }
-
-        # エージェント実行（同期処理の場合は invoke を使用）
+        print(f"[API] /api/agent/ask called. input={request.input[:50]!r}, session_id={session_id}")
+
+        # エージェントの初期ステートを作成（session_id 指定時は履歴をサーバー側から読み出す）
+        initial_state = await _prepare_state(request, session_id)
+
+        # 回答キャッシュ（同じ質問・履歴・インデックス世代なら保存済みの回答を返す）
+        generation, embed = _index_context()
+        cached = await _lookup_cache(initial_state, generation, embed)
+        if cached is not None:
+            await _save_session(session_id, request, initial_state, cached["output"])
+            print("[API] /api/agent/ask finished. (answer cache hit)")
+            return AskResponse(
+                output=cached["output"],
+                steps=cached["steps"],
+                references=cached["references"],
+                session_id=session_id,
+            )
+
+        # エージェント実行（ainvoke でイベントループをブロックせずに実行する）
         # graph_builder.py で定義されたワークフローが実行される
-        result_state = agent_executor.invoke(initial_state)
+        result_state = await async_agent_executor.ainvoke(initial_state)
+        await _store_cache(initial_state, generation, embed, result_state)
 
         # 実行結果から必要な情報を取り出す
         output = result_state.get("output", "")
         steps = result_state.get("steps", [])
         references = result_state.get("references", []) # Step 193で追加されたフィールド
+        await _save_session(session_id, request, initial_state, output)
 
         # 完了ログ出力
         print(
@@ -102,9 +313,10 @@ async def ask_agent(request: AskRequest):
             f"steps={len(steps)}"
         )
 
-        return AskResponse(output=output, steps=steps, references=references)
-
+        return AskResponse(output=output, steps=steps, references=references, session_id=session_id)
 
+    except HTTPException:
+        raise
     except Exception as e:
         # エラーハンドリング
         import traceback
@@ -120,3 +332,132 @@ async def ask_agent(request: AskRequest):
             },
             status_code=500,
         )
+
+
+@router.post("/ask/stream")
+async def ask_agent_stream(request: AskRequest):
+    """
+    /ask のストリーミング版（Server-Sent Events）。
+
+    送信するイベント:
+    - step: 各ノードが完了するたびに、その StepLog を送る
+    - token: 回答生成ノード（answer）の LLM 出力をトークン単位で送る
+    - references: 回答に使用した参照情報（最後に1回）
+    - done: 最終回答テキスト（output）と会話セッションID（session_id）
+    - error: 実行中にエラーが発生した場合
+    """
+    session_id = _session_id_for(request)
+    print(f"[API] /api/agent/ask/stream called. input={request.input[:50]!r}, session_id={session_id}")
+    # セッションが見つからない場合などは、ストリームを始める前に HTTP エラーで返す
+    initial_state = await _prepare_state(request, session_id)
+
+    async def event_stream() -> AsyncIterator[str]:
+        sent_steps = 0
+        output = ""
+        references: List = []
+        steps: List = []
+        # キャッシュ保存の判定用（回答生成・RAG 検索のエラー、Web検索の有無）と、保存する情報源
+        result_flags: Dict = {}
+        try:
+            # 回答キャッシュにヒットした場合は、保存済みのステップと回答をそのまま送る
+            generation, embed = _index_context()
+            cached = await _lookup_cache(initial_state, generation, embed)
+            if cached is not None:
+                for step in cached["steps"]:
+                    yield _sse_event("step", _dump(step))
+                yield _sse_event("references", [_dump(r) for r in cached["references"]])
+                await _save_session(session_id, request, initial_state, cached["output"])
+                yield _sse_event("done", {"output": cached["output"], "session_id": session_id})
+                print("[API] /api/agent/ask/stream finished. (answer cache hit)")
+                return
+
+            # updates: ノード完了ごとのステート / messages: LLM のトークン
+            async for mode, chunk in async_agent_executor.astream(
+                initial_state, stream_mode=["updates", "messages"]
+            ):
+                if mode == "messages":
+                    message, metadata = chunk
+                    # 意図解析（分類器）の出力は流さず、回答生成のトークンだけを送る
+                    if metadata.get("langgraph_node") == "answer" and message.content:
+                        yield _sse_event("token", {"content": message.content})
+                    continue
+
+                # 各ノードの更新には、そのノードが追加した steps / references だけが入っている
+                for update in chunk.values():
+                    if not update:
+                        continue
+                    for step in update.get("steps") or []:
+                        sent_steps += 1
+                        # 並列ノードの step_idx はマージ前の値なので、送信順に振り直す
+                        step_data = {**_dump(step), "step_idx": sent_steps}
+                        steps.append(step_data)
+                        yield _sse_event("step", step_data)
+                    references.extend(update.get("references") or [])
+                    if update.get("output"):
+                        output = update["output"]
+                    for key in ("error", "rag_error", "web_search_result", "source"):
+                        if update.get(key):
+                            result_flags[key] = update[key]
+
+            yield _sse_event("references", [_dump(r) for r in references])
+            await _save_session(session_id, request, initial_state, output)
+            yield _sse_event("done", {"output": output, "session_id": session_id})
+            await _store_cache(
+                initial_state,
+                generation,
+                embed,
+                {"output": output, "steps": steps, "references": references, **result_flags},
+            )
+            print(f"[API] /api/agent/ask/stream finished. steps={sent_steps}")
+
+        except Exception as e:
+            import traceback
+            print(f"Error in /api/agent/ask/stream: {e}")
+            print(f"Traceback: {traceback.format_exc()}")
+            yield _sse_event(
+                "error",
+                {
+                    "error": str(e),
+                    "message": "エージェントの実行中にエラーが発生しました。サーバーログを確認してください。",
+                },
+            )
+
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+@router.post("/sessions")
+async def create_session(request: SessionCreateRequest | None = None):
+    """
+    サーバー側の会話セッションを作成し、発行した session_id を返すエンドポイント。
+    history を指定した場合は、その会話をセッションの最初の履歴として取り込む。
+    """
+    _check_sessions_enabled()
+    history = _request_history(request.history if request is not None else None)
+    session_id = await run_blocking(session_store.create, history)
+    return {"session_id": session_id, "turns": len(history)}
+
+
+@router.get("/sessions/{session_id}")
+async def get_session(session_id: str):
+    """
+    サーバー側に保存されている会話セッションの履歴を返すエンドポイント。
+    """
+    _check_session_id(session_id)
+    history = await run_blocking(session_store.history, session_id)
+    if history is None:
+        raise _session_not_found(session_id)
+    return {"session_id": session_id, "turns": len(history), "history": history}
+
+
+@router.delete("/sessions/{session_id}")
+async def delete_session(session_id: str):
+    """
+    サーバー側に保存されている会話セッションを削除するエンドポイント（存在しなくてもエラーにしない）。
+    """
+    _check_session_id(session_id)
+    deleted = await run_blocking(session_store.delete, session_id)
+    return {"session_id": session_id, "deleted": deleted}
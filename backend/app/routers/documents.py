@@ -6,14 +6,31 @@ backend/app/routers/documents.py
 RAG（Retrieval-Augmented Generation）システムへの文書登録もここで行います。
 """
 
+import json
+import os
+import tempfile
 import uuid
+from dataclasses import asdict
+from datetime import datetime
 from typing import List
-from fastapi import APIRouter, UploadFile, File, Form, HTTPException, Depends
+from fastapi import APIRouter, UploadFile, File, Form, HTTPException, Depends, Query
 from fastapi.responses import JSONResponse
 from pydantic import BaseModel
 
+from app.rag.document_catalog import SORT_FIELDS
 from app.rag.retriever import RAGRetriever
-from app.services.document_parser import parse_document_content
+from app.rag.registry import registry
+from app.services.blocking_pool import run_blocking
+from app.services.document_parser import (
+    SUPPORTED_EXTENSIONS,
+    empty_content_error,
+    get_extension,
+    iter_document_text,
+)
+from app.services.bulk_ingest import BulkItem, run_bulk, summarize, unsupported_reason
+from app.services.ingest_jobs import KIND_BULK, JobQueueFullError, job_queue
+from app.services.upload_spool import spool_upload
+from app import config
 
 # ルーターの定義
 router = APIRouter(
@@ -25,19 +42,13 @@ router = APIRouter(
 # 依存関係定義 (Dependency Injection)
 # =================================================================
 
-# RAGRetrieverのシングルトンインスタンスを保持する変数
-_retriever_instance = None
-
-def get_retriever():
+def get_retriever() -> RAGRetriever:
     """
     RAGRetriever のインスタンスを取得する依存関係関数。
-    初回呼び出し時にインスタンスを生成し、以降は同じインスタンスを返します（シングルトンパターン）。
-    これにより、DB接続などのリソースを効率的に管理します。
+    プロセス全体で共有しているリソースレジストリ（app.rag.registry）から取得するため、
+    エージェントのノードと同じインスタンスが使われます。
     """
-    global _retriever_instance
-    if _retriever_instance is None:
-        _retriever_instance = RAGRetriever()
-    return _retriever_instance
+    return registry.get_retriever()
 
 
 # =================================================================
@@ -58,12 +69,123 @@ class DocumentSummary(BaseModel):
     document_id: str
     document_title: str
     chunk_count: int
+    size: int = 0                    # 登録したテキストのバイト数
+    sha256: str | None = None        # 登録したテキストのハッシュ
+    created_at: str | None = None
+    updated_at: str | None = None
 
 class DocumentListResponse(BaseModel):
     """
     文書一覧取得APIのレスポンス
     """
     documents: List[DocumentSummary]
+    total: int = 0                   # 全文書数（ページングに使う）
+    offset: int = 0
+    limit: int | None = None
+
+
+# =================================================================
+# バックグラウンド取り込み用のヘルパー
+# =================================================================
+
+def _queue_full_error(e: JobQueueFullError) -> HTTPException:
+    return HTTPException(status_code=503, detail=str(e), headers={"Retry-After": "30"})
+
+
+def _check_job_capacity() -> None:
+    """
+    取り込み待ちのジョブが上限に達していれば 503 を返す（ファイルを受け取る前に確認する）。
+    """
+    try:
+        job_queue.check_capacity()
+    except JobQueueFullError as e:
+        raise _queue_full_error(e)
+
+
+def _submit_job(**job) -> dict:
+    """
+    取り込みジョブを登録する。ファイルを受け取っている間にキューが埋まった場合も 503 を返す。
+    """
+    try:
+        return job_queue.submit(**job)
+    except JobQueueFullError as e:
+        raise _queue_full_error(e)
+
+
+def _spool_text(content: str) -> str:
+    """
+    テキスト登録の本文を取り込み待ちファイルとして保存し、そのパスを返す。
+    """
+    config.INGEST_SPOOL_DIR.mkdir(parents=True, exist_ok=True)
+    fd, path = tempfile.mkstemp(suffix=".txt", dir=str(config.INGEST_SPOOL_DIR))
+    with os.fdopen(fd, "w", encoding="utf-8") as f:
+        f.write(content)
+    return path
+
+
+async def _spool_bulk(files: List[UploadFile]) -> List[BulkItem]:
+    """
+    一括取り込みのファイルを取り込み待ちファイルとして保存する。
+    未対応の形式・サイズ超過のファイルは保存せず、取り込まない理由だけを記録する。
+    """
+    items: List[BulkItem] = []
+    total = 0
+    try:
+        for file in files:
+            filename = file.filename or "uploaded_document"
+            reason = unsupported_reason(filename)
+            if reason is not None:
+                items.append(BulkItem(filename=filename, skip_reason=reason))
+                continue
+            # zip は展開後のファイルごとに上限を確認する
+            max_bytes = config.BULK_MAX_BYTES if get_extension(filename) == "zip" else config.UPLOAD_MAX_BYTES
+            try:
+                spooled = await spool_upload(file, max_bytes=max_bytes, directory=config.INGEST_SPOOL_DIR)
+            except HTTPException as e:
+                if e.status_code != 413:
+                    raise
+                items.append(BulkItem(filename=filename, skip_reason=e.detail))
+                continue
+            items.append(BulkItem(filename=filename, path=spooled.path, size=spooled.size, sha256=spooled.sha256))
+            total += spooled.size
+            if total > config.BULK_MAX_BYTES:
+                raise HTTPException(
+                    status_code=413,
+                    detail=f"ファイルの合計サイズが上限（{config.BULK_MAX_BYTES // (1024 * 1024)}MB）を超えています。",
+                )
+    except BaseException:
+        for item in items:
+            item.cleanup()
+        raise
+    return items
+
+
+def _write_manifest(items: List[BulkItem]) -> str:
+    """
+    一括取り込みジョブで処理するファイルの一覧を保存し、そのパスを返す。
+    """
+    config.INGEST_SPOOL_DIR.mkdir(parents=True, exist_ok=True)
+    fd, path = tempfile.mkstemp(suffix=".json", dir=str(config.INGEST_SPOOL_DIR))
+    with os.fdopen(fd, "w", encoding="utf-8") as f:
+        json.dump([asdict(item) for item in items], f, ensure_ascii=False)
+    return path
+
+
+def _accepted(job: dict, message: str) -> JSONResponse:
+    """
+    ジョブを受け付けたことを示す 202 レスポンス
+    """
+    return JSONResponse(
+        status_code=202,
+        content={
+            "message": message,
+            "job_id": job["job_id"],
+            "doc_id": job["doc_id"],
+            "title": job["title"],
+            "status": job["status"],
+            "status_url": f"{router.prefix}/jobs/{job['job_id']}",
+        },
+    )
 
 
 # =================================================================
@@ -94,21 +216,58 @@ async def upload_document(
         filename = file.filename or "uploaded_document"
         final_title = title or filename
         
-        # ファイルの中身を読み込む（非同期）
-        raw_bytes = await file.read()
-
-        # ファイル形式に応じてテキスト抽出（サービス層の関数を利用）
-        content = await parse_document_content(filename, raw_bytes)
+        if get_extension(filename) not in SUPPORTED_EXTENSIONS:
+            raise HTTPException(
+                status_code=400,
+                detail=f"未対応のファイル形式です: {filename}（txt/pdf/docx などを利用してください）",
+            )
 
         # ドキュメントIDの生成（一意なID）
         doc_id = "user_" + uuid.uuid4().hex
-        
-        # RAGインデックスへの登録処理
-        result = retriever.add_document(
-            doc_id=doc_id,
-            title=final_title,
-            content=content,
-        )
+
+        if config.INGEST_BACKGROUND:
+            # ファイルを保存してジョブを登録した時点で応答し、取り込みはバックグラウンドで行う
+            _check_job_capacity()
+            spooled = await spool_upload(file, directory=config.INGEST_SPOOL_DIR)
+            try:
+                job = _submit_job(
+                    kind="upload",
+                    doc_id=doc_id,
+                    title=final_title,
+                    filename=filename,
+                    path=spooled.path,
+                    size=spooled.size,
+                    sha256=spooled.sha256,
+                )
+            except BaseException:
+                spooled.cleanup()
+                raise
+            return _accepted(job, "アップロードしたファイルの取り込みを受け付けました。")
+
+        # ファイルの中身を一時ファイルに書き出す（メモリに全体を載せない。サイズ上限とハッシュもここで確認）
+        spooled = await spool_upload(file)
+
+        # ファイル形式に応じてテキストをページごとに抽出し（サービス層の関数を利用）、
+        # そのままチャンク分割・埋め込み・RAGインデックスへの登録に流し込む
+        # PDF / Word はプロセスプールで抽出され、ページごとの所要時間がレポートに入る
+        parse_report = {}
+        try:
+            result = await run_blocking(
+                retriever.add_document,
+                doc_id=doc_id,
+                title=final_title,
+                content=iter_document_text(filename, spooled.path, parse_report),
+                metadata={"source_sha256": spooled.sha256},
+            )
+        except Exception:
+            # 途中まで登録されたチャンクを残さない
+            await run_blocking(retriever.delete_document, doc_id)
+            raise
+        finally:
+            spooled.cleanup()
+
+        if result == 0:
+            raise empty_content_error(filename)
 
         print(f"[API] /api/documents/upload finished. doc_id={doc_id}, title={final_title!r}")
         
@@ -117,6 +276,9 @@ async def upload_document(
             "title": final_title,
             "doc_id": doc_id,
             "result": result,
+            "size": spooled.size,
+            "sha256": spooled.sha256,
+            "parse": parse_report,
         }
 
     except HTTPException:
@@ -133,6 +295,83 @@ async def upload_document(
         )
 
 
+@router.post("/bulk")
+async def bulk_upload_documents(
+    files: List[UploadFile] = File(...),
+    retriever: RAGRetriever = Depends(get_retriever)
+):
+    """
+    複数のファイル（または zip アーカイブ）をまとめてRAGインデックスに登録するエンドポイント。
+    内容が同じファイル（バッチ内・登録済みの文書）は重複として取り込まない。
+
+    Returns:
+        JSON: ファイルごとの結果（indexed / duplicate / skipped / failed）と件数の集計
+              （バックグラウンド処理の場合は 202 を返し、結果はジョブの results で確認する）
+    """
+    try:
+        print(f"[API] /api/documents/bulk called. files={len(files)}")
+
+        if len(files) > config.BULK_MAX_FILES:
+            raise HTTPException(
+                status_code=400,
+                detail=f"一度に登録できるファイル数（{config.BULK_MAX_FILES}件）を超えています。",
+            )
+
+        if config.INGEST_BACKGROUND:
+            _check_job_capacity()
+        items = await _spool_bulk(files)
+
+        if config.INGEST_BACKGROUND:
+            try:
+                manifest = await run_blocking(_write_manifest, items)
+                try:
+                    job = _submit_job(
+                        kind=KIND_BULK,
+                        doc_id="",
+                        title=f"{len(items)}件のファイル",
+                        filename=items[0].filename if len(items) == 1 else f"{len(items)} files",
+                        path=manifest,
+                        size=sum(item.size for item in items),
+                        files_total=len(items),
+                    )
+                except BaseException:
+                    os.unlink(manifest)
+                    raise
+            except BaseException:
+                for item in items:
+                    item.cleanup()
+                raise
+            return _accepted(job, "ファイルの一括取り込みを受け付けました。")
+
+        batch_id = uuid.uuid4().hex
+        try:
+            results = await run_blocking(run_bulk, retriever, items, batch_id)
+        finally:
+            for item in items:
+                item.cleanup()
+
+        summary = summarize(results)
+        print(f"[API] /api/documents/bulk finished. batch_id={batch_id}, summary={summary}")
+
+        return {
+            "message": "ファイルを一括でRAGインデックスに登録しました。",
+            "batch_id": batch_id,
+            "summary": summary,
+            "results": results,
+        }
+
+    except HTTPException:
+        raise
+    except Exception as e:
+        import traceback
+        print(f"Error in /api/documents/bulk: {e}")
+        print(traceback.format_exc())
+        raise HTTPException(
+            status_code=500,
+            detail=f"一括登録中に予期せぬエラーが発生しました: {e}",
+        )
+
+
 @router.post("/register")
 async def register_document(
     payload: DocumentRegisterRequest,
@@ -150,13 +389,37 @@ async def register_document(
 
         # ドキュメントIDの生成
         doc_id = "user_" + uuid.uuid4().hex
-        
+
+        if config.INGEST_BACKGROUND:
+            # 本文をファイルに保存してジョブを登録し、取り込みはバックグラウンドで行う
+            _check_job_capacity()
+            path = await run_blocking(_spool_text, payload.content)
+            try:
+                job = _submit_job(
+                    kind="register",
+                    doc_id=doc_id,
+                    title=payload.title,
+                    filename=f"{doc_id}.txt",
+                    path=path,
+                    size=len(payload.content.encode("utf-8")),
+                )
+            except BaseException:
+                os.unlink(path)
+                raise
+            return _accepted(job, "文書の登録を受け付けました。")
+
         # RAGインデックスへの登録
-        result = retriever.add_document(
-            doc_id=doc_id,
-            title=payload.title,
-            content=payload.content,
-        )
+        try:
+            result = await run_blocking(
+                retriever.add_document,
+                doc_id=doc_id,
+                title=payload.title,
+                content=payload.content,
+            )
+        except Exception:
+            # 途中まで登録されたチャンクを残さない
+            await run_blocking(retriever.delete_document, doc_id)
+            raise
 
         print(f"[API] /api/documents/register finished. doc_id={doc_id}, result={result}")
         
@@ -167,6 +430,8 @@ async def register_document(
             "result": result,
         }
 
+    except HTTPException:
+        raise
     except Exception as e:
         import traceback
         print(f"Error in /api/documents/register: {e}")
@@ -177,15 +442,45 @@ async def register_document(
         )
 
 
+@router.get("/jobs/{job_id}")
+async def get_ingest_job(job_id: str):
+    """
+    取り込みジョブの状態（段階・チャンク数・エラー）を返すエンドポイント。
+    """
+    job = job_queue.get(job_id)
+    if job is None:
+        raise HTTPException(
+            status_code=404,
+            detail=f"job_id='{job_id}' に対応するジョブは見つかりませんでした。",
+        )
+    return job
+
+
 @router.get("", response_model=DocumentListResponse)
-async def list_documents(retriever: RAGRetriever = Depends(get_retriever)):
+async def list_documents(
+    offset: int = Query(0, ge=0),
+    limit: int = Query(config.DOCUMENT_LIST_DEFAULT_LIMIT, ge=1, le=config.DOCUMENT_LIST_MAX_LIMIT),
+    sort: str = Query("created_at", description=f"並び替え項目（{' / '.join(SORT_FIELDS)}）"),
+    order: str = Query("asc", pattern="^(asc|desc)$"),
+    retriever: RAGRetriever = Depends(get_retriever)
+):
     """
     登録済み文書の一覧（メタデータ）を取得するエンドポイント。
+    文書カタログから返すため、ベクトルDB（Chroma）にはアクセスしない。
     """
+    if sort not in SORT_FIELDS:
+        raise HTTPException(
+            status_code=400,
+            detail=f"未対応の並び替え項目です: {sort}（{' / '.join(SORT_FIELDS)} のいずれか）",
+        )
     try:
-        # 全ドキュメントのリストを取得
-        docs = retriever.list_documents()
-        return DocumentListResponse(documents=docs)
+        docs, total = retriever.list_documents(
+            offset=offset, limit=limit, sort=sort, descending=(order == "desc"),
+        )
+        for doc in docs:
+            for key in ("created_at", "updated_at"):
+                doc[key] = datetime.fromtimestamp(doc[key]).isoformat(timespec="seconds")
+        return DocumentListResponse(documents=docs, total=total, offset=offset, limit=limit)
     except Exception as e:
         import traceback
         print(f"Error in GET /api/documents: {e}")
@@ -196,6 +491,99 @@ async def list_documents(retriever: RAGRetriever = Depends(get_retriever)):
         )
 
 
+@router.put("/{document_id}")
+async def update_document(
+    document_id: str,
+    file: UploadFile | None = File(None),
+    content: str | None = Form(None),
+    title: str | None = Form(None),
+    retriever: RAGRetriever = Depends(get_retriever)
+):
+    """
+    登録済みの文書の内容を差し替えるエンドポイント（改訂版の契約書など）。
+    文書IDは変わらず、内容が変わったチャンクだけを埋め込み直す。
+
+    Args:
+        document_id (str): 差し替える文書のID
+        file (UploadFile | None): 新しい内容のファイル（content とどちらか一方）
+        content (str | None): 新しい内容のテキスト（file とどちらか一方）
+        title (str | None): 新しいタイトル（省略時は現在のタイトルのまま）
+
+    Returns:
+        JSON: 差し替え後のチャンク数と、残した・追加した・削除したチャンク数
+    """
+    try:
+        print(f"[API] PUT /api/documents/{document_id} called. "
+              f"filename={file.filename if file else None!r}, title={title!r}")
+
+        if (file is None) == (content is None):
+            raise HTTPException(
+                status_code=400,
+                detail="新しい内容は file（ファイル）か content（テキスト）のどちらか一方で指定してください。",
+            )
+
+        if file is None:
+            result = await run_blocking(
+                retriever.update_document,
+                doc_id=document_id,
+                content=content,
+                title=title,
+            )
+            spooled, parse_report = None, None
+        else:
+            filename = file.filename or "uploaded_document"
+            if get_extension(filename) not in SUPPORTED_EXTENSIONS:
+                raise HTTPException(
+                    status_code=400,
+                    detail=f"未対応のファイル形式です: {filename}（txt/pdf/docx などを利用してください）",
+                )
+            spooled = await spool_upload(file)
+            parse_report = {}
+            try:
+                result = await run_blocking(
+                    retriever.update_document,
+                    doc_id=document_id,
+                    content=iter_document_text(filename, spooled.path, parse_report),
+                    title=title,
+                    metadata={"source_sha256": spooled.sha256},
+                )
+            except ValueError:
+                # テキストが取り出せなかった場合は元の文書を残したまま 400 にする
+                raise empty_content_error(filename)
+            finally:
+                spooled.cleanup()
+
+        if result is None:
+            raise HTTPException(
+                status_code=404,
+                detail=f"document_id='{document_id}' に対応するデータは見つかりませんでした。",
+            )
+
+        print(f"[API] PUT /api/documents/{document_id} finished. result={result}")
+
+        response = {
+            "message": "文書の内容を差し替えました。",
+            "doc_id": document_id,
+            **result,
+        }
+        if spooled is not None:
+            response.update(size=spooled.size, sha256=spooled.sha256, parse=parse_report)
+        return response
+
+    except HTTPException:
+        raise
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        import traceback
+        print(f"Error in PUT /api/documents/{document_id}: {e}")
+        print(traceback.format_exc())
+        raise HTTPException(
+            status_code=500,
+            detail=f"文書の差し替え中にエラーが発生しました: {e}",
+        )
+
+
 @router.delete("/{document_id}")
 async def delete_document(
     document_id: str,
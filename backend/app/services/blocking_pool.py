@@ -0,0 +1,44 @@
+"""
+backend/app/services/blocking_pool.py
+
+同期（ブロッキング）処理をイベントループの外で実行するための共有スレッドプールです。
+Chroma の検索など、非同期クライアントを持たない処理を async なコードから呼び出す際に使用します。
+スレッド数に上限を設けることで、負荷が高いときも同時実行数が際限なく増えないようにしています。
+"""
+
+import asyncio
+import functools
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, Callable, TypeVar
+
+from app import config
+
+T = TypeVar("T")
+
+# プロセス全体で共有する上限付きスレッドプール
+_executor = ThreadPoolExecutor(
+    max_workers=config.BLOCKING_POOL_SIZE,
+    thread_name_prefix="blocking",
+)
+
+
+async def run_blocking(func: Callable[..., T], *args: Any, **kwargs: Any) -> T:
+    """
+    func(*args, **kwargs) を共有スレッドプールで実行し、結果を await できるようにします。
+    """
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_executor, functools.partial(func, *args, **kwargs))
+
+
+def submit_blocking(func: Callable[..., T], *args: Any, **kwargs: Any) -> "Future[T]":
+    """
+    同期コードから func を共有スレッドプールに投入し、Future を返します。
+    """
+    return _executor.submit(func, *args, **kwargs)
+
+
+def shutdown() -> None:
+    """
+    アプリケーション終了時にスレッドプールを停止します。
+    """
+    _executor.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,319 @@
+"""
+backend/app/services/bulk_ingest.py
+
+複数のファイル（または zip アーカイブ）をまとめて RAG インデックスに取り込むためのモジュールです。
+
+- 内容ハッシュ（SHA-256）で重複を判定し、同じバッチ内・登録済みの文書と同じファイルは取り込みません
+- ファイルのパースは数件ずつ先行して並列に実行します（PDF / Word の抽出はパース用プロセスプール）
+- すべてのファイルのチャンクを1つの取り込みパイプラインに流すため、小さなファイルが多くても
+  埋め込みの API 呼び出しと Chroma への書き込みは大きなバッチのまま行われます
+- ファイルごとに結果（indexed / duplicate / skipped / failed）を返します
+"""
+
+import hashlib
+import os
+import shutil
+import time
+import uuid
+import zipfile
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Callable, Deque, Dict, Iterator, List, Optional, Tuple
+
+from fastapi import HTTPException
+
+from app import config
+from app.rag.retriever import RAGRetriever
+from app.services.document_parser import SUPPORTED_EXTENSIONS, get_extension, iter_document_text
+
+# ファイルごとの結果
+STATUS_INDEXED = "indexed"
+STATUS_DUPLICATE = "duplicate"
+STATUS_SKIPPED = "skipped"
+STATUS_FAILED = "failed"
+
+# zip から展開するときに1回に読み込むサイズ
+READ_BLOCK_BYTES = 1024 * 1024
+
+
+@dataclass
+class BulkItem:
+    filename: str
+    path: Optional[str] = None          # 取り込むファイル（skip_reason があるときは None）
+    size: int = 0
+    sha256: Optional[str] = None
+    skip_reason: Optional[str] = None   # 受け付けの時点で取り込まないと決まった理由
+
+    @property
+    def is_archive(self) -> bool:
+        return self.skip_reason is None and get_extension(self.filename) == "zip"
+
+    def cleanup(self) -> None:
+        if not self.path:
+            return
+        try:
+            os.unlink(self.path)
+        except FileNotFoundError:
+            pass
+
+
+def unsupported_reason(filename: str) -> Optional[str]:
+    """
+    取り込めない形式なら理由を返す（zip は展開してから判定する）。
+    """
+    ext = get_extension(filename)
+    if ext in SUPPORTED_EXTENSIONS or ext == "zip":
+        return None
+    return f"未対応のファイル形式です: .{ext or '不明'}"
+
+
+def _entry_name(info: zipfile.ZipInfo) -> str:
+    """
+    UTF-8 フラグのない zip（Windows の標準機能で作ったものなど）のファイル名は cp932 として読み直す。
+    """
+    if info.flag_bits & 0x800:
+        return info.filename
+    try:
+        return info.filename.encode("cp437").decode("cp932")
+    except (UnicodeEncodeError, UnicodeDecodeError):
+        return info.filename
+
+
+def _is_hidden(name: str) -> bool:
+    return any(part.startswith(".") or part == "__MACOSX" for part in name.split("/"))
+
+
+def expand_archive(item: BulkItem, directory: Path, budget: Dict[str, int]) -> List[BulkItem]:
+    """
+    zip の各ファイルを directory に展開して BulkItem のリストにする。
+    展開しながらサイズを数え、ファイル数・合計サイズ（budget）とファイルごとの上限を守る。
+    """
+    try:
+        archive = zipfile.ZipFile(item.path)
+    except (zipfile.BadZipFile, OSError) as e:
+        raise ValueError(f"zip ファイルを開けませんでした: {e}")
+
+    items: List[BulkItem] = []
+    with archive:
+        for info in archive.infolist():
+            name = _entry_name(info)
+            if info.is_dir() or _is_hidden(name):
+                continue
+            filename = f"{item.filename}/{name}"
+            reason = unsupported_reason(name)
+            if reason is None and get_extension(name) == "zip":
+                reason = "zip の中の zip は展開しません"
+            if reason is None and budget["files"] <= 0:
+                reason = f"ファイル数が上限（{config.BULK_MAX_FILES}件）を超えています"
+            if reason is None and info.file_size > config.UPLOAD_MAX_BYTES:
+                reason = f"ファイルサイズが上限（{config.UPLOAD_MAX_BYTES // (1024 * 1024)}MB）を超えています"
+            if reason is not None:
+                items.append(BulkItem(filename=filename, skip_reason=reason))
+                continue
+
+            # ヘッダーのサイズは信用せず、実際に展開したバイト数で上限を確認する
+            limit = min(config.UPLOAD_MAX_BYTES, budget["bytes"])
+            path = directory / f"{len(items):05d}.{get_extension(name)}"
+            digest = hashlib.sha256()
+            size = 0
+            try:
+                with archive.open(info) as src, open(path, "wb") as out:
+                    while True:
+                        block = src.read(READ_BLOCK_BYTES)
+                        if not block:
+                            break
+                        size += len(block)
+                        if size > limit:
+                            break
+                        digest.update(block)
+                        out.write(block)
+            except (zipfile.BadZipFile, RuntimeError, OSError, EOFError) as e:
+                # 壊れたエントリ・暗号化されたエントリなど
+                path.unlink(missing_ok=True)
+                items.append(BulkItem(filename=filename, skip_reason=f"zip から取り出せませんでした: {e}"))
+                continue
+            if size > limit:
+                path.unlink(missing_ok=True)
+                items.append(BulkItem(filename=filename, skip_reason="展開後のサイズが上限を超えています"))
+                continue
+
+            budget["files"] -= 1
+            budget["bytes"] -= size
+            items.append(BulkItem(filename=filename, path=str(path), size=size, sha256=digest.hexdigest()))
+    return items
+
+
+def _parse(item: BulkItem) -> Tuple[str, Dict]:
+    """
+    1ファイル分のテキストを抽出する（パース用スレッドで実行）。
+    """
+    report: Dict = {}
+    text = "".join(iter_document_text(item.filename, item.path, report))
+    return text, report
+
+
+def _error_message(e: Exception) -> str:
+    return e.detail if isinstance(e, HTTPException) else str(e)
+
+
+def run_bulk(
+    retriever: RAGRetriever,
+    items: List[BulkItem],
+    batch_id: str,
+    progress: Optional[Callable[[int, int, int, int], None]] = None,
+) -> List[Dict]:
+    """
+    ファイルをまとめて取り込み、ファイルごとの結果を受け付け順に返す。
+    文書IDは batch_id とファイルの位置から決めるため、同じバッチを再実行しても同じIDに上書きされる。
+    :param progress: 進捗の通知先 progress(処理済みファイル数, ファイル数, 埋め込み済みチャンク数, 登録済みチャンク数)
+                     （重複・対象外のファイルは最初から処理済みに数える）
+    """
+    work_dir = config.INGEST_SPOOL_DIR / f"bulk_{batch_id}"
+    shutil.rmtree(work_dir, ignore_errors=True)
+    try:
+        return _run_bulk(retriever, items, batch_id, work_dir, progress)
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+
+def _run_bulk(
+    retriever: RAGRetriever,
+    items: List[BulkItem],
+    batch_id: str,
+    work_dir: Path,
+    progress: Optional[Callable[[int, int, int, int], None]],
+) -> List[Dict]:
+    # 1. zip を展開して、取り込む候補のファイルを並べる
+    budget = {"files": config.BULK_MAX_FILES, "bytes": config.BULK_MAX_BYTES}
+    files: List[BulkItem] = []
+    for i, item in enumerate(items):
+        if not item.is_archive:
+            if item.skip_reason is None:
+                budget["files"] -= 1
+                budget["bytes"] -= item.size
+            files.append(item)
+            continue
+        directory = work_dir / str(i)
+        directory.mkdir(parents=True, exist_ok=True)
+        try:
+            files.extend(expand_archive(item, directory, budget))
+        except ValueError as e:
+            files.append(BulkItem(filename=item.filename, skip_reason=str(e)))
+
+    results: List[Dict] = [{"filename": f.filename} for f in files]
+    doc_ids = [
+        "user_" + uuid.uuid5(uuid.NAMESPACE_URL, f"bulk/{batch_id}/{i}/{f.filename}").hex
+        for i, f in enumerate(files)
+    ]
+
+    # 2. 重複の判定（同じバッチ内は最初のファイルだけを取り込む。再実行時は自分自身の登録を重複とみなさない）
+    try:
+        existing = retriever.find_by_source_hash(f.sha256 for f in files if f.sha256)
+    except Exception as e:
+        print(f"警告: [BulkIngest] 登録済み文書との重複確認に失敗しました: {e}")
+        existing = {}
+    first_by_hash: Dict[str, str] = {}
+    targets: List[int] = []
+    for i, f in enumerate(files):
+        if f.skip_reason is not None:
+            results[i].update(status=STATUS_SKIPPED, reason=f.skip_reason)
+        elif f.sha256 in existing and existing[f.sha256] != doc_ids[i]:
+            results[i].update(status=STATUS_DUPLICATE, duplicate_of=existing[f.sha256], reason="登録済みの文書と同じ内容です")
+        elif f.sha256 in first_by_hash:
+            results[i].update(status=STATUS_DUPLICATE, duplicate_of=first_by_hash[f.sha256], reason="同じ内容のファイルが含まれています")
+        else:
+            first_by_hash[f.sha256] = doc_ids[i]
+            targets.append(i)
+
+    # 3. 先行して並列にパースしながら、全ファイルのチャンクを1つのパイプラインに流す
+    started: List[int] = []
+    parsed = len(files) - len(targets)
+    embedded = written = 0
+
+    def report_progress() -> None:
+        if progress is not None:
+            progress(parsed, len(files), embedded, written)
+
+    def on_pipeline_progress(e: int, w: int) -> None:
+        nonlocal embedded, written
+        embedded, written = e, w
+        report_progress()
+
+    def documents(pool: ThreadPoolExecutor) -> Iterator[Tuple[str, str, str, Dict]]:
+        nonlocal parsed
+        pending: Deque[Tuple[int, Future]] = deque()
+        queue = iter(targets)
+        window = max(1, config.BULK_PARSE_CONCURRENCY)
+        try:
+            while True:
+                while len(pending) < window:
+                    i = next(queue, None)
+                    if i is None:
+                        break
+                    pending.append((i, pool.submit(_parse, files[i])))
+                if not pending:
+                    return
+                i, future = pending.popleft()
+                try:
+                    text, report = future.result()
+                except Exception as e:
+                    results[i].update(status=STATUS_FAILED, error=_error_message(e))
+                    continue
+                finally:
+                    parsed += 1
+                    report_progress()
+                results[i]["parse"] = report
+                started.append(i)
+                title = os.path.basename(files[i].filename) or files[i].filename
+                yield doc_ids[i], title, text, {"source_sha256": files[i].sha256}
+        finally:
+            for _, future in pending:
+                future.cancel()
+
+    t0 = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=max(1, config.BULK_PARSE_CONCURRENCY), thread_name_prefix="bulk-parse") as pool:
+        source = documents(pool)
+        try:
+            counts = retriever.add_documents(source, progress=on_pipeline_progress)
+        except Exception as e:
+            source.close()  # 先行して投入したパースを取り消す
+            # 埋め込み API の障害など、バッチ全体に関わる失敗。途中まで登録した文書は削除する
+            print(f"警告: [BulkIngest] batch_id={batch_id} の取り込みに失敗しました: {e}")
+            for i in started:
+                retriever.delete_document(doc_ids[i])
+                results[i].update(status=STATUS_FAILED, error=_error_message(e))
+            for i in targets:
+                results[i].setdefault("status", STATUS_FAILED)
+                results[i].setdefault("error", "先に発生したエラーにより取り込みを中止しました")
+            return results
+
+    for i in started:
+        chunks = counts.get(doc_ids[i], 0)
+        if chunks == 0:
+            results[i].update(status=STATUS_SKIPPED, reason="テキストを抽出できませんでした")
+        else:
+            results[i].update(status=STATUS_INDEXED, doc_id=doc_ids[i], chunks=chunks)
+
+    elapsed = time.perf_counter() - t0
+    print(f"[BulkIngest] batch_id={batch_id}, summary={summarize(results)}, elapsed={elapsed:.1f}s")
+    return results
+
+
+def summarize(results: List[Dict]) -> Dict[str, int]:
+    """
+    結果の件数を状態ごとに数える（chunks は登録したチャンクの合計）。
+    """
+    summary = {
+        "files": len(results),
+        STATUS_INDEXED: 0,
+        STATUS_DUPLICATE: 0,
+        STATUS_SKIPPED: 0,
+        STATUS_FAILED: 0,
+        "chunks": 0,
+    }
+    for result in results:
+        summary[result["status"]] += 1
+        summary["chunks"] += result.get("chunks", 0)
+    return summary
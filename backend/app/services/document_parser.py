@@ -5,11 +5,60 @@ backend/app/services/document_parser.py
 ファイル形式ごとのパース処理を関数として提供します。
 """
 
+import codecs
 import io
+import time
+from collections import deque
+from typing import Deque, Dict, Iterator, List, Optional, Tuple, Union
+
 from docx import Document
 from pypdf import PdfReader
 from fastapi import HTTPException
 
+from app import config
+from app.services.parse_pool import ParseJob, ParseTimeoutError, ParseUnavailableError, ParseWorkerError
+
+# バイト列、またはファイルパス（プロセス間で大きなバイト列を何度も送らないため）
+Source = Union[bytes, str]
+
+
+def _open(source: Source):
+    return io.BytesIO(source) if isinstance(source, bytes) else open(source, "rb")
+
+
+# =========================
+# 抽出処理（ワーカープロセスでも実行されるため HTTPException は使わない）
+# =========================
+
+def count_pdf_pages(source: Source) -> int:
+    with _open(source) as f:
+        return len(PdfReader(f).pages)
+
+
+def extract_pdf_pages(source: Source, start: int = 0, end: Optional[int] = None) -> List[Tuple[int, str, float]]:
+    """
+    PDF の [start, end) ページのテキストを抽出し、[(ページ番号, テキスト, 抽出時間ms), ...] を返します。
+    """
+    with _open(source) as f:
+        reader = PdfReader(f)
+        pages = reader.pages
+        end = len(pages) if end is None else min(end, len(pages))
+        results = []
+        for i in range(start, end):
+            t0 = time.perf_counter()
+            page_text = pages[i].extract_text() or ""
+            results.append((i + 1, page_text, (time.perf_counter() - t0) * 1000))
+        return results
+
+
+def extract_docx_text(source: Source) -> str:
+    with _open(source) as f:
+        doc = Document(f)
+        # 空でない段落のテキストをリスト化
+        paragraphs: list[str] = [p.text for p in doc.paragraphs if p.text]
+        return "\n".join(paragraphs).strip()
+
+
 def parse_text(raw_bytes: bytes) -> str:
     """
     テキストファイルのバイナリデータを読み込み、文字列として返します。
@@ -29,17 +78,8 @@ def parse_pdf(raw_bytes: bytes) -> str:
     PDFファイルのバイナリデータを読み込み、各ページからテキストを抽出して結合します。
     """
     try:
-        # バイトデータをファイルライクオブジェクトに変換
-        pdf_stream = io.BytesIO(raw_bytes)
-        reader = PdfReader(pdf_stream)
-        texts: list[str] = []
-        
-        # 全ページをループしてテキスト抽出
-        for i, page in enumerate(reader.pages):
-            page_text = page.extract_text() or ""
-            texts.append(page_text)
-        
-        # 改行で結合して一つのテキストにする
+        # 全ページをループしてテキスト抽出し、改行で結合して一つのテキストにする
+        texts = [text for _, text, _ in extract_pdf_pages(raw_bytes)]
         content = "\n\n".join(texts).strip()
     except Exception as e:
         raise HTTPException(
@@ -60,13 +100,7 @@ def parse_docx(raw_bytes: bytes) -> str:
     Wordドキュメント (.docx) のバイナリデータを読み込み、段落ごとのテキストを抽出して結合します。
     """
     try:
-        # バイトデータをファイルライクオブジェクトに変換
-        doc_stream = io.BytesIO(raw_bytes)
-        doc = Document(doc_stream)
-        
-        # 空でない段落のテキストをリスト化
-        paragraphs: list[str] = [p.text for p in doc.paragraphs if p.text]
-        content = "\n".join(paragraphs).strip()
+        content = extract_docx_text(raw_bytes)
     except Exception as e:
         raise HTTPException(
             status_code=400,
@@ -81,18 +115,30 @@ def parse_docx(raw_bytes: bytes) -> str:
         )
     return content
 
-async def parse_document_content(filename: str, raw_bytes: bytes) -> str:
+# 対応している拡張子（テキスト系 / PDF / Word）
+TEXT_EXTENSIONS = {"txt", "md", "markdown", "json"}
+SUPPORTED_EXTENSIONS = TEXT_EXTENSIONS | {"pdf", "docx"}
+
+
+def get_extension(filename: str) -> str:
     """
-    ファイル名（拡張子）に基づいて適切なパーサーを選択し、テキストコンテンツを返します。
-    対応フォーマット: .txt, .md, .json, .pdf, .docx
+    ファイル名から拡張子（ドットなし・小文字）を取り出します。拡張子がなければ空文字。
     """
-    ext = ""
-    # 拡張子の抽出（最後のドット以降を小文字化）
     if "." in filename:
-        ext = filename.rsplit(".", 1)[-1].lower()
+        return filename.rsplit(".", 1)[-1].lower()
+    return ""
+
+
+def parse_document_bytes(filename: str, raw_bytes: bytes) -> str:
+    """
+    ファイル名（拡張子）に基づいて適切なパーサーを選択し、テキストコンテンツを返します（同期版）。
+    API 以外（インデックス構築スクリプトなど）からも利用します。
+    対応フォーマット: .txt, .md, .json, .pdf, .docx
+    """
+    ext = get_extension(filename)
 
     # 拡張子ごとの分岐処理
-    if ext in {"txt", "md", "markdown", "json"}:
+    if ext in TEXT_EXTENSIONS:
         return parse_text(raw_bytes)
     elif ext == "pdf":
         return parse_pdf(raw_bytes)
@@ -104,3 +150,132 @@ async def parse_document_content(filename: str, raw_bytes: bytes) -> str:
             status_code=400,
             detail=f"未対応のファイル形式です: .{ext or '不明'}（txt/pdf/docx などを利用してください）",
         )
+
+
+def _parse_error(label: str, e: Exception) -> HTTPException:
+    if isinstance(e, HTTPException):
+        return e
+    if isinstance(e, ParseUnavailableError):
+        # ファイル自体の問題ではないので、時間をおいて再試行できることを伝える
+        return HTTPException(
+            status_code=503,
+            detail=f"{label}の読み取りを開始できませんでした。しばらくしてから再試行してください。（{e}）",
+            headers={"Retry-After": "30"},
+        )
+    if isinstance(e, ParseTimeoutError):
+        detail = f"{label}の読み取りが制限時間を超えました（{config.PARSE_TIMEOUT_SEC:g}秒）。"
+    elif isinstance(e, MemoryError):
+        detail = f"{label}の読み取り中にメモリ上限（{config.PARSE_MEMORY_LIMIT_MB}MB）を超えました。"
+    elif isinstance(e, ParseWorkerError):
+        detail = (
+            f"{label}の読み取り中に処理が異常終了しました"
+            f"（メモリ上限 {config.PARSE_MEMORY_LIMIT_MB}MB を超えた可能性があります）。"
+        )
+    else:
+        detail = f"{label}の読み取りに失敗しました: {e}"
+    return HTTPException(status_code=400, detail=detail)
+
+
+def _iter_pdf_pages(path: str, report: Dict) -> Iterator[str]:
+    """
+    PDF をページ範囲ごとのジョブに分けてプロセスプールで並列に抽出し、ページ順にテキストを返します。
+    先行して投入するジョブ数をプールのサイズまでに抑えるため、メモリに載るのはその範囲のページだけです。
+    """
+    page_count = ParseJob(count_pdf_pages, path).result()
+    per_job = max(1, config.PARSE_PDF_PAGES_PER_JOB)
+    ranges = deque(range(0, page_count, per_job))
+    in_flight: Deque[ParseJob] = deque()
+    timings: List[Tuple[int, float]] = []
+    report["pages"] = page_count
+    report["jobs"] = len(ranges)
+
+    try:
+        while ranges or in_flight:
+            while ranges and len(in_flight) < max(1, config.PARSE_POOL_SIZE):
+                start = ranges.popleft()
+                in_flight.append(ParseJob(extract_pdf_pages, path, start, start + per_job))
+            for page_no, text, ms in in_flight.popleft().result():
+                timings.append((page_no, ms))
+                yield text + "\n\n"
+    finally:
+        for job in in_flight:
+            job.cancel()
+        timings.sort(key=lambda item: item[1], reverse=True)
+        report["slowest_pages"] = [{"page": no, "ms": round(ms, 1)} for no, ms in timings[:5]]
+        slow = [no for no, ms in timings if ms >= config.PARSE_SLOW_PAGE_MS]
+        if slow:
+            print(f"警告: [DocumentParser] 抽出に時間がかかったページがあります: {sorted(slow)}")
+
+
+def _iter_text_file(path: str, block_size: int = 1024 * 1024) -> Iterator[str]:
+    """
+    テキストファイルを UTF-8 として少しずつデコードして返します。
+    """
+    decoder = codecs.getincrementaldecoder("utf-8")()
+    with open(path, "rb") as f:
+        try:
+            for block in iter(lambda: f.read(block_size), b""):
+                text = decoder.decode(block)
+                if text:
+                    yield text
+            tail = decoder.decode(b"", final=True)
+        except UnicodeDecodeError:
+            raise HTTPException(
+                status_code=400,
+                detail="テキストファイルをUTF-8として読み取れませんでした。",
+            )
+    if tail:
+        yield tail
+
+
+def _iter_docx(path: str) -> Iterator[str]:
+    # Word は段落単位で読めないため、プロセスプールで全文を抽出して返す
+    yield ParseJob(extract_docx_text, path).result()
+
+
+def iter_document_text(filename: str, path: str, report: Optional[Dict] = None) -> Iterator[str]:
+    """
+    ディスク上のファイルからテキストを少しずつ（PDF はページごとに）取り出して返します（同期版）。
+    全文を1つの文字列にしないため、チャンク分割・埋め込みに順に流し込めます。
+    PDF / Word の抽出は専用のプロセスプール（services/parse_pool）で実行します。
+    :param report: 渡した場合、ページ数・所要時間・遅かったページなどを書き込みます
+    """
+    ext = get_extension(filename)
+    report = {} if report is None else report
+    report["format"] = ext
+    t0 = time.perf_counter()
+
+    if ext in TEXT_EXTENSIONS:
+        pieces = _iter_text_file(path)
+    elif ext == "pdf":
+        pieces = _iter_pdf_pages(path, report)
+    elif ext == "docx":
+        pieces = _iter_docx(path)
+    else:
+        raise HTTPException(
+            status_code=400,
+            detail=f"未対応のファイル形式です: .{ext or '不明'}（txt/pdf/docx などを利用してください）",
+        )
+
+    label = {"pdf": "PDFファイル", "docx": "Wordファイル(.docx)"}.get(ext, "テキストファイル")
+    try:
+        yield from pieces
+    except Exception as e:
+        raise _parse_error(label, e)
+    finally:
+        report["elapsed_ms"] = round((time.perf_counter() - t0) * 1000, 1)
+        print(f"[DocumentParser] file={filename!r}, report={report}")
+
+
+def empty_content_error(filename: str) -> HTTPException:
+    """
+    テキストが1文字も取り出せなかった場合のエラー
+    """
+    ext = get_extension(filename)
+    if ext == "pdf":
+        detail = "PDFからテキストを抽出できませんでした。（画像のみのPDFの可能性があります）"
+    elif ext == "docx":
+        detail = "Wordファイルからテキストを抽出できませんでした。"
+    else:
+        detail = "ファイルからテキストを抽出できませんでした。"
+    return HTTPException(status_code=400, detail=detail)
@@ -0,0 +1,375 @@
+"""
+backend/app/services/ingest_jobs.py
+
+文書の取り込み（パース → チャンク分割 → 埋め込み → 登録）をバックグラウンドで処理するジョブキューです。
+アップロード API はファイルを保存してジョブを登録した時点で応答し（202）、
+クライアントは GET /api/documents/jobs/{job_id} で進捗を確認します。
+
+- ジョブは SQLite に保存し、再起動時に未完了のジョブを再開します
+- 同時に処理するジョブ数はワーカー数で制限し、未完了のジョブが上限に達したら新規の受付を断ります
+"""
+
+import json
+import os
+import queue
+import sqlite3
+import threading
+import time
+import uuid
+from datetime import datetime
+from pathlib import Path
+from typing import Dict, List, Optional
+
+from fastapi import HTTPException
+
+from app import config
+from app.rag.registry import get_retriever
+from app.services.bulk_ingest import BulkItem, run_bulk, summarize
+from app.services.document_parser import empty_content_error, iter_document_text
+
+# ジョブの状態
+STATUS_QUEUED = "queued"
+STATUS_RUNNING = "running"
+STATUS_SUCCEEDED = "succeeded"
+STATUS_FAILED = "failed"
+
+# 複数ファイル・zip の一括取り込み
+KIND_BULK = "bulk"
+
+# 処理の段階（status = running のときの内訳）
+STAGE_QUEUED = "queued"
+STAGE_PARSING = "parsing"      # テキスト抽出中（まだ登録したチャンクがない）
+STAGE_EMBEDDING = "embedding"  # 埋め込み・登録中
+STAGE_DONE = "done"
+STAGE_FAILED = "failed"
+
+# 進捗をデータベースに書き込む最短間隔（秒）
+PROGRESS_INTERVAL_SEC = 1.0
+
+_COLUMNS = [
+    "job_id", "kind", "status", "stage", "doc_id", "title", "filename", "path",
+    "size", "sha256", "pages_parsed", "chunks_embedded", "chunks_written",
+    "files_total", "files_done", "results",
+    "parse_report", "error", "created_at", "updated_at",
+]
+
+
+class JobQueueFullError(Exception):
+    """未完了のジョブが上限に達している"""
+
+
+class IngestJobQueue:
+    """
+    取り込みジョブのキュー。submit() でジョブを登録し、ワーカースレッドが順に処理する。
+    """
+
+    def __init__(
+        self,
+        path: Path = config.INGEST_JOBS_PATH,
+        workers: int = config.INGEST_WORKERS,
+        max_pending: int = config.INGEST_MAX_PENDING,
+    ):
+        self.path = Path(path)
+        self.workers = max(1, workers)
+        self.max_pending = max_pending
+        self._lock = threading.Lock()
+        self._conn: Optional[sqlite3.Connection] = None
+        self._queue: "queue.Queue[Optional[str]]" = queue.Queue()
+        self._threads: List[threading.Thread] = []
+
+    # ---- 起動・終了 ----
+
+    def start(self) -> None:
+        """
+        データベースを開き、未完了のジョブを積み直してからワーカーを起動する。
+        """
+        with self._lock:
+            if self._threads:
+                return
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            self._conn = sqlite3.connect(str(self.path), check_same_thread=False)
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS ingest_jobs ("
+                "job_id TEXT PRIMARY KEY, kind TEXT NOT NULL, status TEXT NOT NULL, stage TEXT NOT NULL, "
+                "doc_id TEXT NOT NULL, title TEXT NOT NULL, filename TEXT NOT NULL, path TEXT, "
+                "size INTEGER, sha256 TEXT, pages_parsed INTEGER DEFAULT 0, "
+                "chunks_embedded INTEGER DEFAULT 0, chunks_written INTEGER DEFAULT 0, "
+                "files_total INTEGER, files_done INTEGER DEFAULT 0, results TEXT, "
+                "parse_report TEXT, error TEXT, created_at REAL NOT NULL, updated_at REAL NOT NULL)"
+            )
+            self._conn.commit()
+            # 前回の実行中に止まったジョブも最初からやり直す（チャンクIDが同じなので upsert で上書きされる）
+            pending = [
+                row[0] for row in self._conn.execute(
+                    "SELECT job_id FROM ingest_jobs WHERE status IN (?, ?) ORDER BY created_at",
+                    (STATUS_QUEUED, STATUS_RUNNING),
+                ).fetchall()
+            ]
+            for job_id in pending:
+                self._queue.put(job_id)
+            for i in range(self.workers):
+                thread = threading.Thread(target=self._worker, name=f"ingest-{i}", daemon=True)
+                thread.start()
+                self._threads.append(thread)
+        if pending:
+            print(f"[IngestJobQueue] 未完了のジョブ {len(pending)} 件を再開します。")
+
+    def shutdown(self) -> None:
+        """
+        ワーカーを止める（処理中のジョブは次回起動時に再開される）。
+        """
+        with self._lock:
+            for _ in self._threads:
+                self._queue.put(None)
+            self._threads = []
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
+    # ---- 受付・参照 ----
+
+    def pending_count(self) -> int:
+        with self._lock:
+            if self._conn is None:
+                return 0
+            row = self._conn.execute(
+                "SELECT COUNT(*) FROM ingest_jobs WHERE status IN (?, ?)",
+                (STATUS_QUEUED, STATUS_RUNNING),
+            ).fetchone()
+        return row[0]
+
+    def check_capacity(self) -> None:
+        """
+        未完了のジョブが上限に達していれば JobQueueFullError を送出する。
+        """
+        if self.pending_count() >= self.max_pending:
+            raise JobQueueFullError(
+                f"取り込み待ちのジョブが上限（{self.max_pending}件）に達しています。しばらくしてから再試行してください。"
+            )
+
+    def submit(
+        self,
+        kind: str,
+        doc_id: str,
+        title: str,
+        filename: str,
+        path: str,
+        size: Optional[int] = None,
+        sha256: Optional[str] = None,
+        files_total: Optional[int] = None,
+    ) -> Dict:
+        """
+        ディスク上のファイル（path）を取り込むジョブを登録し、ジョブ情報を返す。
+        ファイルはジョブの完了後に削除される。
+        kind="bulk" の場合、path は一括取り込みするファイルの一覧（JSON）を指す。
+        """
+        self.check_capacity()
+        job_id = uuid.uuid4().hex
+        now = time.time()
+        with self._lock:
+            if self._conn is None:
+                raise RuntimeError("取り込みジョブキューが起動していません。")
+            self._conn.execute(
+                "INSERT INTO ingest_jobs (job_id, kind, status, stage, doc_id, title, filename, path, "
+                "size, sha256, files_total, created_at, updated_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (job_id, kind, STATUS_QUEUED, STAGE_QUEUED, doc_id, title, filename, path,
+                 size, sha256, files_total, now, now),
+            )
+            self._conn.commit()
+        self._queue.put(job_id)
+        print(f"[IngestJobQueue] submitted job_id={job_id}, doc_id={doc_id}, filename={filename!r}")
+        return self.get(job_id)
+
+    def _load(self, job_id: str) -> Optional[Dict]:
+        with self._lock:
+            if self._conn is None:
+                return None
+            row = self._conn.execute(
+                f"SELECT {', '.join(_COLUMNS)} FROM ingest_jobs WHERE job_id = ?", (job_id,)
+            ).fetchone()
+        return dict(zip(_COLUMNS, row)) if row else None
+
+    def get(self, job_id: str) -> Optional[Dict]:
+        """
+        API で返すジョブ情報（サーバー内のファイルパスは含めない）
+        """
+        job = self._load(job_id)
+        return _public(job) if job else None
+
+    def stats(self) -> Dict:
+        with self._lock:
+            if self._conn is None:
+                return {"running": False}
+            rows = self._conn.execute(
+                "SELECT status, COUNT(*) FROM ingest_jobs GROUP BY status"
+            ).fetchall()
+        return {
+            "running": True,
+            "workers": self.workers,
+            "max_pending": self.max_pending,
+            **{status: count for status, count in rows},
+        }
+
+    # ---- 処理 ----
+
+    def _update(self, job_id: str, **fields) -> None:
+        fields["updated_at"] = time.time()
+        assignments = ", ".join(f"{name} = ?" for name in fields)
+        with self._lock:
+            if self._conn is None:
+                return
+            self._conn.execute(
+                f"UPDATE ingest_jobs SET {assignments} WHERE job_id = ?",
+                (*fields.values(), job_id),
+            )
+            self._conn.commit()
+
+    def _worker(self) -> None:
+        while True:
+            job_id = self._queue.get()
+            if job_id is None:
+                return
+            try:
+                self._run(job_id)
+            except Exception as e:
+                # ここに来るのはジョブ情報の更新自体に失敗した場合など
+                print(f"警告: [IngestJobQueue] job_id={job_id} の処理中にエラーが発生しました: {e}")
+
+    def _run(self, job_id: str) -> None:
+        job = self._load(job_id)
+        if job is None or job["status"] not in (STATUS_QUEUED, STATUS_RUNNING):
+            return
+
+        path, filename, doc_id = job["path"], job["filename"], job["doc_id"]
+        if not path or not os.path.exists(path):
+            self._update(job_id, status=STATUS_FAILED, stage=STAGE_FAILED, error="取り込むファイルが見つかりません。")
+            return
+
+        self._update(job_id, status=STATUS_RUNNING, stage=STAGE_PARSING, error=None)
+        print(f"[IngestJobQueue] started job_id={job_id}, kind={job['kind']}, doc_id={doc_id}")
+
+        if job["kind"] == KIND_BULK:
+            self._run_bulk(job)
+            return
+
+        report: Dict = {}
+        last_write = 0.0
+        pages = 0
+
+        # PDF はページごと、テキストはブロックごとに数える
+        def count_pages(pieces):
+            nonlocal pages, last_write
+            for piece in pieces:
+                pages += 1
+                now = time.monotonic()
+                if now - last_write >= PROGRESS_INTERVAL_SEC:
+                    last_write = now
+                    self._update(job_id, pages_parsed=pages)
+                yield piece
+
+        def on_progress(embedded: int, written: int) -> None:
+            self._update(
+                job_id, stage=STAGE_EMBEDDING, pages_parsed=pages,
+                chunks_embedded=embedded, chunks_written=written,
+            )
+
+        retriever = None
+        try:
+            retriever = get_retriever()
+            added = retriever.add_document(
+                doc_id=doc_id,
+                title=job["title"],
+                content=count_pages(iter_document_text(filename, path, report)),
+                progress=on_progress,
+                metadata={"source_sha256": job["sha256"]} if job["sha256"] else None,
+            )
+            if added == 0:
+                raise empty_content_error(filename)
+        except Exception as e:
+            error = e.detail if isinstance(e, HTTPException) else str(e)
+            print(f"警告: [IngestJobQueue] job_id={job_id} が失敗しました: {error}")
+            if retriever is not None:
+                # 途中まで登録されたチャンクを残さない
+                retriever.delete_document(doc_id)
+            self._update(
+                job_id, status=STATUS_FAILED, stage=STAGE_FAILED, error=error,
+                pages_parsed=pages, parse_report=json.dumps(report, ensure_ascii=False),
+            )
+        else:
+            self._update(
+                job_id, status=STATUS_SUCCEEDED, stage=STAGE_DONE,
+                pages_parsed=pages, chunks_embedded=added, chunks_written=added,
+                parse_report=json.dumps(report, ensure_ascii=False),
+            )
+            print(f"[IngestJobQueue] finished job_id={job_id}, doc_id={doc_id}, chunks={added}")
+        finally:
+            try:
+                os.unlink(path)
+            except FileNotFoundError:
+                pass
+            self._update(job_id, path=None)
+
+    def _run_bulk(self, job: Dict) -> None:
+        """
+        一括取り込みジョブ。ファイル一覧（JSON）の各ファイルを bulk_ingest でまとめて取り込む。
+        一部のファイルが失敗してもジョブは succeeded とし、ファイルごとの結果を results に残す。
+        """
+        job_id, manifest = job["job_id"], job["path"]
+        with open(manifest, encoding="utf-8") as f:
+            items = [BulkItem(**entry) for entry in json.load(f)]
+
+        last_write = 0.0
+
+        def on_progress(done: int, total: int, embedded: int, written: int) -> None:
+            nonlocal last_write
+            now = time.monotonic()
+            if now - last_write < PROGRESS_INTERVAL_SEC:
+                return
+            last_write = now
+            self._update(
+                job_id, stage=STAGE_EMBEDDING if written else STAGE_PARSING,
+                files_total=total, files_done=done, chunks_embedded=embedded, chunks_written=written,
+            )
+
+        try:
+            results = run_bulk(get_retriever(), items, batch_id=job_id, progress=on_progress)
+        except Exception as e:
+            print(f"警告: [IngestJobQueue] job_id={job_id} が失敗しました: {e}")
+            self._update(job_id, status=STATUS_FAILED, stage=STAGE_FAILED, error=str(e))
+        else:
+            summary = summarize(results)
+            self._update(
+                job_id, status=STATUS_SUCCEEDED, stage=STAGE_DONE,
+                files_total=summary["files"], files_done=summary["files"],
+                chunks_embedded=summary["chunks"], chunks_written=summary["chunks"],
+                results=json.dumps(results, ensure_ascii=False),
+            )
+            print(f"[IngestJobQueue] finished job_id={job_id}, summary={summary}")
+        finally:
+            for item in items:
+                item.cleanup()
+            try:
+                os.unlink(manifest)
+            except FileNotFoundError:
+                pass
+            self._update(job_id, path=None)
+
+
+def _public(job: Dict) -> Dict:
+    job = dict(job)
+    job.pop("path", None)
+    job["parse_report"] = json.loads(job["parse_report"]) if job["parse_report"] else None
+    if job["kind"] == KIND_BULK:
+        job["results"] = json.loads(job["results"]) if job["results"] else None
+        job["summary"] = summarize(job["results"]) if job["results"] else None
+    else:
+        for key in ("files_total", "files_done", "results"):
+            job.pop(key, None)
+    for key in ("created_at", "updated_at"):
+        job[key] = datetime.fromtimestamp(job[key]).isoformat(timespec="seconds")
+    return job
+
+
+# シングルトンとして保持
+job_queue = IngestJobQueue()
@@ -0,0 +1,269 @@
+"""
+backend/app/services/parse_pool.py
+
+文書パース（PDF / Word のテキスト抽出）を専用のワーカープロセスで実行するためのモジュールです。
+CPU を使い続けるパース処理をイベントループやリクエスト処理のスレッドから切り離し、
+巨大なファイルや壊れたファイルがあっても他の API（/api/agent/ask など）が止まらないようにします。
+
+- ワーカーは PARSE_POOL_SIZE 個の枠に1プロセスずつ持ち、各枠は一度に1ジョブだけを実行します
+- 制限時間はワーカーがジョブを受け取った時点から数え、超えた場合はそのジョブのプロセスだけを止めます
+  （同時に実行中の他のジョブには影響しません。止めた枠は次のジョブで新しいプロセスを起動します）
+- ワーカープロセスには RLIMIT_AS でメモリ上限を設定します（対応 OS のみ）
+"""
+
+import multiprocessing
+import queue
+import threading
+import time
+from concurrent.futures import CancelledError, Future
+from typing import Any, Callable, List, Optional, Tuple
+
+from app import config
+
+
+class ParseTimeoutError(Exception):
+    """パースジョブが制限時間内に終わらなかった"""
+
+
+class ParseWorkerError(Exception):
+    """ジョブを実行していたワーカープロセスが異常終了した（メモリ上限超過など）"""
+
+
+class ParseUnavailableError(Exception):
+    """パース用のワーカーを用意できなかった・停止中だった（時間をおいて再試行できる）"""
+
+
+# スレッドを持つ親プロセスを fork すると固まることがあるため spawn で起動する
+_mp_context = multiprocessing.get_context("spawn")
+
+
+def _init_worker(memory_limit_mb: int) -> None:
+    """
+    ワーカープロセスの初期化。アドレス空間の上限を設定します。
+    """
+    if memory_limit_mb <= 0:
+        return
+    try:
+        import resource
+
+        limit = memory_limit_mb * 1024 * 1024
+        resource.setrlimit(resource.RLIMIT_AS, (limit, limit))
+    except Exception as e:
+        # Windows など resource がない環境では上限なしで動かす
+        print(f"警告: [ParsePool] メモリ上限を設定できませんでした: {e}")
+
+
+def _worker_main(conn, memory_limit_mb: int) -> None:
+    """
+    ワーカープロセスの本体。(func, args) を受け取って実行し、("ok", 戻り値) / ("error", 例外) を返す。
+    """
+    _init_worker(memory_limit_mb)
+    while True:
+        try:
+            task = conn.recv()
+        except (EOFError, OSError):
+            return
+        if task is None:
+            return
+        func, args = task
+        try:
+            conn.send(("ok", func(*args)))
+        except BaseException as e:
+            try:
+                conn.send(("error", e))
+            except Exception:
+                # 例外が pickle できない場合は内容だけを文字列で返す
+                conn.send(("error", RuntimeError(f"{type(e).__name__}: {e}")))
+
+
+class _Worker:
+    """
+    ワーカープロセス1つ分（親プロセス側のハンドル）
+    """
+
+    def __init__(self):
+        self.conn, child_conn = _mp_context.Pipe()
+        self.process = _mp_context.Process(
+            target=_worker_main,
+            args=(child_conn, config.PARSE_MEMORY_LIMIT_MB),
+            daemon=True,
+        )
+        self.process.start()
+        child_conn.close()
+
+    def alive(self) -> bool:
+        return self.process.is_alive()
+
+    def kill(self) -> None:
+        try:
+            self.process.terminate()
+            self.process.join(timeout=5)
+            if self.process.is_alive():
+                self.process.kill()
+        except Exception:
+            pass
+        self.conn.close()
+
+    def stop(self) -> None:
+        try:
+            self.conn.send(None)
+        except Exception:
+            pass
+        self.kill()
+
+
+# キューに積むジョブ: (Future, func, args, 制限時間)
+_Task = Tuple[Future, Callable[..., Any], tuple, float]
+
+
+class _ParsePool:
+    """
+    ワーカーの枠ごとに1スレッドがキューからジョブを取り出し、自分のワーカープロセスで実行する。
+    """
+
+    def __init__(self, size: int):
+        self.size = max(1, size)
+        self._tasks: "queue.Queue[Optional[_Task]]" = queue.Queue()
+        self._workers: List[Optional[_Worker]] = [None] * self.size
+        self._closed = False
+        self._threads = [
+            threading.Thread(target=self._run_slot, args=(i,), name=f"parse-slot-{i}", daemon=True)
+            for i in range(self.size)
+        ]
+        for thread in self._threads:
+            thread.start()
+
+    def submit(self, func: Callable[..., Any], args: tuple, timeout: float) -> Future:
+        if self._closed:
+            raise ParseUnavailableError("パース処理は停止中です。しばらくしてから再試行してください。")
+        future: Future = Future()
+        self._tasks.put((future, func, args, timeout))
+        return future
+
+    def _run_slot(self, slot: int) -> None:
+        while True:
+            task = self._tasks.get()
+            if task is None:
+                return
+            future, func, args, timeout = task
+            # キューで待っている間に取り消されたジョブは実行しない
+            if not future.set_running_or_notify_cancel():
+                continue
+            try:
+                future.set_result(self._execute(slot, func, args, timeout))
+            except BaseException as e:
+                future.set_exception(e)
+
+    def _execute(self, slot: int, func: Callable[..., Any], args: tuple, timeout: float) -> Any:
+        worker = self._workers[slot]
+        if worker is None or not worker.alive():
+            try:
+                worker = self._workers[slot] = _Worker()
+            except Exception as e:
+                self._workers[slot] = None
+                raise ParseUnavailableError(
+                    "パース用のプロセスを起動できませんでした。しばらくしてから再試行してください。"
+                ) from e
+
+        # 制限時間はこのワーカーがジョブを受け取った時点から数える（キューでの待ち時間は含めない）
+        deadline = time.monotonic() + timeout
+        try:
+            worker.conn.send((func, args))
+            while True:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                if worker.conn.poll(min(remaining, 1.0)):
+                    status, value = worker.conn.recv()
+                    if status == "error":
+                        raise value
+                    return value
+                if self._closed:
+                    raise ParseUnavailableError("パース処理が停止されました。しばらくしてから再試行してください。")
+        except (EOFError, OSError, BrokenPipeError) as e:
+            # このジョブを実行していたプロセス自身が落ちた
+            self._discard(slot, worker)
+            raise ParseWorkerError(
+                "パース処理のプロセスが異常終了しました（メモリ上限を超えた可能性があります）。"
+            ) from e
+        except ParseUnavailableError:
+            self._discard(slot, worker)
+            raise
+
+        # 制限時間を超えた: このジョブのプロセスだけを止める
+        self._discard(slot, worker)
+        raise ParseTimeoutError(f"パース処理が {timeout:g} 秒以内に終わりませんでした。")
+
+    def _discard(self, slot: int, worker: _Worker) -> None:
+        worker.kill()
+        if self._workers[slot] is worker:
+            self._workers[slot] = None
+
+    def shutdown(self) -> None:
+        self._closed = True
+        # 未着手のジョブは再試行できるエラーで終わらせる
+        while True:
+            try:
+                task = self._tasks.get_nowait()
+            except queue.Empty:
+                break
+            if task is not None and task[0].set_running_or_notify_cancel():
+                task[0].set_exception(
+                    ParseUnavailableError("パース処理が停止されました。しばらくしてから再試行してください。")
+                )
+        for _ in self._threads:
+            self._tasks.put(None)
+        for worker in self._workers:
+            if worker is not None:
+                worker.stop()
+
+
+_pool: Optional[_ParsePool] = None
+_lock = threading.Lock()
+
+
+def _get_pool() -> _ParsePool:
+    global _pool
+    with _lock:
+        if _pool is None:
+            _pool = _ParsePool(config.PARSE_POOL_SIZE)
+        return _pool
+
+
+class ParseJob:
+    """
+    パース用ワーカーに投入したジョブ。
+    func・引数・戻り値は pickle できる必要があります（モジュールレベルの関数など）。
+    複数のジョブを先に投入しておき、順に result() で受け取ることで並列に実行できます。
+    result() は結果が出るまでブロックするため、async なコードからは run_blocking 経由で使ってください。
+    """
+
+    def __init__(self, func: Callable[..., Any], *args: Any, timeout: Optional[float] = None):
+        self.timeout = config.PARSE_TIMEOUT_SEC if timeout is None else timeout
+        self._future = _get_pool().submit(func, args, self.timeout)
+
+    def result(self) -> Any:
+        """
+        ジョブの結果を待って返します。
+        :raises ParseTimeoutError: 実行開始から制限時間（既定は config.PARSE_TIMEOUT_SEC）を超えた場合
+        :raises ParseWorkerError: このジョブを実行していたワーカープロセスが異常終了した場合
+        :raises ParseUnavailableError: ワーカーを用意できなかった・停止された場合（再試行できる）
+        """
+        try:
+            return self._future.result()
+        except CancelledError as e:
+            raise ParseUnavailableError("パース処理が取り消されました。") from e
+
+    def cancel(self) -> None:
+        self._future.cancel()
+
+
+def shutdown() -> None:
+    """
+    アプリケーション終了時にワーカープロセスを停止します。
+    """
+    global _pool
+    with _lock:
+        pool, _pool = _pool, None
+    if pool is not None:
+        pool.shutdown()
@@ -0,0 +1,237 @@
+"""
+backend/app/services/session_store.py
+
+会話セッションの履歴をサーバー側に保存するストアです。
+クライアントは session_id と新しい入力だけを送り、過去の会話はサーバーがここから読み出します。
+
+- セッションIDはサーバーが推測できない乱数で発行します（クライアントが決めた ID は受け付けません）
+- 会話のターンは SQLite に追記だけで保存します（1ターン = 1行）
+- よく使われるセッションの履歴は、件数上限付きの LRU でメモリに保持します
+- 古いターンの要約（会話履歴の圧縮で作ったもの）もセッションごとに保存し、再起動後も再利用します
+"""
+
+import re
+import secrets
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from app import config
+
+# セッションIDはサーバーが推測できない乱数で発行する（IDを知っていれば履歴を読めるため）
+SESSION_ID_PATTERN = re.compile(r"^[A-Za-z0-9_-]{16,128}$")
+
+
+def new_session_id() -> str:
+    return secrets.token_urlsafe(24)
+
+
+def is_valid_session_id(session_id: str) -> bool:
+    return bool(SESSION_ID_PATTERN.match(session_id or ""))
+
+
+@dataclass
+class _Session:
+    turns: List[Dict[str, str]] = field(default_factory=list)
+    summary: Optional[str] = None  # 先頭から summary_turns 件のターンの要約
+    summary_turns: int = 0
+
+
+class SessionStore:
+    """
+    session_id → 会話のターン列 を保存するストア。
+    """
+
+    def __init__(
+        self,
+        path: Path = config.SESSION_STORE_PATH,
+        cache_size: int = config.SESSION_CACHE_SIZE,
+    ):
+        self.path = Path(path)
+        self.cache_size = cache_size
+        self._lock = threading.Lock()
+        self._conn: Optional[sqlite3.Connection] = None
+        self._cache: "OrderedDict[str, _Session]" = OrderedDict()
+
+        # 計測用カウンタ
+        self.hits = 0
+        self.misses = 0
+
+    def _connect(self) -> sqlite3.Connection:
+        # ロックを保持した状態で呼ぶこと
+        if self._conn is None:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            self._conn = sqlite3.connect(str(self.path), check_same_thread=False)
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS sessions ("
+                "session_id TEXT PRIMARY KEY, turns INTEGER NOT NULL DEFAULT 0, "
+                "summary TEXT, summary_turns INTEGER NOT NULL DEFAULT 0, "
+                "created_at REAL NOT NULL, updated_at REAL NOT NULL)"
+            )
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS session_turns ("
+                "session_id TEXT NOT NULL, seq INTEGER NOT NULL, role TEXT NOT NULL, "
+                "content TEXT NOT NULL, created_at REAL NOT NULL, PRIMARY KEY (session_id, seq))"
+            )
+            self._conn.commit()
+        return self._conn
+
+    def _load(self, session_id: str) -> Optional[_Session]:
+        # ロックを保持した状態で呼ぶこと
+        session = self._cache.get(session_id)
+        if session is not None:
+            self._cache.move_to_end(session_id)
+            self.hits += 1
+            return session
+        self.misses += 1
+        conn = self._connect()
+        row = conn.execute(
+            "SELECT summary, summary_turns FROM sessions WHERE session_id = ?", (session_id,)
+        ).fetchone()
+        if row is None:
+            return None
+        turns = [
+            {"role": role, "content": content}
+            for role, content in conn.execute(
+                "SELECT role, content FROM session_turns WHERE session_id = ? ORDER BY seq",
+                (session_id,),
+            )
+        ]
+        session = _Session(turns=turns, summary=row[0], summary_turns=row[1])
+        self._remember(session_id, session)
+        return session
+
+    def _remember(self, session_id: str, session: _Session) -> None:
+        # ロックを保持した状態で呼ぶこと
+        self._cache[session_id] = session
+        self._cache.move_to_end(session_id)
+        while len(self._cache) > self.cache_size:
+            self._cache.popitem(last=False)
+
+    # ---- 読み出し ----
+
+    def history(self, session_id: str) -> Optional[List[Dict[str, str]]]:
+        """
+        セッションの会話履歴（古い順）を返す。セッションがなければ None。
+        """
+        with self._lock:
+            session = self._load(session_id)
+            return list(session.turns) if session is not None else None
+
+    def summary(self, session_id: str) -> Tuple[Optional[str], int]:
+        """
+        保存されている要約を返す。
+        :return: (要約, 要約に含まれる先頭からのターン数)。なければ (None, 0)
+        """
+        with self._lock:
+            session = self._load(session_id)
+            if session is None or not session.summary:
+                return None, 0
+            return session.summary, session.summary_turns
+
+    # ---- 書き込み ----
+
+    def create(self, history: Sequence[Dict[str, str]] = ()) -> str:
+        """
+        新しいセッションを作り、その ID を返す。
+        history を渡した場合は、最初のターンとして保存する
+        （ブラウザに残っている会話をサーバー側へ移すときに使う）。
+        """
+        session_id = new_session_id()
+        with self._lock:
+            now = time.time()
+            conn = self._connect()
+            conn.execute(
+                "INSERT INTO sessions (session_id, created_at, updated_at) VALUES (?, ?, ?)",
+                (session_id, now, now),
+            )
+            self._remember(session_id, _Session())
+            self._append_locked(session_id, history, now)
+        print(f"[SessionStore] created session_id={session_id}, imported_turns={len(history)}")
+        return session_id
+
+    def append(self, session_id: str, turns: Sequence[Dict[str, str]]) -> None:
+        """
+        セッションの末尾にターンを追記する（セッションがなければ何もしない）。
+        """
+        with self._lock:
+            self._append_locked(session_id, turns, time.time())
+
+    def _append_locked(self, session_id: str, turns: Sequence[Dict[str, str]], now: float) -> None:
+        # ロックを保持した状態で呼ぶこと
+        session = self._load(session_id)
+        if session is None or not turns:
+            return
+        base = len(session.turns)
+        rows = [
+            (session_id, base + i, turn.get("role", "user"), turn.get("content", ""), now)
+            for i, turn in enumerate(turns)
+        ]
+        conn = self._connect()
+        conn.executemany(
+            "INSERT INTO session_turns (session_id, seq, role, content, created_at) VALUES (?, ?, ?, ?, ?)",
+            rows,
+        )
+        conn.execute(
+            "UPDATE sessions SET turns = ?, updated_at = ? WHERE session_id = ?",
+            (base + len(rows), now, session_id),
+        )
+        conn.commit()
+        session.turns.extend({"role": role, "content": content} for _, _, role, content, _ in rows)
+
+    def save_summary(self, session_id: str, summary: str, turns: int) -> None:
+        """
+        先頭から turns 件のターンの要約を保存する（保存済みの要約より古いものは無視する）。
+        """
+        with self._lock:
+            session = self._load(session_id)
+            if session is None or turns <= session.summary_turns:
+                return
+            conn = self._connect()
+            conn.execute(
+                "UPDATE sessions SET summary = ?, summary_turns = ? WHERE session_id = ?",
+                (summary, turns, session_id),
+            )
+            conn.commit()
+            session.summary = summary
+            session.summary_turns = turns
+
+    def delete(self, session_id: str) -> bool:
+        with self._lock:
+            self._cache.pop(session_id, None)
+            conn = self._connect()
+            deleted = conn.execute("DELETE FROM sessions WHERE session_id = ?", (session_id,)).rowcount
+            conn.execute("DELETE FROM session_turns WHERE session_id = ?", (session_id,))
+            conn.commit()
+        return deleted > 0
+
+    # ---- 状態 ----
+
+    def stats(self) -> Dict:
+        if not config.SESSION_STORE_ENABLED:
+            return {"enabled": False}
+        with self._lock:
+            row = self._connect().execute("SELECT COUNT(*), COALESCE(SUM(turns), 0) FROM sessions").fetchone()
+            return {
+                "enabled": True,
+                "sessions": row[0],
+                "turns": row[1],
+                "cached_sessions": len(self._cache),
+                "hits": self.hits,
+                "misses": self.misses,
+            }
+
+    def close(self) -> None:
+        with self._lock:
+            self._cache.clear()
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
+
+# シングルトンとして保持
+session_store = SessionStore()
@@ -0,0 +1,75 @@
+"""
+backend/app/services/upload_spool.py
+
+アップロードされたファイルを、メモリに全体を載せずに一時ファイルへ書き出すためのモジュールです。
+書き出しながらサイズ上限の確認と内容ハッシュ（SHA-256）の計算を行います。
+"""
+
+import hashlib
+import os
+import tempfile
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Optional
+
+from fastapi import HTTPException, UploadFile
+
+from app import config
+from app.services.document_parser import get_extension
+
+# 1回に読み込むサイズ
+READ_BLOCK_BYTES = 1024 * 1024
+
+
+@dataclass
+class SpooledUpload:
+    filename: str
+    path: str      # 一時ファイルのパス（使い終わったら cleanup() で削除する）
+    size: int      # バイト数
+    sha256: str    # 内容ハッシュ
+
+    def cleanup(self) -> None:
+        try:
+            os.unlink(self.path)
+        except FileNotFoundError:
+            pass
+
+
+async def spool_upload(
+    file: UploadFile,
+    max_bytes: int = config.UPLOAD_MAX_BYTES,
+    directory: Optional[Path] = None,
+) -> SpooledUpload:
+    """
+    UploadFile を少しずつ読み込んで一時ファイルに書き出す。
+    サイズが max_bytes を超えた場合は 413 エラーにする。
+    :param directory: 書き出し先（省略時は OS の一時ディレクトリ）
+    """
+    filename = file.filename or "uploaded_document"
+    digest = hashlib.sha256()
+    size = 0
+    if directory is not None:
+        directory.mkdir(parents=True, exist_ok=True)
+    fd, path = tempfile.mkstemp(
+        suffix=f".{get_extension(filename) or 'bin'}",
+        dir=str(directory) if directory is not None else None,
+    )
+    try:
+        with os.fdopen(fd, "wb") as out:
+            while True:
+                block = await file.read(READ_BLOCK_BYTES)
+                if not block:
+                    break
+                size += len(block)
+                if size > max_bytes:
+                    raise HTTPException(
+                        status_code=413,
+                        detail=f"ファイルサイズが上限（{max_bytes // (1024 * 1024)}MB）を超えています。",
+                    )
+                digest.update(block)
+                out.write(block)
+    except BaseException:
+        os.unlink(path)
+        raise
+
+    return SpooledUpload(filename=filename, path=path, size=size, sha256=digest.hexdigest())
@@ -1,38 +1,259 @@
-from typing import List, Dict
-from tavily import TavilyClient
+import asyncio
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future
+from typing import Dict, List, Optional, Tuple
+
+from tavily import TavilyClient, AsyncTavilyClient
 from app import config
+from app.rag.embedding_cache import normalize_query
+from app.services.blocking_pool import submit_blocking
 
 # Tavily クライアントの初期化
 if not config.TAVILY_API_KEY:
     # キーがない場合は None にしておいて、呼び出し時に警告を出す
     tavily_client = None
+    async_tavily_client = None
 else:
     tavily_client = TavilyClient(api_key=config.TAVILY_API_KEY)
+    # 非同期エージェント用（イベントループをブロックしない HTTP クライアント）
+    async_tavily_client = AsyncTavilyClient(api_key=config.TAVILY_API_KEY)
+
+
+# =========================
+# 検索結果キャッシュ
+# =========================
+# - トピックごとの TTL（株価・為替などは短く、一般的な検索は長く）
+# - 同じクエリの同時リクエストは1回の検索にまとめる（single-flight）
+# - TTL 切れでも一定期間は古い結果を返しつつ裏で更新する（stale-while-revalidate）
+# - Tavily が遅い・落ちている場合も古い結果があればそれを返す
+
+# 値動きの速いトピック（短い TTL）
+MARKET_WORDS = ["株価", "為替", "FX", "相場", "金利"]
+# ニュース系のトピック（中程度の TTL）
+NEWS_WORDS = ["最新", "最近", "今日", "昨日", "ニュース"]
+
+
+def ttl_for(query: str) -> float:
+    """
+    クエリのトピックに応じたキャッシュの有効期間（秒）を返す。
+    """
+    if any(word in query for word in MARKET_WORDS):
+        return config.WEB_SEARCH_TTL_MARKET_SEC
+    if any(word in query for word in NEWS_WORDS):
+        return config.WEB_SEARCH_TTL_NEWS_SEC
+    return config.WEB_SEARCH_TTL_DEFAULT_SEC
+
+
+class _Entry:
+    def __init__(self, results: List[Dict], ttl: float):
+        self.results = results
+        self.fetched_at = time.monotonic()
+        self.ttl = ttl
+
+    def age(self) -> float:
+        return time.monotonic() - self.fetched_at
+
+    def is_fresh(self) -> bool:
+        return self.age() <= self.ttl
+
+    def is_usable_stale(self) -> bool:
+        return self.age() <= self.ttl + config.WEB_SEARCH_STALE_SEC
+
+
+_cache: "OrderedDict[Tuple[str, int], _Entry]" = OrderedDict()
+_cache_lock = threading.Lock()
+# 実行中の検索（single-flight 用）
+_inflight_sync: Dict[Tuple[str, int], Future] = {}
+_inflight_async: Dict[Tuple[str, int], "asyncio.Task"] = {}
+_stats = {"hits": 0, "stale_hits": 0, "misses": 0, "coalesced": 0, "errors": 0}
+
+
+def _key(query: str, max_results: int) -> Tuple[str, int]:
+    return normalize_query(query), max_results
+
+
+def _count(name: str) -> None:
+    with _cache_lock:
+        _stats[name] += 1
+
+
+def _get_entry(key) -> Optional[_Entry]:
+    with _cache_lock:
+        entry = _cache.get(key)
+        if entry is not None:
+            _cache.move_to_end(key)
+        return entry
+
+
+def _put_entry(key, query: str, results: List[Dict]) -> None:
+    with _cache_lock:
+        _cache[key] = _Entry(results, ttl_for(query))
+        _cache.move_to_end(key)
+        while len(_cache) > config.WEB_SEARCH_CACHE_SIZE:
+            _cache.popitem(last=False)
+
+
+def cache_stats() -> Dict:
+    with _cache_lock:
+        return {**_stats, "size": len(_cache)}
+
+
+def _fallback(entry: Optional[_Entry]) -> List[Dict]:
+    """
+    Tavily が遅い・落ちている場合、期限切れでも以前の結果があればそれを返す。
+    """
+    if entry is None:
+        return []
+    print(f"[WebSearch] 以前の検索結果（{entry.age():.0f}秒前）で代替します。")
+    return entry.results
+
+
+def _results_of(resp: Dict, query: str) -> List[Dict]:
+    # resp は dict: { "query": ..., "results": [...], ... } のイメージ
+    results = resp.get("results", [])
+    print(f"[WebSearch] query={query!r}, hits={len(results)}")
+    return results
+
+
+# ---- 同期版 ----
+
+def _fetch(query: str, max_results: int) -> List[Dict]:
+    # Tavily の search API 呼び出し
+    # docs: https://docs.tavily.com/documentation/api-reference/endpoint/search :contentReference[oaicite:1]{index=1}
+    resp = tavily_client.search(
+        query=query,
+        max_results=max_results,
+        # 必要に応じて topic / search_depth なども指定可能
+        # topic="general",
+        # search_depth="basic",
+    )
+    return _results_of(resp, query)
+
+
+def _fetch_shared(key, query: str, max_results: int) -> Future:
+    """
+    同じキーの検索が実行中ならその Future を返し、なければ新しく検索を始める。
+    """
+    with _cache_lock:
+        future = _inflight_sync.get(key)
+        if future is not None:
+            _stats["coalesced"] += 1
+            return future
+        future = Future()
+        _inflight_sync[key] = future
+
+    def worker():
+        try:
+            results = _fetch(query, max_results)
+            _put_entry(key, query, results)
+            future.set_result(results)
+        except Exception as e:
+            future.set_exception(e)
+        finally:
+            with _cache_lock:
+                _inflight_sync.pop(key, None)
+
+    # 他のブロッキング処理と同じ上限付きスレッドプールで実行する
+    # （プールが埋まっていても、呼び出し側は WEB_SEARCH_TIMEOUT_SEC で待つのをやめて古い結果に戻る）
+    try:
+        submit_blocking(worker)
+    except RuntimeError as e:
+        # 終了処理でプールが止まっている場合
+        with _cache_lock:
+            _inflight_sync.pop(key, None)
+        future.set_exception(e)
+    return future
 
 
 def run_web_search(query: str, max_results: int = 5) -> List[Dict]:
     """
     Web検索を実行して、LLM がそのまま食べやすい形の結果を返す。
     戻り値の各 dict には、title / url / content などを含める前提。
+    結果はトピックごとの TTL でキャッシュされる。
     """
     if tavily_client is None:
         print("[WebSearch] Tavily API キーが設定されていません。")
         return []
 
+    key = _key(query, max_results)
+    entry = _get_entry(key)
+    if entry is not None and entry.is_fresh():
+        _count("hits")
+        return entry.results
+
+    stale = entry if entry is not None and entry.is_usable_stale() else None
+    future = _fetch_shared(key, query, max_results)
+
+    if stale is not None:
+        # 古い結果をすぐ返し、更新は裏で続ける
+        _count("stale_hits")
+        return stale.results
+
+    _count("misses")
+    try:
+        return future.result(timeout=config.WEB_SEARCH_TIMEOUT_SEC)
+    except Exception as e:
+        _count("errors")
+        print(f"[WebSearch] 検索中にエラーが発生しました: {e}")
+        return _fallback(entry)
+
+
+# ---- 非同期版 ----
+
+async def _afetch(key, query: str, max_results: int) -> List[Dict]:
     try:
-        # Tavily の search API 呼び出し
-        # docs: https://docs.tavily.com/documentation/api-reference/endpoint/search :contentReference[oaicite:1]{index=1}
-        resp = tavily_client.search(
+        resp = await async_tavily_client.search(
             query=query,
             max_results=max_results,
-            # 必要に応じて topic / search_depth なども指定可能
-            # topic="general",
-            # search_depth="basic",
         )
-        # resp は dict: { "query": ..., "results": [...], ... } のイメージ
-        results = resp.get("results", [])
-        print(f"[WebSearch] query={query!r}, hits={len(results)}")
+        results = _results_of(resp, query)
+        _put_entry(key, query, results)
         return results
+    finally:
+        _inflight_async.pop(key, None)
+
+
+def _afetch_shared(key, query: str, max_results: int) -> "asyncio.Task":
+    task = _inflight_async.get(key)
+    if task is not None and not task.done():
+        _count("coalesced")
+        return task
+    task = asyncio.ensure_future(_afetch(key, query, max_results))
+    # 誰も await しなかった場合（裏での更新）でも例外が未処理扱いにならないようにする
+    task.add_done_callback(lambda t: t.cancelled() or t.exception())
+    _inflight_async[key] = task
+    return task
+
+
+async def arun_web_search(query: str, max_results: int = 5) -> List[Dict]:
+    """
+    run_web_search の非同期版。
+    """
+    if async_tavily_client is None:
+        print("[WebSearch] Tavily API キーが設定されていません。")
+        return []
+
+    key = _key(query, max_results)
+    entry = _get_entry(key)
+    if entry is not None and entry.is_fresh():
+        _count("hits")
+        return entry.results
+
+    stale = entry if entry is not None and entry.is_usable_stale() else None
+    task = _afetch_shared(key, query, max_results)
+
+    if stale is not None:
+        # 古い結果をすぐ返し、更新は裏で続ける
+        _count("stale_hits")
+        return stale.results
+
+    _count("misses")
+    try:
+        # shield: タイムアウトしても検索自体は続け、完了すればキャッシュに入る
+        return await asyncio.wait_for(asyncio.shield(task), timeout=config.WEB_SEARCH_TIMEOUT_SEC)
     except Exception as e:
+        _count("errors")
         print(f"[WebSearch] 検索中にエラーが発生しました: {e}")
-        return []
+        return _fallback(entry)
@@ -0,0 +1,61 @@
+# backend/tests/conftest.py
+# テスト共通の設定
+# - app.config の読み込み前にダミーの API キーを設定する（OpenAI API は呼ばない）
+# - retriever: 一時ディレクトリに作る RAGRetriever（埋め込みは文字 2-gram のハッシュで作る）
+
+import hashlib
+import os
+from pathlib import Path
+
+os.environ.setdefault("OPENAI_API_KEY", "sk-test")
+
+import numpy as np
+import pytest
+from chromadb.utils import embedding_functions
+
+from app import config
+from app.rag.retriever import RAGRetriever
+
+
+class FakeEmbeddingFunction(embedding_functions.EmbeddingFunction):
+    """
+    文字 2-gram をハッシュした 64 次元のベクトルを返す埋め込み関数（呼び出された本文を記録する）
+    """
+
+    def __init__(self, *args, **kwargs):
+        self.calls = []
+
+    def __call__(self, input):
+        self.calls.append(list(input))
+        vectors = []
+        for text in input:
+            v = np.zeros(64, dtype=np.float32)
+            for i in range(len(text) - 1):
+                v[int(hashlib.md5(text[i:i + 2].encode()).hexdigest(), 16) % 64] += 1
+            vectors.append(v / (np.linalg.norm(v) or 1.0))
+        return vectors
+
+    @staticmethod
+    def name():
+        return "fake"
+
+    def get_config(self):
+        return {}
+
+    @staticmethod
+    def build_from_config(config):
+        return FakeEmbeddingFunction()
+
+
+@pytest.fixture
+def retriever(tmp_path, monkeypatch):
+    for name in dir(config):
+        value = getattr(config, name)
+        if name.endswith("_PATH") and isinstance(value, Path):
+            monkeypatch.setattr(config, name, tmp_path / value.name)
+    monkeypatch.setattr(config, "CHROMA_DIR", tmp_path / "chroma_db")
+    monkeypatch.setattr(config, "DOCUMENT_STORE_DIR", tmp_path / "document_store")
+    monkeypatch.setattr(embedding_functions, "OpenAIEmbeddingFunction", FakeEmbeddingFunction)
+    r = RAGRetriever()
+    yield r
+    r.close()
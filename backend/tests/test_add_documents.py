@@ -0,0 +1,64 @@
+# backend/tests/test_add_documents.py
+# 文書の登録（RAGRetriever.add_documents）で、チャンクが書き込まれる前に全文が文書ストアで確定していることのテスト
+
+import pytest
+
+from app import config
+from app.rag import retriever as retriever_module
+from app.rag.ingest_pipeline import IngestionPipeline
+
+
+def _contract(prefix: str, articles: int) -> str:
+    lines = []
+    for n in range(1, articles + 1):
+        filler = f"{prefix}第{n}条の規定は、当事者の義務について定めるものである。"
+        lines.append(f"第{n}条（{prefix}）\n" + filler * (config.CHUNK_MAX_TOKENS // 2 // len(filler) + 1) + "\n")
+    return "".join(lines)
+
+
+@pytest.fixture
+def written(retriever, monkeypatch):
+    """
+    埋め込みを1件ずつ計算し、Chroma への書き込みを1文書より小さいバッチに分けて、
+    書き込むたびにストアから本文を読めるかを記録する
+    """
+    log = []
+
+    class SmallBatchPipeline(IngestionPipeline):
+        def __init__(self, *args, **kwargs):
+            super().__init__(*args, **{**kwargs, "batch_size": 1, "concurrency": 1, "write_batch_size": 3})
+
+        def write(self, records, embeddings):
+            log.extend((r.text, retriever._stored_text(r.metadata)) for r in records)
+            super().write(records, embeddings)
+
+    monkeypatch.setattr(retriever_module, "IngestionPipeline", SmallBatchPipeline)
+    return log
+
+
+def test_document_is_stored_before_its_chunks_are_written(retriever, written):
+    content = _contract("甲", 10)
+    assert retriever.add_document("doc1", "契約", content) == 10
+    assert len(written) == 10
+    assert all(stored == text for text, stored in written)
+
+
+def test_streamed_pages_are_stored_before_chunks_are_written(retriever, written):
+    content = _contract("乙", 8)
+    pages = (content[i:i + 500] for i in range(0, len(content), 500))
+    assert retriever.add_document("doc1", "契約", pages) == 8
+    assert all(stored == text for text, stored in written)
+    assert retriever.store.read("doc1") == content
+
+
+def test_bulk_batches_spanning_documents(retriever, written):
+    counts = retriever.add_documents([
+        ("doc1", "契約1", _contract("甲", 4), None),
+        ("doc2", "契約2", iter([_contract("乙", 5)]), None),
+        ("empty", "空", "   \n", None),
+    ])
+    assert counts == {"doc1": 4, "doc2": 5, "empty": 0}
+    assert len(written) == 9
+    assert all(stored == text for text, stored in written)
+    assert "empty" not in retriever.store
+    assert all(hit["snippet"] for hit in retriever.search("当事者の義務", n_results=9, mode="vector"))
@@ -0,0 +1,39 @@
+# backend/tests/test_answer_cache.py
+# 回答キャッシュに保存してよい結果の判定（is_cacheable）のテスト
+
+from app.agent import nodes
+from app.agent.answer_cache import is_cacheable
+from app.agent.types import AgentState
+
+
+class _BrokenRetriever:
+    def lookup_articles(self, question):
+        raise RuntimeError("chroma is down")
+
+    def search(self, query, n_results=10, mode=None):
+        raise RuntimeError("chroma is down")
+
+
+def test_rag_failure_fallback_is_not_cached(monkeypatch):
+    monkeypatch.setattr(nodes, "get_retriever", lambda: _BrokenRetriever())
+    update = nodes.run_rag_if_needed(AgentState(input="第5条の解除条件は？", intent="doc_dependent"))
+    assert update["intent"] == "general"
+    assert update["rag_error"]
+    assert not is_cacheable({"output": "一般的な回答", **update})
+
+
+def test_retriever_unavailable_fallback_is_not_cached(monkeypatch):
+    def unavailable():
+        raise RuntimeError("index not built")
+
+    monkeypatch.setattr(nodes, "get_retriever", unavailable)
+    update = nodes.run_rag_if_needed(AgentState(input="契約の解除条件は？", intent="doc_dependent"))
+    assert update["rag_error"]
+    assert not is_cacheable({"output": "一般的な回答", **update})
+
+
+def test_is_cacheable():
+    assert is_cacheable({"output": "回答", "source": "rag"})
+    assert not is_cacheable({"output": ""})
+    assert not is_cacheable({"output": "回答", "error": "timeout"})
+    assert not is_cacheable({"output": "回答", "web_search_result": [{"url": "https://example.com"}]})
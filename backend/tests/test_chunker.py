@@ -0,0 +1,110 @@
+# backend/tests/test_chunker.py
+# 構造を考慮したチャンク分割（app/rag/chunker.py）のテスト
+
+import pytest
+
+from app.rag.chunker import iter_chunks, parse_number
+from app.rag.ingest_pipeline import estimate_tokens
+
+
+CONTRACT = (
+    "業務委託契約書\n"
+    "\n"
+    "第1条（目的）\n"
+    "本契約は、業務の委託について定める。\n"
+    "第2条（定義）\n"
+    "本契約において用いる用語の定義は次のとおりとする。\n"
+    "一　「成果物」とは、納品物をいう。\n"
+    "二　「秘密情報」とは、開示された情報をいう。\n"
+    "第十二条（解除）\n"
+    + "甲は、乙が義務に違反したときは、本契約を解除できる。" * 3 + "\n"
+    "２　" + "前項の場合、甲は損害賠償を請求できる。" * 3 + "\n"
+    "３　" + "解除の通知は書面で行う。" * 4 + "\n"
+    "第5条の2（存続）\n"
+    "本条は存続する。\n"
+)
+
+
+@pytest.mark.parametrize("max_tokens", [20, 40, 60, 500])
+def test_offsets_point_back_into_source(max_tokens):
+    chunks = list(iter_chunks(CONTRACT, max_tokens=max_tokens))
+    assert chunks
+    for chunk in chunks:
+        assert CONTRACT[chunk.start:chunk.end] == chunk.text
+        assert chunk.text == chunk.text.strip()
+        assert estimate_tokens(chunk.text) <= max_tokens
+    # 順に並び、重ならない
+    for prev, cur in zip(chunks, chunks[1:]):
+        assert prev.end <= cur.start
+
+
+def test_page_iterable_gives_same_chunks_as_string():
+    pages = [CONTRACT[i:i + 37] for i in range(0, len(CONTRACT), 37)]
+    from_string = [(c.text, c.start, c.end, c.articles) for c in iter_chunks(CONTRACT, max_tokens=40)]
+    from_pages = [(c.text, c.start, c.end, c.articles) for c in iter_chunks(iter(pages), max_tokens=40)]
+    assert from_pages == from_string
+
+
+def test_small_articles_are_not_split_and_start_at_headings():
+    chunks = list(iter_chunks(CONTRACT, max_tokens=60))
+    first, second = chunks[0], chunks[1]
+    assert first.text.endswith("本契約は、業務の委託について定める。")
+    assert first.articles == [("第1条", 1)]
+    # 第2条は第1条の残りに入りきらないため、見出しから新しいチャンクを始める
+    assert second.text.startswith("第2条（定義）")
+    assert second.articles == [("第2条", 2)]
+    assert second.metadata()["article"] == "第2条"
+
+
+def test_small_sections_are_packed_together():
+    chunks = list(iter_chunks(CONTRACT, max_tokens=500))
+    assert len(chunks) == 1
+    assert [number for _, number in chunks[0].articles] == [1, 2, 12, 5]
+    meta = chunks[0].metadata()
+    assert meta["article"] == "第1条"
+    assert (meta["article_start"], meta["article_end"]) == (1, 5)
+    assert (meta["char_start"], meta["char_end"]) == (0, len(CONTRACT.rstrip()))
+
+
+def test_oversized_article_splits_at_clause_items():
+    chunks = list(iter_chunks(CONTRACT, max_tokens=60))
+    article_12 = [c for c in chunks if c.articles == [("第十二条", 12)]]
+    assert len(article_12) > 1
+    assert article_12[0].text.startswith("第十二条（解除）")
+    # 項の行頭（２　/ ３　）で新しいチャンクを始める
+    assert any(c.text.startswith("２　") for c in article_12)
+    assert any(c.text.startswith("３　") for c in article_12)
+    # 長い条の続きに次の条を混ぜない
+    assert chunks[-1].text.startswith("第5条の2")
+    assert chunks[-1].articles == [("第5条の2", 5)]
+
+
+def test_long_line_without_sentence_end_is_split_by_length():
+    text = "第1条（目的）\n" + "あ" * 95 + "\n"
+    chunks = list(iter_chunks(text, max_tokens=30))
+    assert "".join(c.text for c in chunks).replace("\n", "") == text.replace("\n", "")
+    for chunk in chunks:
+        assert text[chunk.start:chunk.end] == chunk.text
+        assert len(chunk.text) <= 30
+        assert chunk.articles == [("第1条", 1)]
+
+
+def test_markdown_heading_ends_article_range():
+    text = (
+        "第1条（目的）\n" + "本契約は、業務の委託について定める。" * 2 + "\n"
+        "## 付則\n" + "本契約は、締結日から効力を生じるものとする。" * 2 + "\n"
+    )
+    chunks = list(iter_chunks(text, max_tokens=50))
+    assert len(chunks) == 2
+    assert chunks[0].articles == [("第1条", 1)]
+    assert chunks[1].text.startswith("## 付則")
+    assert chunks[1].articles == []
+    assert "article" not in chunks[1].metadata()
+
+
+@pytest.mark.parametrize(
+    "text, expected",
+    [("12", 12), ("１２", 12), ("十二", 12), ("二十", 20), ("百五", 105), ("千二百三十四", 1234), ("甲", None)],
+)
+def test_parse_number(text, expected):
+    assert parse_number(text) == expected
@@ -0,0 +1,216 @@
+# backend/tests/test_context_packing.py
+# 検索結果の統合（RRF）と RAG コンテキストの組み立て（app/agent/context_packer.py）のテスト
+
+import pytest
+
+from app.agent.context_packer import (
+    HEADER_TOKENS,
+    drop_near_duplicates,
+    merge_adjacent,
+    pack_context,
+    truncate_to_tokens,
+)
+from app.rag.ingest_pipeline import estimate_tokens
+from app.rag.retriever import reciprocal_rank_fusion
+
+
+def _hit(chunk_id, index=None, doc="doc1", text="", start=None, end=None, score=None, article=None):
+    hit = {
+        "chunk_id": chunk_id,
+        "document_id": doc,
+        "document_title": f"{doc}.txt",
+        "snippet": text,
+        "score": score,
+        "chunk_index": index,
+        "char_start": start,
+        "char_end": end,
+    }
+    if article:
+        hit["article"] = article
+    return hit
+
+
+# ---- reciprocal_rank_fusion ----
+
+def test_rrf_top_in_every_ranking_scores_one():
+    fused = reciprocal_rank_fusion([[_hit("a"), _hit("b")], [_hit("a"), _hit("c")]], n_results=3, k=60)
+    assert [d["chunk_id"] for d in fused] == ["a", "b", "c"]
+    assert fused[0]["score"] == pytest.approx(1.0)
+    assert fused[1]["score"] == pytest.approx((1 / 62) / (2 / 61))
+
+
+def test_rrf_prefers_hits_found_by_both_searches():
+    vector = [_hit("a"), _hit("b"), _hit("c")]
+    lexical = [_hit("c"), _hit("d")]
+    fused = reciprocal_rank_fusion([vector, lexical], n_results=10, k=60)
+    # c: 1/63 + 1/61 > a: 1/61
+    assert [d["chunk_id"] for d in fused] == ["c", "a", "b", "d"]
+
+
+def test_rrf_keeps_first_ranking_fields_and_truncates():
+    vector = [_hit("a", text="ベクトル側の本文", index=3)]
+    lexical = [_hit("a", text="キーワード側の本文"), _hit("b")]
+    fused = reciprocal_rank_fusion([vector, lexical], n_results=1, k=60)
+    assert len(fused) == 1
+    assert fused[0]["snippet"] == "ベクトル側の本文"
+    assert fused[0]["chunk_index"] == 3
+
+
+def test_rrf_uses_snippet_as_key_without_chunk_id():
+    fused = reciprocal_rank_fusion(
+        [[_hit(None, text="同じ本文")], [_hit(None, text="同じ本文"), _hit(None, text="別の本文")]],
+        n_results=10,
+        k=60,
+    )
+    assert [d["snippet"] for d in fused] == ["同じ本文", "別の本文"]
+
+
+# ---- merge_adjacent ----
+
+SOURCE = "第1条　目的を定める。\n\n第2条　定義を定める。第3条　解除を定める。"
+
+
+def _span(text):
+    start = SOURCE.index(text)
+    return {"text": text, "start": start, "end": start + len(text)}
+
+
+def test_merge_adjacent_joins_consecutive_chunks_in_order():
+    c0, c1, c2 = _span("第1条　目的を定める。"), _span("第2条　定義を定める。"), _span("第3条　解除を定める。")
+    hits = [
+        _hit("c2", 2, score=0.5, article="第3条", **c2),
+        _hit("c0", 0, score=0.9, article="第1条", **c0),
+        _hit("c1", 1, score=0.7, article="第2条", **c1),
+    ]
+    passages = merge_adjacent(hits)
+    assert len(passages) == 1
+    passage = passages[0]
+    # 空白を挟むチャンクは改行で、直接続くチャンクはそのままつなぐ
+    assert passage.text == "第1条　目的を定める。\n第2条　定義を定める。第3条　解除を定める。"
+    assert passage.chunk_ids == ["c0", "c1", "c2"]
+    assert passage.articles == ["第1条", "第2条", "第3条"]
+    assert passage.rank == 0
+    assert passage.score == 0.9
+
+
+def test_merge_adjacent_removes_overlap_by_position():
+    hits = [
+        _hit("c0", 0, text="ABCDEFGH", start=0, end=8),
+        _hit("c1", 1, text="FGHIJK", start=5, end=11),
+    ]
+    assert [p.text for p in merge_adjacent(hits)] == ["ABCDEFGHIJK"]
+
+
+def test_merge_adjacent_removes_overlap_without_position():
+    hits = [_hit("c0", 0, text="甲は乙に通知する。乙は"), _hit("c1", 1, text="乙は直ちに回答する。")]
+    assert [p.text for p in merge_adjacent(hits)] == ["甲は乙に通知する。乙は直ちに回答する。"]
+
+
+def test_merge_adjacent_keeps_gaps_and_documents_apart():
+    hits = [
+        _hit("a0", 0, doc="a", text="A0"),
+        _hit("a2", 2, doc="a", text="A2"),
+        _hit("b1", 1, doc="b", text="B1"),
+        _hit("x", None, doc="a", text="番号なし"),
+    ]
+    passages = merge_adjacent(hits)
+    assert [p.text for p in passages] == ["A0", "A2", "B1", "番号なし"]
+    assert [p.rank for p in passages] == [0, 1, 2, 3]
+
+
+def test_merge_adjacent_skips_duplicate_chunk_ids():
+    hits = [_hit("c0", 0, text="本文0", start=0, end=3), _hit("c0", 0, text="本文0", start=0, end=3)]
+    passages = merge_adjacent(hits)
+    assert len(passages) == 1
+    assert passages[0].chunk_ids == ["c0"]
+
+
+# ---- drop_near_duplicates / pack_context ----
+
+def test_drop_near_duplicates_keeps_higher_ranked_passage():
+    passages = merge_adjacent([
+        _hit("a", 0, doc="a", text="甲は乙に対し、業務の対価として金銭を支払う。"),
+        _hit("b", 0, doc="b", text="業務の対価"),
+        _hit("c", 0, doc="c", text="甲は乙に対し、業務の対価として金銭を支払う"),
+        _hit("d", 0, doc="d", text="本契約の有効期間は一年とする。"),
+    ])
+    kept = drop_near_duplicates(passages, threshold=0.8)
+    assert [p.document_id for p in kept] == ["a", "d"]
+
+
+def test_pack_context_skips_passages_over_budget_but_keeps_later_ones():
+    big = "あ" * 200
+    small = "い" * 20
+    hits = [_hit("s", 0, doc="s", text=small), _hit("b", 0, doc="b", text=big), _hit("t", 0, doc="t", text="う" * 20)]
+    budget = 2 * (20 + HEADER_TOKENS) + 10
+    packed = pack_context(hits, max_tokens=budget, dedup_threshold=0.8)
+    assert [p.document_id for p in packed] == ["s", "t"]
+    assert sum(p.tokens for p in packed) <= budget
+
+
+def test_pack_context_truncates_oversized_top_passage():
+    text = "甲は乙に通知する。" * 50
+    packed = pack_context([_hit("a", 0, text=text)], max_tokens=200, dedup_threshold=0.8)
+    assert len(packed) == 1
+    assert packed[0].truncated
+    assert packed[0].tokens <= 200
+    assert packed[0].text.endswith("。…")
+
+
+def test_truncate_to_tokens_fits_budget():
+    cut = truncate_to_tokens("甲は乙に通知する。" * 20, 50)
+    assert estimate_tokens(cut) <= 50
+    assert cut.endswith("。…")
+
+
+# ---- widen_passages ----
+
+DOCUMENT = "前文。" * 20 + "第1条　目的を定める。" + "中略。" * 20 + "第2条　定義を定める。" + "後文。" * 20
+
+
+def _widen(hit, before, after):
+    start, end = max(0, hit["char_start"] - before), hit["char_end"] + after
+    text = DOCUMENT[start:end]
+    return {**hit, "snippet": text, "char_start": start, "char_end": start + len(text)}
+
+
+def _positioned_hit(chunk_id, index, text):
+    start = DOCUMENT.index(text)
+    return _hit(chunk_id, index, text=text, start=start, end=start + len(text))
+
+
+def test_pack_context_widens_passages_with_spare_budget():
+    hit = _positioned_hit("c0", 0, "第1条　目的を定める。")
+    packed = pack_context([hit], max_tokens=500, dedup_threshold=0.8, widen=_widen, widen_chars=9)
+    assert packed[0].text == "前文。前文。前文。第1条　目的を定める。中略。中略。中略。"
+    assert DOCUMENT[packed[0].char_start:packed[0].char_end] == packed[0].text
+
+
+def test_pack_context_does_not_widen_past_budget():
+    hit = _positioned_hit("c0", 0, "第1条　目的を定める。")
+    budget = estimate_tokens(hit["snippet"]) + HEADER_TOKENS + 5
+    packed = pack_context([hit], max_tokens=budget, dedup_threshold=0.8, widen=_widen, widen_chars=9)
+    assert packed[0].text == "第1条　目的を定める。"
+
+
+def test_pack_context_does_not_widen_into_another_passage():
+    hits = [
+        _positioned_hit("c0", 0, "第1条　目的を定める。"),
+        _positioned_hit("c5", 5, "第2条　定義を定める。"),
+    ]
+    # 2件目を広げると、先に広げた1件目と重なるので広げない
+    packed = pack_context(hits, max_tokens=1000, dedup_threshold=0.8, widen=_widen, widen_chars=39)
+    assert packed[0].text.startswith("前文。") and packed[0].text.endswith("中略。")
+    assert packed[1].text == "第2条　定義を定める。"
+    # 間に収まる幅なら両方広げる
+    packed = pack_context(hits, max_tokens=1000, dedup_threshold=0.8, widen=_widen, widen_chars=6)
+    assert [p.text for p in packed] == [
+        "前文。前文。第1条　目的を定める。中略。中略。",
+        "中略。中略。第2条　定義を定める。後文。後文。",
+    ]
+
+
+def test_pack_context_keeps_passages_without_positions():
+    hit = _hit("c0", 0, text="位置の記録がない本文")
+    packed = pack_context([hit], max_tokens=500, dedup_threshold=0.8, widen=_widen, widen_chars=9)
+    assert packed[0].text == "位置の記録がない本文"
@@ -0,0 +1,89 @@
+# backend/tests/test_lexical_index.py
+# キーワード検索用の索引（app/rag/lexical_index.py）のテスト
+
+import sqlite3
+
+from app.rag.ingest_pipeline import ChunkRecord
+from app.rag.lexical_index import LexicalIndex
+
+
+TEXT = "第1条（目的）本契約は業務の委託について定める。第2条（損害賠償）乙は損害を賠償する。"
+
+
+def _record(chunk_id, text, **meta):
+    start = TEXT.index(text)
+    return ChunkRecord(
+        id=chunk_id,
+        text=text,
+        metadata={"document_id": "doc1", "document_title": "契約", "char_start": start,
+                  "char_end": start + len(text), **meta},
+    )
+
+
+def _text_for(meta):
+    return TEXT[meta["char_start"]:meta["char_end"]] if meta.get("document_id") == "doc1" else None
+
+
+def _saved_texts(path):
+    with sqlite3.connect(str(path)) as conn:
+        return dict(conn.execute("SELECT chunk_id, text FROM lexical_chunks"))
+
+
+def test_text_is_not_saved_when_it_can_be_read_back(tmp_path):
+    path = tmp_path / "lexical.sqlite3"
+    index = LexicalIndex(path, text_for=_text_for)
+    index.add([
+        _record("c0", "第1条（目的）本契約は業務の委託について定める。"),
+        ChunkRecord(id="legacy", text="位置の記録がない古いチャンク", metadata={"document_id": "doc0"}),
+    ])
+    assert _saved_texts(path) == {"c0": None, "legacy": "位置の記録がない古いチャンク"}
+
+    hits = index.search("業務の委託")
+    assert hits[0]["chunk_id"] == "c0"
+    assert hits[0]["snippet"] == "第1条（目的）本契約は業務の委託について定める。"
+    index.close()
+
+
+def test_remove_after_reload_uses_saved_terms(tmp_path):
+    path = tmp_path / "lexical.sqlite3"
+    index = LexicalIndex(path, text_for=_text_for)
+    index.add([
+        _record("c0", "第1条（目的）本契約は業務の委託について定める。"),
+        _record("c1", "第2条（損害賠償）乙は損害を賠償する。"),
+    ])
+    index.close()
+
+    reloaded = LexicalIndex(path, text_for=_text_for)
+    assert reloaded.search("損害賠償")[0]["snippet"] == "第2条（損害賠償）乙は損害を賠償する。"
+    # 同じIDを置き換えると、古い本文の索引語は残らない
+    reloaded.add([_record("c1", "乙は損害を賠償する。")])
+    assert reloaded.search("損害賠償")[0]["snippet"] == "乙は損害を賠償する。"
+    assert not any(hit["chunk_id"] == "c1" for hit in reloaded.search("第2条"))
+
+    assert reloaded.remove_document("doc1") == 2
+    assert len(reloaded) == 0
+    assert reloaded._postings == {}
+    assert reloaded.search("業務") == []
+    reloaded.close()
+
+
+def test_without_text_for_keeps_text(tmp_path):
+    path = tmp_path / "lexical.sqlite3"
+    index = LexicalIndex(path)
+    index.add([_record("c0", "第1条（目的）本契約は業務の委託について定める。")])
+    assert _saved_texts(path) == {"c0": "第1条（目的）本契約は業務の委託について定める。"}
+    index.remove_document("doc1")
+    assert index._postings == {}
+    index.close()
+
+
+def test_reopened_without_text_for_returns_empty_snippets(tmp_path):
+    path = tmp_path / "lexical.sqlite3"
+    index = LexicalIndex(path, text_for=_text_for)
+    index.add([_record("c0", "第1条（目的）本契約は業務の委託について定める。")])
+    index.close()
+
+    reopened = LexicalIndex(path)
+    hits = reopened.search("業務の委託")
+    assert [(hit["chunk_id"], hit["snippet"]) for hit in hits] == [("c0", "")]
+    reopened.close()
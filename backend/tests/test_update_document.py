@@ -0,0 +1,114 @@
+# backend/tests/test_update_document.py
+# 文書の差し替え（RAGRetriever.update_document のチャンク単位の差分更新）のテスト
+
+import pytest
+
+from app import config
+
+
+def _article(number: int, body: str) -> str:
+    # 1つの条が1チャンクになるよう、トークン上限の半分を超える長さにする
+    filler = f"第{number}条の規定は、{body}について定めるものである。"
+    return f"第{number}条（{body}）\n" + filler * (config.CHUNK_MAX_TOKENS // 2 // len(filler) + 1) + "\n"
+
+
+def _chunks(retriever, doc_id):
+    got = retriever.collection.get(where={"document_id": doc_id}, include=["metadatas"])
+    rows = sorted(zip(got["ids"], got["metadatas"]), key=lambda row: row[1]["chunk_index"])
+    return [(chunk_id, meta, retriever._stored_text(meta)) for chunk_id, meta in rows]
+
+
+def _embedded_texts(retriever):
+    return [text for call in retriever.embedding_func.calls for text in call]
+
+
+def test_update_keeps_unchanged_chunks_and_embeds_only_new_ones(retriever):
+    old = _article(1, "目的") + _article(2, "定義") + _article(3, "解除")
+    retriever.add_document("doc1", "業務委託契約", old)
+    before = _chunks(retriever, "doc1")
+    assert len(before) == 3
+    retriever.embedding_func.calls.clear()
+
+    new = _article(1, "目的") + _article(2, "用語") + _article(3, "解除")
+    result = retriever.update_document("doc1", new)
+
+    assert result == {"title": "業務委託契約", "chunks": 3, "kept": 2, "added": 1, "removed": 1}
+    after = _chunks(retriever, "doc1")
+    assert [chunk_id for chunk_id, _, _ in after][0::2] == [before[0][0], before[2][0]]
+    assert after[1][0] != before[1][0]
+    # 埋め込みを計算したのは変わったチャンクだけ
+    assert _embedded_texts(retriever) == [after[1][2]]
+    assert after[1][2].startswith("第2条（用語）")
+    # 位置のメタデータは新しい全文に合っている
+    for _, meta, text in after:
+        assert new[meta["char_start"]:meta["char_end"]] == text
+
+
+def test_update_shifts_positions_of_kept_chunks(retriever):
+    old = _article(1, "目的") + _article(2, "定義")
+    retriever.add_document("doc1", "契約", old)
+    before = {chunk_id: meta for chunk_id, meta, _ in _chunks(retriever, "doc1")}
+
+    new = _article(0, "前文") + old
+    result = retriever.update_document("doc1", new)
+
+    assert (result["kept"], result["added"], result["removed"]) == (2, 1, 0)
+    after = _chunks(retriever, "doc1")
+    assert [meta["chunk_index"] for _, meta, _ in after] == [0, 1, 2]
+    for chunk_id, meta, text in after[1:]:
+        assert chunk_id in before
+        assert meta["char_start"] == before[chunk_id]["char_start"] + len(_article(0, "前文"))
+        assert meta["chunk_index"] == before[chunk_id]["chunk_index"] + 1
+        assert new[meta["char_start"]:meta["char_end"]] == text
+
+
+def test_update_drops_metadata_keys_that_are_no_longer_set(retriever):
+    content = _article(1, "目的") + _article(2, "定義")
+    retriever.add_document("doc1", "契約", content, metadata={"source_sha256": "abc"})
+    assert all(meta.get("source_sha256") == "abc" for _, meta, _ in _chunks(retriever, "doc1"))
+
+    result = retriever.update_document("doc1", content, title="新しい契約")
+
+    assert (result["kept"], result["added"], result["removed"]) == (2, 0, 0)
+    for _, meta, _ in _chunks(retriever, "doc1"):
+        assert "source_sha256" not in meta
+        assert meta["document_title"] == "新しい契約"
+
+
+def test_update_matches_duplicate_chunks_one_to_one(retriever):
+    same = _article(1, "目的")
+    retriever.add_document("doc1", "契約", same + same)
+    old_ids = [chunk_id for chunk_id, _, _ in _chunks(retriever, "doc1")]
+    assert len(old_ids) == 2
+
+    result = retriever.update_document("doc1", same + same + same)
+
+    assert (result["kept"], result["added"], result["removed"]) == (2, 1, 0)
+    new_ids = [chunk_id for chunk_id, _, _ in _chunks(retriever, "doc1")]
+    assert new_ids[:2] == old_ids
+    assert len(set(new_ids)) == 3
+
+
+def test_update_replaces_lexical_postings(retriever):
+    retriever.add_document("doc1", "契約", _article(1, "目的") + _article(2, "損害賠償"))
+    assert retriever.search("損害賠償", mode="lexical")
+
+    retriever.update_document("doc1", _article(1, "目的") + _article(2, "反社会的勢力"))
+
+    hits = retriever.search("反社会的勢力", mode="lexical")
+    assert hits and hits[0]["snippet"].startswith("第2条（反社会的勢力）")
+    assert not any("損害賠償" in hit["snippet"] for hit in retriever.search("損害賠償", mode="lexical"))
+
+
+def test_update_unknown_document_returns_none(retriever):
+    assert retriever.update_document("missing", _article(1, "目的")) is None
+
+
+def test_update_with_empty_content_keeps_old_chunks(retriever):
+    retriever.add_document("doc1", "契約", _article(1, "目的"))
+    before = _chunks(retriever, "doc1")
+
+    with pytest.raises(ValueError):
+        retriever.update_document("doc1", "   \n")
+
+    assert _chunks(retriever, "doc1") == before
@@ -28,9 +28,15 @@ const API_BASE_URL = ASK_URL.replace(/\/api\/agent\/ask$/, "");
 const DOC_REGISTER_URL = `${API_BASE_URL}/api/documents/register`;
 const DOC_UPLOAD_URL = `${API_BASE_URL}/api/documents/upload`;
 const DOC_LIST_URL = `${API_BASE_URL}/api/documents`;
+// 取り込みジョブの状態確認用URL生成関数（status_url はサーバーからの相対パス）
+const DOC_JOB_URL = (statusUrl: string) => `${API_BASE_URL}${statusUrl}`;
 // 文書削除用URL生成関数
 const DOC_DELETE_URL = (documentId: string) =>
     `${API_BASE_URL}/api/documents/${documentId}`;
+// サーバー側の会話セッション用URL（作成 / 取得・削除）
+const SESSIONS_URL = `${API_BASE_URL}/api/agent/sessions`;
+const SESSION_URL = (sessionId: string) =>
+    `${API_BASE_URL}/api/agent/sessions/${encodeURIComponent(sessionId)}`;
 
 // ==============================
 // ローカルストレージ用キー
@@ -40,6 +46,54 @@ const SESSIONS_KEY = "general-ai-agent:sessions";
 const ACTIVE_SESSION_KEY = "general-ai-agent:active-session";
 const messagesKeyFor = (sessionId: string) =>
     `general-ai-agent:messages:${sessionId}`;
+// 画面のセッションID → サーバーが発行した会話セッションID（履歴をサーバー側へ移し終えたセッション）
+const SERVER_SESSIONS_KEY = "general-ai-agent:server-sessions";
+
+const loadServerSessions = (): Record<string, string> => {
+    try {
+        const parsed = JSON.parse(localStorage.getItem(SERVER_SESSIONS_KEY) || "{}");
+        return parsed && typeof parsed === "object" && !Array.isArray(parsed) ? parsed : {};
+    } catch (e) {
+        return {};
+    }
+};
+
+const setServerSession = (sessionId: string, serverId: string | null) => {
+    const mapping = loadServerSessions();
+    if (serverId) {
+        mapping[sessionId] = serverId;
+    } else {
+        delete mapping[sessionId];
+    }
+    localStorage.setItem(SERVER_SESSIONS_KEY, JSON.stringify(mapping));
+};
+
+// サーバー側に会話セッションを作り、それまでの履歴を移す（無効なサーバーでは null）
+const createServerSession = async (history: Message[]): Promise<string | null> => {
+    try {
+        const res = await fetch(SESSIONS_URL, {
+            method: "POST",
+            headers: { "Content-Type": "application/json" },
+            body: JSON.stringify({ history }),
+        });
+        if (!res.ok) return null;
+        const data = await res.json();
+        return data.session_id || null;
+    } catch (e) {
+        console.warn("Failed to create server session:", e);
+        return null;
+    }
+};
+
+// サーバー側の会話セッションを削除（失敗しても画面の操作は続ける）
+const deleteServerSession = (sessionId: string) => {
+    const serverId = loadServerSessions()[sessionId];
+    if (!serverId) return;
+    setServerSession(sessionId, null);
+    fetch(SESSION_URL(serverId), { method: "DELETE" }).catch((e) =>
+        console.warn("Failed to delete server session:", e)
+    );
+};
 
 
 function App() {
@@ -233,6 +287,7 @@ function App() {
         } catch (e) {
             console.warn("Failed to remove messages for session:", e);
         }
+        deleteServerSession(sessionId);
 
         const remaining = sessions.filter((s) => s.id !== sessionId);
         let nextSessions;
@@ -303,6 +358,25 @@ function App() {
         }
     };
 
+    // 取り込みジョブの完了待ち（202 Accepted の場合はバックグラウンドで処理されるため）
+    const waitForIngestJob = async (res: Response) => {
+        if (res.status !== 202) return;
+        const { status_url } = await res.json();
+        while (true) {
+            await new Promise((resolve) => setTimeout(resolve, 1000));
+            const jobRes = await fetch(DOC_JOB_URL(status_url), { method: "GET" });
+            if (!jobRes.ok) {
+                const data = await jobRes.json().catch(() => ({}));
+                throw new Error(data.detail || "取り込みジョブの状態取得に失敗しました。");
+            }
+            const job = await jobRes.json();
+            if (job.status === "succeeded") return;
+            if (job.status === "failed") {
+                throw new Error(job.error || "文書の取り込みに失敗しました。");
+            }
+        }
+    };
+
     // テキスト直接登録
     const handleRegisterText = async (title: string, content: string) => {
         const res = await fetch(DOC_REGISTER_URL, {
@@ -314,6 +388,7 @@ function App() {
             const data = await res.json().catch(() => ({}));
             throw new Error(data.detail || "文書登録に失敗しました。");
         }
+        await waitForIngestJob(res);
         await fetchDocuments(); // 一覧更新
     };
 
@@ -329,6 +404,7 @@ function App() {
             const data = await res.json().catch(() => ({}));
             throw new Error(data.detail || "ファイルアップロードに失敗しました。");
         }
+        await waitForIngestJob(res);
         await fetchDocuments(); // 一覧更新
     };
 
@@ -356,37 +432,51 @@ function App() {
         setIsLoading(true);
 
         // 回答プロファイル（システムプロンプト）の適用
+        // 指示は入力とは別に送り、サーバー側の会話履歴にはユーザーの入力だけが残るようにする
         const profile = ANSWER_PROFILES[profileKey] || ANSWER_PROFILES.default;
-        let promptToSend = input;
-
-        // システムプロンプトがある場合は入力テキストに付与して送信
-        if (profile.systemPrompt) {
-            promptToSend = `
-[回答プロファイル]: ${profile.label}
-
-${profile.systemPrompt}
-
---- ユーザーからの指示 ---
-${input}
-`.trim();
-        }
+        const instructions = profile.systemPrompt
+            ? `[回答プロファイル]: ${profile.label}\n\n${profile.systemPrompt}`
+            : undefined;
 
         // ユーザー自身のメッセージ表示用（生の入力を表示）
         const userMessage: Message = { role: "user", content: input };
 
-        // API送信用の履歴作成（現在のメッセージを追加）
+        // 画面表示用の履歴（現在のメッセージを追加）
         const historyToSend = [...messages, userMessage];
 
-        try {
-            // API呼び出し
-            const res = await fetch(ASK_URL, {
+        // 会話履歴はサーバー側のセッションに保存されるため、送るのは新しい入力だけ
+        // （サーバー側のセッションが使えない場合は、従来どおり履歴を毎回送る）
+        const sessionId = activeSessionId;
+        const ask = (serverId: string | null) =>
+            fetch(ASK_URL, {
                 method: "POST",
                 headers: { "Content-Type": "application/json" },
                 body: JSON.stringify({
-                    input: promptToSend, // 実際にはプロファイル付きのテキストを送信
-                    history: historyToSend,
+                    input,
+                    instructions,
+                    session_id: serverId ?? undefined,
+                    history: serverId ? undefined : messages,
                 }),
             });
+        const openServerSession = async () => {
+            if (!sessionId) return null;
+            const serverId = await createServerSession(messages);
+            setServerSession(sessionId, serverId);
+            return serverId;
+        };
+
+        try {
+            // API呼び出し
+            let serverId = sessionId ? loadServerSessions()[sessionId] ?? null : null;
+            if (!serverId) {
+                serverId = await openServerSession();
+            }
+            let res = await ask(serverId);
+            // サーバー側のセッションが消えていた場合は、履歴を移し直して1回だけ再送する
+            if (res.status === 404 && serverId) {
+                serverId = await openServerSession();
+                res = await ask(serverId);
+            }
 
             if (!res.ok) {
                 const data = await res.json().catch(() => ({}));
@@ -428,6 +518,7 @@ ${input}
         setError("");
         if (activeSessionId) {
             localStorage.removeItem(messagesKeyFor(activeSessionId));
+            deleteServerSession(activeSessionId);
         }
     };
 